@@ -1,8 +1,13 @@
+# Example: python add_coords_corpwatch.py
+# Offline: python add_coords_corpwatch.py gazetteer.csv
+# Local Nominatim: python add_coords_corpwatch.py http://localhost:8080
 import pandas as pd
 import yaml
 from neo4j import GraphDatabase, exceptions
-import geocoder
-from time import time, sleep
+import sys
+from time import time
+from geocoding import (GeocodeCache, GazetteerProvider, OSMProvider,
+                       geocode_addresses, write_coords)
 
 
 def print_stats(session):
@@ -26,42 +31,32 @@ with open("../util/neo4j_creds.yaml", 'r') as stream:
     session = driver.session()
     print_stats(session)
 
-    step = 100
-    limit = 20000
+    if len(sys.argv) > 1 and sys.argv[1].endswith('.csv'):
+        provider = GazetteerProvider(sys.argv[1])
+    elif len(sys.argv) > 1:
+        provider = OSMProvider(url=sys.argv[1], interval=0, workers=8)
+    else:
+        provider = OSMProvider()
+    cache = GeocodeCache('./data/geocode_cache.csv')
 
     df = pd.DataFrame(
             session.run("MATCH (n:Location {source:'Corpwatch'})  "
                         "WHERE EXISTS(n.street_1) AND NOT EXISTS(n.latitude) "
                         "RETURN n.id as id, n.street_1 as street, "
-                        "n.city as city, n.postal_code as pcode "
-                        "LIMIT {}".format(limit)).data()).set_index('id')
+                        "n.city as city, n.postal_code as pcode").data(),
+            columns=['id', 'street', 'city', 'pcode']).set_index('id')
 
     df.fillna("", inplace=True)
     df['address'] = df.street + ' ' + df.city + ' ' + df.pcode
     df.address = df.address.str.replace('_', ' ')
-    df = df.address
 
-    total = 0
-    p_set = 0
-    no_null = 0
-    for i, (index, row) in enumerate(df.iteritems()):
-        if i % step == 0:
-            total += int(p_set/2)
-            print("\tRow {:,} ({:,}): Set coords for total {:,} nodes. "
-                  "True: {} Null: {}".format(i, df.shape[0], total,
-                                             int(p_set/2)-no_null, no_null))
-            p_set = 0
-            no_null = 0
-
-        j = geocoder.osm(row).json
-        if j is None:
-            j = {'lat': 0.0, 'lng': 0.0}
-            no_null += 1
-
-        q = "MERGE (n:Location {{id:'{}', source:'Corpwatch'}}) SET "\
-            "n.latitude={}, n.longitude={}".format(index, j['lat'], j['lng'])
-        p_set += session.run(q).summary().counters.properties_set
-        sleep(1)
+    t1 = time()
+    coords = geocode_addresses(df.address, provider, cache)
+    t2 = time()
+    print("Geocoded {:,} nodes ({:,} not found) in {:.2f} sec".format(
+            coords.shape[0], int(coords.lat.isna().sum()), t2-t1))
+    write_coords(session, coords)
+    print("Set coords in {:.2f} sec".format(time()-t2))
 
     print_stats(session)
     driver.close()
@@ -1,5 +1,7 @@
 from util.networkx_importer import NetworkxImporter
+from itertools import compress
 from numpy import nan
+import numpy as np
 import pandas as pd
 import networkx as nx
 
@@ -8,179 +10,252 @@ def isNaN(s):
     return s != s
 
 
+def columns(df):
+    # the values of every column, as df.iterrows() gives them in its rows,
+    # without boxing every row into a Series
+    values = df.values
+    return {col: list(values[:, j]) for j, col in enumerate(df.columns)}
+
+
+def ids(prefix, *cols):
+    # "<prefix><value>[_<value>...]" for every row, as str.format writes it
+    # (NaN included, which astype(str) keeps as NaN)
+    if len(cols) == 1:
+        return [prefix + value for value in map(str, cols[0])]
+    return [prefix + '_'.join(values) for values
+            in zip(*[map(str, col) for col in cols])]
+
+
+def ints(col):
+    return pd.Series(col, dtype=object).astype('int64').tolist()
+
+
+def present(col):
+    # the rows whose value is not NaN
+    values = np.fromiter(col, dtype=object, count=len(col))
+    return ~isNaN(values).astype(bool)
+
+
+def pick(values, select):
+    return list(compress(values, select))
+
+
+def parse_companies(df):
+    col = columns(df)
+    n = len(df)
+    rows = np.arange(n)
+    company = ids('CW_C_', col["cw_id"])
+    nodes = [(rows, company, {
+            'cw_id': col["cw_id"], 'nlabel': "Company",
+            'latest_year': col["year"], 'cik': col["cik"],
+            'irs_number': col["irs_number"], 'no_parents': col["num_parents"],
+            'no_children': col["num_children"],
+            'top_parent': col["top_parent_id"],
+            'company_name': col["company_name"], 'source': 'Corpwatch'})]
+
+    sic = present(col["sic_code"])
+    industry = ids('CW_I_', ints(pick(col["sic_code"], sic)))
+    nodes.append((rows[sic], industry, {'nlabel': 'Industry',
+                                        'source': 'Corpwatch'}))
+    edges = [(rows[sic], pick(company, sic), industry,
+              {'elabel': 'PART_OF', 'source': 'Corpwatch'})]
+    return nodes, edges
+
+
+def parse_industries(df):
+    col = columns(df)
+    rows = np.arange(len(df))
+    industry = ids('CW_I_', col["sic_code"])
+    sector = ids('CW_S_', col["sic_sector"])
+    nodes = [(rows, industry, {'sic_code': col["sic_code"],
+                               'nlabel': 'Industry',
+                               'name': col["industry_name"],
+                               'source': 'Corpwatch'}),
+             (rows, sector, {'nlabel': 'Sector', 'source': 'Corpwatch'})]
+    edges = [(rows, industry, sector, {'elabel': 'PART_OF',
+                                       'source': 'Corpwatch'})]
+    return nodes, edges
+
+
+def parse_sectors(df):
+    col = columns(df)
+    rows = np.arange(len(df))
+    sector = ids('CW_S_', col["sic_sector"])
+    group = ids('CW_SG_', col["sector_group"])
+    nodes = [(rows, sector, {'nlabel': 'Sector',
+                             'sic_sector': col["sic_sector"],
+                             'name': col["sector_name"],
+                             'source': 'Corpwatch'}),
+             (rows, group, {'nlabel': 'SectorGroup',
+                            'name': col["sector_group_name"],
+                            'sector_group': col["sector_group"],
+                            'source': 'Corpwatch'})]
+    edges = [(rows, sector, group, {'elabel': 'PART_OF',
+                                    'source': 'Corpwatch'})]
+    return nodes, edges
+
+
+def parse_countries(df):
+    col = columns(df)
+    nodes = [(np.arange(len(df)), ids('CW_CT_', col["country_code"]), {
+            'nlabel': 'Country', 'country_code': col["country_code"],
+            'country_name': col["country_name"],
+            'latitude': col["latitude"], 'longitude': col["longitude"],
+            'source': 'Corpwatch'})]
+    return nodes, []
+
+
+def parse_subdivisions(df):
+    col = columns(df)
+    rows = np.arange(len(df))
+    subdivision = ids('', col["country_code"], col["subdivision_code"])
+    country = ids('CW_CT_', col["country_code"])
+    nodes = [(rows, ['CW_SD_' + sd for sd in subdivision], {
+                    'nlabel': 'Subdivision', 'subdivision_code': subdivision,
+                    'name': col["subdivision_name"],
+                    'latitude': col["latitude"],
+                    'longitude': col["longitude"], 'source': 'Corpwatch'}),
+             (rows, country, {'nlabel': 'Country', 'source': 'Corpwatch'})]
+    edges = [(rows, nodes[0][1], country, {'elabel': 'IS_IN',
+                                           'source': 'Corpwatch'})]
+    return nodes, edges
+
+
+def parse_countries_aliases(df):
+    df = pd.DataFrame(df.groupby('country_code').country_name.agg(
+            lambda x: set(x))).reset_index(level=0)
+    col = columns(df)
+    named = present(col["country_name"])
+    nodes = [(np.arange(len(df))[named],
+              ids('CW_CT_', pick(col["country_code"], named)),
+              {'alias': pick(col["country_name"], named)})]
+    return nodes, []
+
+
+def parse_locations(df):
+    col = columns(df)
+    n = len(df)
+    rows = np.arange(n)
+    lat, long = find_coords(col, n)
+    location = ids('CW_L_', col["street_1"])
+    company = ids('CW_C_', col["cw_id"])
+    nodes = [(rows, location, {
+                    'nlabel': 'Location', 'street_1': col["street_1"],
+                    'street_2': col["street_2"], 'city': col["city"],
+                    'state': col["state"], 'postal_code': col["postal_code"],
+                    'latitude': lat, 'longitude': long,
+                    'source': 'Corpwatch'}),
+             (rows, company, {'nlabel': 'Company', 'source': 'Corpwatch'})]
+    edges = [(rows, location, company, {'elabel': 'LOCATED_AT',
+                                        'type': col['type'],
+                                        'source': 'Corpwatch'})]
+
+    subdiv = present(col["country_code"]) | present(col["subdiv_code"])
+    subdivision = ids('CW_SD_', pick(col["country_code"], subdiv),
+                      pick(col["subdiv_code"], subdiv))
+    nodes.append((rows[subdiv], subdivision, {'nlabel': 'Subdivision',
+                                              'source': 'Corpwatch'}))
+    edges.append((rows[subdiv], pick(location, subdiv), subdivision,
+                  {'elabel': 'IS_IN', 'source': 'Corpwatch'}))
+    return nodes, edges
+
+
+def parse_filers(df):
+    col = columns(df)
+    n = len(df)
+    rows = np.arange(n)
+    filer = ids('CW_F_', col["cik"])
+    nodes = [(rows, filer, {
+            'nlabel': 'Filer', 'cik': col["cik"], 'cw_id': col["cw_id"],
+            'business_phone': col["business_phone"],
+            'match_name': col["match_name"],
+            'conformed_name': col["conformed_name"],
+            'irs_number': col["irs_number"], 'source': 'Corpwatch'})]
+    edges = []
+    for prefix, zip_code in [("business_", "business_zip"),
+                             ("mail_", "mail_zip")]:
+        street = present(col[prefix+"street_1"])
+        lat, long = find_coords(col, n, prefix)
+        location = ids('CW_L_', pick(col[prefix+"street_1"], street))
+        nodes.append((rows[street], location, {
+                'nlabel': 'Location',
+                'street_1': pick(col[prefix+"street_1"], street),
+                'street_2': pick(col[prefix+"street_2"], street),
+                'city': pick(col[prefix+"city"], street),
+                'state': pick(col[prefix+"state"], street),
+                'postal_code': pick(col[zip_code], street),
+                'latitude': pick(lat, street),
+                'longitude': pick(long, street), 'source': 'Corpwatch'}))
+        edges.append((rows[street], pick(filer, street), location,
+                      {'elabel': 'LOCATED_AT', 'type': prefix[:-1],
+                       'source': 'Corpwatch'}))
+    return nodes, edges
+
+
+def parse_relationships(df):
+    col = columns(df)
+    rows = np.arange(len(df))
+    filer = ids('CW_F_', ints(col["filer_cik"]))
+    company = ids('CW_C_', col["cw_id"])
+    nodes = [(rows, filer, {'nlabel': 'Filer', 'source': 'Corpwatch'}),
+             (rows, company, {'nlabel': 'Company', 'source': 'Corpwatch'})]
+    edges = [(rows, filer, company, {'elabel': 'FILED',
+                                     'filing_id': col["filing_id"],
+                                     'source': 'Corpwatch'})]
+
+    parent = present(col["parent_cw_id"])
+    parents = ids('CW_C_', pick(col["parent_cw_id"], parent))
+    nodes.append((rows[parent], parents, {'nlabel': 'Company',
+                                          'source': 'Corpwatch'}))
+    edges.append((rows[parent], parents, pick(company, parent),
+                  {'elabel': 'PARENT',
+                   'filing_id': pick(col["filing_id"], parent),
+                   'source': 'Corpwatch'}))
+    return nodes, edges
+
+
+def find_coords(col, rows, prefix=""):
+    if prefix+'latitude' in col:
+        return (col[prefix+'latitude'], col[prefix+'longitude'])
+    return ([nan] * rows, [nan] * rows)
+
+
 class CW_NetworkxImporter(NetworkxImporter):
 
-    def __init__(self):
-        NetworkxImporter.__init__(self, 'Corpwatch')
+    def __init__(self, compact=False):
+        NetworkxImporter.__init__(self, 'Corpwatch', compact)
+
+    def insert_partition(self, nodes, edges):
+        # node and edge parts of a parsed chunk, see upsert_node_parts; the
+        # stub Company, Filer, Industry, Sector, Subdivision and Country
+        # records of the rows never clobber full ones, in whatever order
+        # they come
+        self.upsert_node_parts(nodes)
+        self.add_edge_parts(edges)
 
     def create_companies(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_C_{}".format(row["cw_id"]),
-                                cw_id=row["cw_id"], nlabel="Company",
-                                latest_year=row["year"], cik=row["cik"],
-                                irs_number=row["irs_number"],
-                                no_parents=row["num_parents"],
-                                no_children=row["num_children"],
-                                top_parent=row["top_parent_id"],
-                                company_name=row["company_name"],
-                                source='Corpwatch')
-
-            if not isNaN(row["sic_code"]):
-                self.graph.add_node("CW_I_{}".format(int(row["sic_code"])),
-                                    nlabel='Industry', source='Corpwatch')
-                self.graph.add_edge("CW_C_{}".format(row["cw_id"]),
-                                    "CW_I_{}".format(int(row["sic_code"])),
-                                    elabel='PART_OF', source='Corpwatch')
+        self.insert_partition(*parse_companies(df))
 
     def create_industries(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_I_{}".format(row["sic_code"]),
-                                sic_code=row["sic_code"], nlabel='Industry',
-                                name=row["industry_name"], source='Corpwatch')
-            self.graph.add_node("CW_S_{}".format(row["sic_sector"]),
-                                nlabel='Sector', source='Corpwatch')
-            self.graph.add_edge("CW_I_{}".format(row["sic_code"]),
-                                "CW_S_{}".format(row["sic_sector"]),
-                                elabel='PART_OF', source='Corpwatch')
+        self.insert_partition(*parse_industries(df))
 
     def create_sectors(self, df):
-        for index, row in df.iterrows():
-
-            self.graph.add_node("CW_S_{}".format(row["sic_sector"]),
-                                nlabel='Sector', sic_sector=row["sic_sector"],
-                                name=row["sector_name"], source='Corpwatch')
-            self.graph.add_node("CW_SG_{}".format(row["sector_group"]),
-                                nlabel='SectorGroup',
-                                name=row["sector_group_name"],
-                                sector_group=row["sector_group"],
-                                source='Corpwatch')
-            self.graph.add_edge("CW_S_{}".format(row["sic_sector"]),
-                                "CW_SG_{}".format(row["sector_group"]),
-                                elabel='PART_OF', source='Corpwatch')
+        self.insert_partition(*parse_sectors(df))
 
     def create_countries(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_CT_{}".format(row["country_code"]),
-                                nlabel='Country',
-                                country_code=row["country_code"],
-                                country_name=row["country_name"],
-                                latitude=row["latitude"],
-                                longitude=row["longitude"], source='Corpwatch')
+        self.insert_partition(*parse_countries(df))
 
     def create_subdivisions(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_SD_{}_{}".format(row["country_code"],
-                                row["subdivision_code"]),
-                                nlabel='Subdivision',
-                                subdivision_code="{}_{}".format(
-                                        row["country_code"],
-                                        row["subdivision_code"]),
-                                name=row["subdivision_name"],
-                                latitude=row["latitude"],
-                                longitude=row["longitude"], source='Corpwatch')
-
-            self.graph.add_node("CW_CT_{}".format(row["country_code"]),
-                                nlabel='Country', source='Corpwatch')
-            self.graph.add_edge("CW_SD_{}_{}".format(row["country_code"],
-                                row["subdivision_code"]),
-                                "CW_CT_{}".format(row["country_code"]),
-                                elabel='IS_IN', source='Corpwatch')
+        self.insert_partition(*parse_subdivisions(df))
 
     def create_countries_aliases(self, df):
-        df = pd.DataFrame(df.groupby('country_code').country_name.agg(
-                lambda x: set(x))).reset_index(level=0)
-        for index, row in df.iterrows():
-            if not isNaN(row["country_name"]):
-                self.graph.add_node("CW_CT_{}".format(row["country_code"]),
-                                    alias=row["country_name"])
+        self.insert_partition(*parse_countries_aliases(df))
 
     def create_locations(self, df):
-        for index, row in df.iterrows():
-            lat, long = self.__find_coords(row)
-            self.graph.add_node("CW_L_{}".format(row["street_1"]),
-                                nlabel='Location', street_1=row["street_1"],
-                                street_2=row["street_2"], city=row["city"],
-                                state=row["state"],
-                                postal_code=row["postal_code"],
-                                latitude=lat, longitude=long,
-                                source='Corpwatch')
-            self.graph.add_node("CW_C_{}".format(row["cw_id"]),
-                                nlabel='Company', source='Corpwatch')
-            self.graph.add_edge("CW_L_{}".format(row["street_1"]),
-                                "CW_C_{}".format(row["cw_id"]),
-                                elabel='LOCATED_AT', type=row['type'],
-                                source='Corpwatch')
-
-            if not(isNaN(row["country_code"]) and isNaN(row["subdiv_code"])):
-                self.graph.add_node("CW_SD_{}_{}".format(row["country_code"],
-                                                         row["subdiv_code"]),
-                                    nlabel='Subdivision', source='Corpwatch')
-                self.graph.add_edge("CW_L_{}".format(row["street_1"]),
-                                    "CW_SD_{}_{}".format(row["country_code"],
-                                                         row["subdiv_code"]),
-                                    elabel='IS_IN', source='Corpwatch')
+        self.insert_partition(*parse_locations(df))
 
     def create_filers(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_F_{}".format(row["cik"]), nlabel='Filer',
-                                cik=row["cik"], cw_id=row["cw_id"],
-                                business_phone=row["business_phone"],
-                                match_name=row["match_name"],
-                                conformed_name=row["conformed_name"],
-                                irs_number=row["irs_number"],
-                                source='Corpwatch')
-            if not isNaN(row["business_street_1"]):
-                lat, long = self.__find_coords(row, "business_")
-                self.graph.add_node("CW_L_{}".format(row["business_street_1"]),
-                                    nlabel='Location',
-                                    street_1=row["business_street_1"],
-                                    street_2=row["business_street_2"],
-                                    city=row["business_city"],
-                                    state=row["business_state"],
-                                    postal_code=row["business_zip"],
-                                    latitude=lat, longitude=long,
-                                    source='Corpwatch')
-                self.graph.add_edge("CW_F_{}".format(row["cik"]),
-                                    "CW_L_{}".format(row["business_street_1"]),
-                                    elabel='LOCATED_AT', type='business',
-                                    source='Corpwatch')
-            if not isNaN(row["mail_street_1"]):
-                lat, long = self.__find_coords(row, "mail_")
-                self.graph.add_node("CW_L_{}".format(row["mail_street_1"]),
-                                    nlabel='Location',
-                                    street_1=row["mail_street_1"],
-                                    street_2=row["mail_street_2"],
-                                    city=row["mail_city"],
-                                    state=row["mail_state"],
-                                    postal_code=row["mail_zip"],
-                                    latitude=lat, longitude=long,
-                                    source='Corpwatch')
-                self.graph.add_edge("CW_F_{}".format(row["cik"]),
-                                    "CW_L_{}".format(row["mail_street_1"]),
-                                    elabel='LOCATED_AT', type='mail',
-                                    source='Corpwatch')
+        self.insert_partition(*parse_filers(df))
 
     def create_relationships(self, df):
-        for index, row in df.iterrows():
-            self.graph.add_node("CW_F_{}".format(int(row["filer_cik"])),
-                                nlabel='Filer', source='Corpwatch')
-            self.graph.add_node("CW_C_{}".format(row["cw_id"]),
-                                nlabel="Company", source='Corpwatch')
-            self.graph.add_edge("CW_F_{}".format(int(row["filer_cik"])),
-                                "CW_C_{}".format(row["cw_id"]),
-                                elabel='FILED', filing_id=row["filing_id"],
-                                source='Corpwatch')
-
-            if not isNaN(row["parent_cw_id"]):
-                self.graph.add_node("CW_C_{}".format(row["parent_cw_id"]),
-                                    nlabel="Company", source='Corpwatch')
-                self.graph.add_edge("CW_C_{}".format(row["parent_cw_id"]),
-                                    "CW_C_{}".format(row["cw_id"]),
-                                    elabel='PARENT',
-                                    filing_id=row["filing_id"],
-                                    source='Corpwatch')
-
-    def __find_coords(self, row, prefix=""):
-        if prefix+'latitude' in row.index:
-            return (row[prefix+'latitude'], row[prefix+'longitude'])
-        return (nan, nan)
+        self.insert_partition(*parse_relationships(df))
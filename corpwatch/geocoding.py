@@ -0,0 +1,178 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep, time
+import pandas as pd
+
+
+def normalize_address(address):
+    # the cache key of an address: lower case, words only, single spaces
+    return ' '.join(re.sub(r'[\W_]+', ' ', address.lower()).split())
+
+
+class GeocodeCache():
+    """Append-only cache of geocoded addresses, kept as a CSV file of
+    normalized address, latitude, longitude, provider and time. Addresses
+    a provider could not find are kept too, without coordinates, so that
+    no known address is looked up again.
+    """
+
+    def __init__(self, path='./data/geocode_cache.csv'):
+        self.path = path
+        if os.path.exists(path):
+            df = pd.read_csv(path, dtype={'address': str},
+                             keep_default_na=False, na_values={'lat': [''],
+                                                               'lng': ['']})
+            self.coords = dict(zip(df.address, zip(df.lat, df.lng)))
+        else:
+            self.coords = {}
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __contains__(self, address):
+        return address in self.coords
+
+    def get(self, address):
+        # (lat, lng), or None if the address is unknown or was not found
+        coords = self.coords.get(address)
+        if coords is None or coords[0] != coords[0]:
+            return None
+        return coords
+
+    def record(self, results, provider):
+        # results: a list of (address, (lat, lng) or None)
+        if len(results) == 0:
+            return
+        df = pd.DataFrame({'address': [address for (address, _) in results],
+                           'lat': [c[0] if c else None for (_, c) in results],
+                           'lng': [c[1] if c else None for (_, c) in results],
+                           'provider': provider, 'time': int(time())})
+        folder = os.path.dirname(self.path)
+        if folder != '' and not os.path.exists(folder):
+            os.makedirs(folder)
+        df.to_csv(self.path, mode='a', header=not os.path.exists(self.path),
+                  index=False)
+        self.coords.update(zip(df.address, zip(df.lat, df.lng)))
+
+
+class OSMProvider():
+    """Geocodes with the Nominatim service of OpenStreetMap through
+    geocoder.osm, with requests at least ``interval`` seconds apart from all
+    threads, as its usage policy asks. ``url`` points it to another
+    Nominatim server, e.g. a local one, where ``interval`` can be 0 and
+    ``workers`` more than 1."""
+
+    name = 'osm'
+
+    def __init__(self, url=None, interval=1.0, workers=1):
+        self.url = url
+        self.interval = interval
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.last = 0
+
+    def __turn(self):
+        with self.lock:
+            delay = self.last + self.interval - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self.last = monotonic()
+
+    def geocode(self, address):
+        import geocoder
+        self.__turn()
+        kwargs = {} if self.url is None else {'url': self.url}
+        g = geocoder.osm(address, **kwargs)
+        if g.error:
+            # a failed request, unlike an address without results, is not
+            # cached and is tried again by the next run
+            raise OSError(g.error)
+        j = g.json
+        if j is None:
+            return None
+        return (j['lat'], j['lng'])
+
+
+class GazetteerProvider():
+    """Offline provider backed by a local gazetteer, a CSV file with the
+    columns address, lat and lng. Addresses are matched after
+    normalization; it needs no network and can run with many workers."""
+
+    name = 'gazetteer'
+    workers = 8
+
+    def __init__(self, path):
+        df = pd.read_csv(path, dtype={'address': str}, keep_default_na=False,
+                         na_values={'lat': [''], 'lng': ['']}).dropna()
+        self.coords = dict(zip(df.address.map(normalize_address),
+                               zip(df.lat, df.lng)))
+
+    def geocode(self, address):
+        return self.coords.get(normalize_address(address))
+
+
+failed = object()
+
+
+def geocode_addresses(addresses, provider, cache, batch=100):
+    """Geocodes a Series of addresses (indexed by node id) and returns a
+    DataFrame with the lat and lng of every id, NaN where the address was
+    not found; ids whose lookup failed are not in it. Identical addresses,
+    after normalization, are looked up once and only if the cache does not
+    know them; the provider is given the address as first written, and the
+    normalized one is only the key of the cache. Results are recorded in
+    the cache every ``batch`` lookups, so an interrupted run loses little."""
+    keys = addresses.map(normalize_address)
+    new = [key for key in pd.unique(keys) if key != '' and key not in cache]
+    # the first address written for every new key
+    first = ~keys.duplicated()
+    raw = dict(zip(keys[first], addresses[first]))
+    print("{:,} addresses, {:,} distinct, {:,} not in the cache".format(
+            len(keys), keys.nunique(), len(new)))
+
+    def lookup(key):
+        try:
+            return provider.geocode(raw[key])
+        except OSError as e:
+            print("\tFailed {}: {}".format(raw[key], e))
+            return failed
+
+    t1 = time()
+    with ThreadPoolExecutor(provider.workers) as pool:
+        for start in range(0, len(new), batch):
+            chunk = new[start:start+batch]
+            cache.record([(address, coords) for (address, coords)
+                          in zip(chunk, pool.map(lookup, chunk))
+                          if coords is not failed], provider.name)
+            print("\tGeocoded {:,} of {:,} addresses in {:.2f} sec".format(
+                    min(start + batch, len(new)), len(new), time()-t1))
+
+    # addresses that failed are left out, to be tried again by the next run
+    keys = keys[[key == '' or key in cache for key in keys]]
+    coords = [cache.get(key) or (None, None) for key in keys]
+    return pd.DataFrame(coords, index=keys.index, columns=['lat', 'lng'],
+                        dtype=float)
+
+
+def write_coords(session, coords, batch=10000, label='Location',
+                 source='Corpwatch'):
+    # sets the coordinates of the nodes in UNWIND batches, one transaction
+    # per batch; nodes without coordinates get 0.0, 0.0 as before, so they
+    # are not selected again
+    coords = coords.fillna(0.0)
+    rows = [{'id': i, 'lat': lat, 'lng': lng} for (i, lat, lng)
+            in zip(coords.index, coords.lat, coords.lng)]
+    query = "UNWIND $rows AS row "\
+            "MATCH (n:{} {{id: row.id, source: $source}}) "\
+            "SET n.latitude = row.lat, n.longitude = row.lng".format(label)
+    for start in range(0, len(rows), batch):
+        tx = session.begin_transaction()
+        try:
+            tx.run(query, rows=rows[start:start+batch], source=source)
+            tx.commit()
+        except Exception:
+            tx.rollback()
+            raise
+    return len(rows)
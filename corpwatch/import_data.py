@@ -1,65 +1,95 @@
+import os
+import sys
 import pandas as pd
-from corpwatch_networkx import CW_NetworkxImporter
+from corpwatch_networkx import CW_NetworkxImporter, parse_industries, \
+    parse_sectors, parse_countries, parse_subdivisions, \
+    parse_countries_aliases, parse_companies, parse_locations, \
+    parse_filers, parse_relationships
+from util.stage_scheduler import Stage, run_stages, print_report
 
 chunksize = 10000
 
-nim = CW_NetworkxImporter()
-
-print("Creating Industries")
-chunks = pd.read_csv('./data/sic_codes.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_industries(df)
-
-print("Creating Sectors")
-chunks = pd.read_csv('./data/sic_sectors.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_sectors(df.fillna(""))
-
-print("Creating Countries")
-chunks = pd.read_csv('./data/un_countries.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_countries(df.fillna(0))
-
-print("Creating Subdivisions")
-chunks = pd.read_csv('./data/un_country_subdivisions.csv', sep='\t',
-                     chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_subdivisions(df.fillna(0))
-
-print("Creating Countries Aliases")
-df = pd.read_csv('./data/un_country_aliases.csv', sep='\t')
-nim.create_countries_aliases(df)
-
-print("Creating Companies")
-chunks = pd.read_csv('./data/company_info.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    df = df[df.most_recent == 1].fillna(0).reset_index(drop=True)
-    nim.create_companies(df)
-
-print("Creating Locations")
-chunks = pd.read_csv('./data/company_locations.csv',
-                     sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    df = df[df.most_recent == 1].reset_index(drop=True)
-    nim.create_locations(df.fillna(""))
-
-print("Creating Filers")
-chunks = pd.read_csv('./data/filers.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_filers(df[~df.cik.isna()])
-
-print("Creating Relationships")
-chunks = pd.read_csv('./data/relationships.csv', sep='\t', chunksize=chunksize)
-for i, df in enumerate(chunks):
-    print("\tChunk {}".format(i))
-    nim.create_relationships(df)
-
-nim.print_statistics()
-nim.export('cw_graph.gpickle')
+
+def fill_empty(df):
+    return df.fillna("")
+
+
+def fill_zero(df):
+    return df.fillna(0)
+
+
+def recent_companies(df):
+    return df[df.most_recent == 1].fillna(0).reset_index(drop=True)
+
+
+def recent_locations(df):
+    return df[df.most_recent == 1].reset_index(drop=True).fillna("")
+
+
+def known_filers(df):
+    return df[~df.cik.isna()]
+
+
+def read_table(file, chunked=True):
+    # the chunks of a table, read lazily in the main process as the workers
+    # need them
+    path = os.path.join('./data/', file)
+    if chunked:
+        chunks = pd.read_csv(path, sep='\t', chunksize=chunksize)
+    else:
+        chunks = [pd.read_csv(path, sep='\t')]
+    for i, df in enumerate(chunks):
+        print("\t{} chunk {}".format(file, i))
+        yield df
+
+
+def parse_table(df, parse, prepare=None):
+    # runs inside a worker: the (nodes, edges) partition of a chunk of a
+    # table, to be merged into the graph in order
+    if prepare is not None:
+        df = prepare(df)
+    return parse(df)
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    # "compact" keeps the graph in a CompactGraph, into which the chunks
+    # are inserted a column at a time
+    compact = len(sys.argv) > 2 and sys.argv[2] == 'compact'
+
+    nim = CW_NetworkxImporter(compact)
+
+    def merge(partition):
+        nim.insert_partition(*partition)
+
+    tables = [('industries', 'sic_codes.csv', parse_industries, None),
+              ('sectors', 'sic_sectors.csv', parse_sectors, fill_empty),
+              ('countries', 'un_countries.csv', parse_countries, fill_zero),
+              ('subdivisions', 'un_country_subdivisions.csv',
+               parse_subdivisions, fill_zero),
+              ('countries_aliases', 'un_country_aliases.csv',
+               parse_countries_aliases, None),
+              ('companies', 'company_info.csv', parse_companies,
+               recent_companies),
+              ('locations', 'company_locations.csv', parse_locations,
+               recent_locations),
+              ('filers', 'filers.csv', parse_filers, known_filers),
+              ('relationships', 'relationships.csv', parse_relationships,
+               None)]
+
+    # the chunks of the tables are parsed by the workers a few ahead of
+    # the merges, and every table is merged after the one before it: later
+    # tables add stub nodes (and aliases) to nodes of earlier ones, and
+    # merging in this order keeps the graph, node order and attributes
+    # included, the same as a sequential import
+    stages = []
+    for (name, file, parse, prepare) in tables:
+        chunked = name != 'countries_aliases'
+        after = [stages[-1].name] if stages else []
+        stages.append(Stage(name, parse_table, (parse, prepare), merge,
+                            after, chunks=read_table(file, chunked)))
+
+    print_report(run_stages(stages, workers))
+
+    nim.print_statistics()
+    nim.export('cw_graph')
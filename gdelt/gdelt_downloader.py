@@ -1,15 +1,149 @@
+import asyncio
+import os
+import queue
+import random
+import zlib
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from io import BufferedReader, RawIOBase
+from struct import unpack
+from time import monotonic
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
 
 
-import pandas as pd
-from io import BytesIO
-from zipfile import ZipFile
-from urllib.request import urlopen
+class ZipStream():
+    """Incremental decompressor for the first member of a zip archive,
+    fed with the bytes of the archive in the order they are downloaded, so
+    the archive is never held in memory."""
+
+    def __init__(self):
+        self.header = b''
+        self.decompressor = None
+        self.remaining = None
+        self.eof = False
+
+    def feed(self, data):
+        if self.header is not None:
+            self.header += data
+            if len(self.header) < 30:
+                return b''
+            (signature, _, flags, method, _, _, _, size, _, name_length,
+             extra_length) = unpack('<IHHHHHIIIHH', self.header[:30])
+            if signature != 0x04034b50:
+                raise ValueError('Not a zip archive.')
+            start = 30 + name_length + extra_length
+            if len(self.header) < start:
+                return b''
+            data, self.header = self.header[start:], None
+            if method == 8:
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            elif method == 0 and not flags & 8:
+                self.remaining = size
+            else:
+                raise ValueError('Unsupported zip member.')
+
+        if self.eof:
+            return b''
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+            self.eof = self.decompressor.eof
+            return data
+        data = data[:self.remaining]
+        self.remaining -= len(data)
+        self.eof = self.remaining == 0
+        return data
+
+
+class Pipe(RawIOBase):
+    # file object read by the parser thread, filled from the event loop. At
+    # most maxsize chunks wait for the parser; while the queue is full the
+    # event loop polls it, so the other transfers go on, and gives up once
+    # stopped() tells that the parser is gone.
+
+    poll = 0.01
+
+    def __init__(self, stopped, maxsize=16):
+        self.chunks = queue.Queue(maxsize)
+        self.chunk = memoryview(b'')
+        self.stopped = stopped
+
+    def readable(self):
+        return True
+
+    async def __put(self, data):
+        while True:
+            try:
+                return self.chunks.put_nowait(data)
+            except queue.Full:
+                if self.stopped():
+                    return
+                await asyncio.sleep(self.poll)
+
+    async def send(self, data):
+        if len(data) > 0:
+            await self.__put(data)
+
+    async def finish(self, error=None):
+        await self.__put(error)
+
+    def readinto(self, b):
+        while len(self.chunk) == 0:
+            data = self.chunks.get()
+            if data is None:
+                self.chunks.put(None)
+                return 0
+            if isinstance(data, Exception):
+                raise data
+            self.chunk = memoryview(data)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+
+class Transfer():
+    # state of one file, kept across retries so that a retry resumes where
+    # the previous attempt stopped
+
+    def __init__(self, link, stopped):
+        self.link = link
+        self.unzip = ZipStream()
+        self.pipe = Pipe(stopped)
+        self.received = 0
+        self.out = None
+
+    async def write(self, data):
+        if self.out is not None:
+            self.out.write(data)
+        self.received += len(data)
+        await self.pipe.send(self.unzip.feed(data))
 
 
 class Downloader():
+    """Downloads and parses GDELT GKG files.
 
-    def __init__(self, links=None):
+    ``download_data`` fetches up to ``concurrency`` links at a time, with
+    requests started at least ``interval`` seconds apart. Every zip is
+    decompressed while it arrives and fed to the CSV parser, which runs in
+    a thread. Failed requests are retried ``retries`` times with an
+    exponential backoff, resuming with a range request from the last byte
+    received. If ``folder`` is given the archives are also kept there, so
+    a later run reuses the complete ones and resumes the partial ones
+    (``<name>.part``) instead of downloading them again.
+    """
+
+    def __init__(self, links=None, folder=None, concurrency=4, retries=5,
+                 backoff=2.0, interval=0.5, timeout=60):
         self.links = links
+        self.folder = folder
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.interval = interval
+        self.timeout = timeout
+        self.failed = []
         self.df = pd.DataFrame()
         self.names = ['GKGRECORDID', 'DATE', 'SOURCECOLLECTIONIDENTIFIER',
                       'SOURCECOMMONNAME', 'DOCUMENTIDENTIFIER', 'COUNTS',
@@ -31,23 +165,144 @@ class Downloader():
                               encoding="ISO-8859-1")
         return self.df
 
+    def parse(self, file):
+        df = pd.read_csv(file, sep='\t', names=self.names,
+                         usecols=self.sel_names, encoding='ISO-8859-1')
+        return df[self.sel_names]
+
     def download_data(self):
+        links = list(self.links)
+        self.failed = []
+        # the chunks are collected in link order and concatenated once
+        frames = [df for df in asyncio.run(self.__download(links))
+                  if df is not None]
+        if len(frames) > 0:
+            self.df = pd.concat(frames, ignore_index=True)
+        else:
+            self.df = pd.DataFrame(columns=self.sel_names)
+        if len(self.failed) > 0:
+            print("Failed to download {} links.".format(len(self.failed)))
+        return self.df
+
+    def write_data(self, path):
+        self.df.to_csv(path, header=True, index=False)
+
+    async def __download(self, links):
+        self.__limit = asyncio.Semaphore(self.concurrency)
+        self.__lock = asyncio.Lock()
+        self.__last = 0
+        self.__done = 0
+        self.__records = 0
+        if self.folder is not None and not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        # a parser blocks its thread while it waits for data, so parsers
+        # and network reads get separate threads
+        with ThreadPoolExecutor(self.concurrency) as self.__parsers, \
+                ThreadPoolExecutor(self.concurrency) as self.__readers:
+            return await asyncio.gather(*[self.__fetch(link, len(links))
+                                          for link in links])
+
+    async def __fetch(self, link, total):
+        async with self.__limit:
+            parse = None
+            transfer = Transfer(link, lambda: parse.done())
+            parse = asyncio.get_running_loop().run_in_executor(
+                    self.__parsers, self.parse,
+                    BufferedReader(transfer.pipe, 1 << 20))
+            try:
+                await self.__transfer(transfer, parse)
+            except (URLError, HTTPException, OSError, ValueError,
+                    zlib.error) as e:
+                await transfer.pipe.finish(e)
+            else:
+                await transfer.pipe.finish()
 
-        for i, url in enumerate(self.links):
-            zipfile = ZipFile(BytesIO(urlopen(url).read()))
             try:
-                df = pd.read_csv(zipfile.open(zipfile.namelist()[0]),
-                                 sep='\t', names=self.names,
-                                 usecols=self.sel_names, encoding='ISO-8859-1')
+                df = await parse
             except UnicodeDecodeError:
-                continue
+                print("\tSkipping {}".format(link))
+                return None
+            except (URLError, HTTPException, OSError, ValueError,
+                    zlib.error) as e:
+                print("\tFailed {}: {}".format(link, e))
+                self.failed.append(link)
+                return None
 
-            df = df[self.sel_names]
-            self.df = self.df.append(df)
-            print("Link {} out of {}.\n\t{} new records,"
-                  "total {} records.".format(i+1, self.links.shape[0],
-                                             df.shape[0], self.df.shape[0]))
-        return self.df
+        self.__done += 1
+        self.__records += df.shape[0]
+        print("Link {} out of {}.\n\t{} new records,"
+              "total {} records.".format(self.__done, total, df.shape[0],
+                                         self.__records))
+        return df
 
-    def write_data(self, path):
-        self.df.to_csv(path, header=True, index=False)
+    async def __transfer(self, transfer, parse):
+        if self.folder is None:
+            return await self.__retry(transfer, parse)
+
+        path = os.path.join(self.folder, os.path.basename(transfer.link))
+        part = path + '.part'
+        for name in [path, part]:
+            if os.path.exists(name):
+                # replays what an earlier run has already downloaded
+                with open(name, 'rb') as f:
+                    for data in iter(lambda: f.read(1 << 20), b''):
+                        await transfer.write(data)
+                if name == path:
+                    return
+                break
+
+        with open(part, 'ab') as transfer.out:
+            await self.__retry(transfer, parse)
+        if transfer.unzip.eof:
+            os.replace(part, path)
+
+    async def __retry(self, transfer, parse):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.__get(transfer, parse)
+            except (URLError, HTTPException, OSError) as e:
+                if attempt == self.retries or (
+                        isinstance(e, HTTPError) and e.code < 500
+                        and e.code != 429):
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                print("\tRetrying {} in {:.1f} sec: {}".format(
+                        transfer.link, delay, e))
+                await asyncio.sleep(delay)
+
+    async def __turn(self):
+        # requests start at least self.interval seconds apart
+        async with self.__lock:
+            delay = self.__last + self.interval - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.__last = monotonic()
+
+    async def __get(self, transfer, parse):
+        if transfer.unzip.eof:
+            return
+        await self.__turn()
+        headers = {}
+        if transfer.received > 0:
+            headers['Range'] = 'bytes={}-'.format(transfer.received)
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+                self.__readers, lambda: urlopen(
+                        Request(transfer.link, headers=headers),
+                        timeout=self.timeout))
+        with response:
+            # a server that ignores the range sends the whole file again
+            skip = transfer.received if response.status != 206 else 0
+            # a kept archive is read to the end, central directory included
+            while not parse.done() and not (transfer.unzip.eof and
+                                            transfer.out is None):
+                data = await loop.run_in_executor(self.__readers,
+                                                  response.read, 1 << 16)
+                if len(data) == 0:
+                    break
+                if skip > 0:
+                    data, skip = data[skip:], max(skip - len(data), 0)
+                await transfer.write(data)
+        if not transfer.unzip.eof and not parse.done():
+            raise ConnectionError('Connection closed after {} bytes.'.format(
+                    transfer.received))
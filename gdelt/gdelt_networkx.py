@@ -3,10 +3,9 @@ import networkx as nx
 from util.networkx_importer import NetworkxImporter
 import yaml
 from neo4j import GraphDatabase, exceptions
-import py_stringmatching as sm
-import py_stringsimjoin as ssj
-from scipy.spatial import distance
-from sklearn.cluster import KMeans
+from scipy.spatial import cKDTree
+from reference_cache import ReferenceCache, qgrams
+from qgram_index import QgramIndex
 import re
 
 
@@ -14,22 +13,128 @@ def isNaN(s):
     return s != s
 
 
+def split_column(df, col, sep=';'):
+    return df[col].dropna().astype(str).str.split(sep)
+
+
+def parse_chunk(df):
+    # Splits the delimited GKG columns of a chunk once, with pandas string
+    # operations, into node tables (indexed by node id) and edge tables
+    # (with 'from' and 'to' columns), ready for add_nodes_from/add_edges_from
+    df = df.reset_index(drop=True)
+    articles = "GD_A_" + df.GKGRECORDID.astype(str)
+    nodes = []
+    edges = []
+
+    tone = split_column(df, '5TONE', ',')
+    tone = pd.DataFrame(tone.tolist(), index=tone.index).reindex(
+            index=df.index, columns=range(7)).fillna(0)
+    nodes.append(pd.DataFrame({'nlabel': 'Article',
+                               'gkg_record_id': df.GKGRECORDID,
+                               'date': df.DATE,
+                               'source_id': df.SOURCECOLLECTIONIDENTIFIER,
+                               'source_name': df.SOURCECOMMONNAME,
+                               'document_id': df.DOCUMENTIDENTIFIER,
+                               'tone': tone[0],
+                               'positive_score': tone[1],
+                               'negative_score': tone[2],
+                               'polarity': tone[3],
+                               'activity_reference_density': tone[4],
+                               'self_group_reference_density': tone[5],
+                               'word_count': tone[6],
+                               'counts': df.COUNTS,
+                               'source': 'GDELT'}).set_index(articles))
+
+    # only the first mention of each column is kept
+    sels = [('ENHANCEDPERSONS', 'Person', "MENTIONS"),
+            ('ENHANCEDORGANIZATIONS', 'Organization', "MENTIONS")]
+    for (sel, label, edge) in sels:
+        first = split_column(df, sel).str[0].str.split(',')
+        key = first.str[0]
+        pos = first.str[1]
+        keep = key != ''
+        key, pos = key[keep], pos[keep]
+        ids = "GD_{}_".format(label[0]) + key
+
+        nodes.append(pd.DataFrame({'nlabel': label, 'name': key.values,
+                                   'source': 'GDELT'}, index=ids.values))
+        edges.append(pd.DataFrame({'from': articles.loc[key.index].values,
+                                   'to': ids.values, 'elabel': edge,
+                                   'source': 'GDELT',
+                                   'position': pos.values}))
+
+    first = split_column(df, 'ENHANCEDTHEMES').str[0].str.split(',')
+    key = first.str[0]
+    pos = first.str[1]
+    keep = key != ''
+    themes = key[keep].str.split('_').explode()
+    rank = themes.groupby(level=0).cumcount()
+    ids = "GD_T_" + themes
+    nodes.append(pd.DataFrame({'nlabel': 'Theme', 'name': themes.values,
+                               'rank': rank.values, 'source': 'GDELT'},
+                              index=ids.values))
+    edges.append(pd.DataFrame({'from': articles.loc[themes.index].values,
+                               'to': ids.values, 'elabel': 'IS_ABOUT',
+                               'source': 'GDELT',
+                               'position': pos.loc[themes.index].values}))
+
+    # articles whose location entries do not all split into the 9 fields
+    # are skipped, like before
+    locations = split_column(df, 'ENHANCEDLOCATIONS').explode()
+    fields = locations.str.count('#') + 1
+    locations = locations[fields.groupby(level=0).transform('max') == 9]
+    columns = ['Type', 'FullName', 'CountryCode', 'ADM1Code', 'ADM2Code',
+               'Latitude', 'Longitude', 'FeatureID', 'Position']
+    temp = locations.str.split('#')
+    temp = pd.DataFrame(temp.tolist(), index=temp.index).reindex(
+            columns=range(9))
+    temp.columns = columns
+    temp = temp.astype(object).where(temp.notna(), None)
+    ids = ["GD_L_{}".format(x) for x in temp.FeatureID]
+    nodes.append(pd.DataFrame({'nlabel': 'Location',
+                               'feature_id': temp.FeatureID.values,
+                               'type': temp.Type.values,
+                               'full_name': temp.FullName.values,
+                               'country_code': temp.CountryCode.values,
+                               'adm1_code': temp.ADM1Code.values,
+                               'adm2_code': temp.ADM2Code.values,
+                               'latitude': temp.Latitude.values,
+                               'longitude': temp.Longitude.values,
+                               'source': 'GDELT'}, index=ids))
+    edges.append(pd.DataFrame({'from': articles.loc[temp.index].values,
+                               'to': ids, 'elabel': 'MENTIONS',
+                               'source': 'GDELT',
+                               'position': temp.Position.values}))
+    return nodes, edges
+
+
 class GDELT_NetworkxImporter(NetworkxImporter):
 
-    def __init__(self):
-        NetworkxImporter.__init__(self, 'GDELT')
-        with open("../util/neo4j_creds.yaml", 'r') as stream:
-            try:
+    def __init__(self, cache=None, compact=False):
+        NetworkxImporter.__init__(self, 'GDELT', compact)
+        self.locations = None
+        self.names = {}
+        # snapshots of the reference entities, fetched from Neo4j only when
+        # they are missing or out of date; the session is opened by the
+        # first fetch, so runs against stored snapshots need no server
+        self.cache = cache if cache is not None else ReferenceCache()
+        self._driver = None
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            with open("../util/neo4j_creds.yaml", 'r') as stream:
                 creds = yaml.safe_load(stream)
-            except yaml.YAMLError as exc:
-                print(exc)
             self._driver = GraphDatabase.driver(creds["uri"],
                                                 auth=(creds["user"],
                                                       creds["password"]))
-            self.session = self._driver.session()
+            self._session = self._driver.session()
+        return self._session
 
     def close(self):
-        self._driver.close()
+        if self._driver is not None:
+            self._driver.close()
 
     # locations
 
@@ -38,46 +143,54 @@ class GDELT_NetworkxImporter(NetworkxImporter):
                 "MATCH (n:Location {source:'Corpwatch'}) "
                 "WHERE EXISTS(n.latitude) "
                 "RETURN n.id as id, n.latitude as lat, n.longitude as lng"
-                ).data()).set_index('id')
-
-    def filter_similar_locations(self, A, B, lim, opt):
-        C = []
-        if opt:
-            n_clusters = int(B.shape[0] * 0.1)
-            km = KMeans(n_clusters=n_clusters, random_state=1924)
-            X = km.fit_predict(B)
-            for index, a in A.iteritems():
-                keep = False
-                Y = pd.Series(km.predict(a))
-                for index1, row1 in enumerate(a):
-                    for index2, row2 in B[X == Y[index1]].iterrows():
-                        if distance.euclidean(row1, row2) < lim:
-                            C += [index]
-                            keep = True
-                            break
-                    if keep:
-                        break
-        else:
-            for index, a in A.iteritems():
-                keep = False
-                for index1, row1 in enumerate(a):
-                    for index2, row2 in B.iterrows():
-                        if distance.euclidean(row1, row2) < lim:
-                            C += [index]
-                            keep = True
-                            break
-                    if keep:
-                        break
-        return set(C)
+                ).data()).set_index('id').apply(pd.to_numeric,
+                                                errors='coerce')
+
+    def location_index(self):
+        # the Corpwatch locations come from the reference cache and are kept
+        # in a KD-tree that every chunk is queried against
+        if self.locations is None:
+            B = self.cache.get('locations', self.fetch_locations)
+            self.locations = cKDTree(B[['lat', 'lng']].dropna().values)
+        return self.locations
+
+    def filter_similar_locations(self, A, B, lim):
+        # rows of A with a point closer than lim to some point of B, found
+        # with one nearest-neighbour query for all the points of the chunk
+        if A.empty or B.n == 0:
+            return set()
+        dist, _ = B.query(A.values, k=1, distance_upper_bound=lim)
+        return set(A.index[dist < lim])
 
     def filter_locations(self, df, lim, opt):
-        A = df.ENHANCEDLOCATIONS.dropna().apply(lambda x: [
-                y.split('#')[5:7] for y in x.split(';')])
-        A = A.apply(lambda x: [[float(z) for z in y] for y in x])
-
-        B = self.fetch_locations()
-
-        return self.filter_similar_locations(A, B, lim, opt)
+        # opt used to select the approximate KMeans search; the KD-tree
+        # search is exact and is used in both cases
+        A = split_column(df, 'ENHANCEDLOCATIONS').explode()
+        A = A.str.split('#', expand=True).reindex(columns=[5, 6])
+        A = A.apply(pd.to_numeric, errors='coerce').dropna()
+
+        return self.filter_similar_locations(A, self.location_index(), lim)
+
+    # names
+
+    def name_index(self, name, fetch, lim):
+        # the q-gram index of a reference table is built once per threshold
+        # and probed by every chunk
+        if (name, lim) not in self.names:
+            B = self.cache.get(name, fetch)
+            tokens = B['tokens'] if 'tokens' in B.columns else \
+                B['name'].apply(qgrams)
+            self.names[(name, lim)] = QgramIndex(tokens, lim)
+        return self.names[(name, lim)]
+
+    def filter_names(self, df, column, index):
+        # rows with a name whose 3-gram Jaccard similarity with a reference
+        # name is at least the threshold of the index
+        A = split_column(df, column).explode().str.split(',').str[0]
+        A = A.dropna().str.lower()
+        names = pd.unique(A.values)
+        matched, _ = index.join([qgrams(name) for name in names])
+        return set(A.index[A.isin(names[matched])])
 
     # Person
 
@@ -88,22 +201,8 @@ class GDELT_NetworkxImporter(NetworkxImporter):
                 )
 
     def filter_person(self, df, lim):
-        A = df.ENHANCEDPERSONS.dropna().apply(lambda x: list(set([
-                y.split(',')[0].lower() for y in x.split(';')])))
-        A = A.apply(pd.Series).stack()
-        A.index = A.index.map(lambda i: "{}_{}".format(i[0], i[1]))
-        A = A.reset_index()
-        A.columns = ['id', 'name']
-
-        B = self.fetch_person()
-        B.name = B.name.str.replace(r'_+', ' ').str.lower()
-
-        qg3_tok = sm.QgramTokenizer(qval=3)
-        C = ssj.jaccard_join(A, B, 'id', 'id', 'name', 'name', qg3_tok, lim,
-                             l_out_attrs=['name'], r_out_attrs=['name'],
-                             show_progress=False)
-
-        return set(C.l_id.apply(lambda x: int(x.split("_")[0])))
+        return self.filter_names(df, 'ENHANCEDPERSONS', self.name_index(
+                'person', self.fetch_person, lim))
 
     # Organization
 
@@ -121,22 +220,8 @@ class GDELT_NetworkxImporter(NetworkxImporter):
         return pd.concat([A, B]).reset_index(drop=True)
 
     def filter_organization(self, df, lim):
-        A = df.ENHANCEDORGANIZATIONS.dropna().apply(lambda x: list(set([
-                y.split(',')[0].lower() for y in x.split(';')])))
-        A = A.apply(pd.Series).stack()
-        A.index = A.index.map(lambda i: "{}_{}".format(i[0], i[1]))
-        A = A.reset_index()
-        A.columns = ['id', 'name']
-
-        B = self.fetch_organization()
-        B.name = B.name.str.replace(r'_+', ' ').str.lower()
-
-        qg3_tok = sm.QgramTokenizer(qval=3)
-        C = ssj.jaccard_join(A, B, 'id', 'id', 'name', 'name', qg3_tok, lim,
-                             l_out_attrs=['name'], r_out_attrs=['name'],
-                             show_progress=False)
-
-        return set(C.l_id.apply(lambda x: int(x.split("_")[0])))
+        return self.filter_names(df, 'ENHANCEDORGANIZATIONS', self.name_index(
+                'organization', self.fetch_organization, lim))
 
     def filter_df(self, df, filter_lim):
         (lim, filters, opt) = filter_lim
@@ -161,99 +246,14 @@ class GDELT_NetworkxImporter(NetworkxImporter):
             print("{} rows passed out of {}".format(len(ind), df.shape[0]))
             df = df.loc[ind, :]
 
-        for no, (index, row) in enumerate(df.iterrows()):
-            if df.shape[0] > 1000:
-                if no % 1000 == 0:
-                    print("\tArticle {} of {}".format(no, df.shape[0]))
-            if not isNaN(row['5TONE']):
-                tone = row['5TONE'].split(',')
-            else:
-                tone = [0 for i in range(7)]
-            self.graph.add_node("GD_A_{}".format(row["GKGRECORDID"]),
-                                nlabel='Article',
-                                gkg_record_id=row['GKGRECORDID'],
-                                date=row['DATE'],
-                                source_id=row['SOURCECOLLECTIONIDENTIFIER'],
-                                source_name=row['SOURCECOMMONNAME'],
-                                document_id=row['DOCUMENTIDENTIFIER'],
-                                tone=tone[0],
-                                positive_score=tone[1],
-                                negative_score=tone[2],
-                                polarity=tone[3],
-                                activity_reference_density=tone[4],
-                                self_group_reference_density=tone[5],
-                                word_count=tone[6],
-                                counts=row['COUNTS'],
-                                source='GDELT')
-
-            sels = [('ENHANCEDPERSONS', 'Person', "MENTIONS"),
-                    ('ENHANCEDORGANIZATIONS', 'Organization', "MENTIONS")]
-
-            for (sel, label, edge) in sels:
-                if not isNaN(row[sel]):
-
-                    temp = pd.Series(row[sel].split(";")).apply(
-                                                lambda x: x.split(","))
-                    for (key, pos) in temp[:1]:
-                        if key != '':
-                            self.graph.add_node("GD_{}_{}".format(label[0],
-                                                                  key),
-                                                nlabel=label, name=key,
-                                                source='GDELT')
-                            self.graph.add_edge("GD_A_{}".format(
-                                                        row["GKGRECORDID"]),
-                                                "GD_{}_{}".format(
-                                                            label[0], key),
-                                                elabel=edge, source='GDELT',
-                                                position=pos)
-
-            sel = 'ENHANCEDTHEMES'
-
-            if not isNaN(row[sel]):
-
-                temp = pd.Series(row[sel].split(";")).apply(
-                                            lambda x: x.split(","))
-                for (key, pos) in temp[:1]:
-                    if key != '':
-                        for r_theme, theme in enumerate(key.split("_")):
-                            self.graph.add_node("GD_T_{}".format(theme),
-                                                nlabel='Theme', name=theme,
-                                                rank=r_theme, source='GDELT')
-                            self.graph.add_edge("GD_A_{}".format(
-                                                row["GKGRECORDID"]),
-                                                "GD_T_{}".format(theme),
-                                                elabel="IS_ABOUT",
-                                                source='GDELT', position=pos)
-
-            sel = "ENHANCEDLOCATIONS"
-            if not isNaN(row[sel]):
-                temp = pd.DataFrame.from_dict(
-                                dict(pd.Series(
-                                        row[sel].split(";")).apply(
-                                            lambda x: x.split("#"))),
-                                "index")
-                if temp.shape[1] != 9:
-                    continue
-
-                temp.columns = ['Type', 'FullName', 'CountryCode',
-                                'ADM1Code', 'ADM2Code', 'Latitude',
-                                'Longitude', 'FeatureID', 'Position']
-
-                for index2, row2 in temp.iterrows():
-
-                    self.graph.add_node("GD_L_{}".format(row2['FeatureID']),
-                                        nlabel='Location',
-                                        feature_id=row2['FeatureID'],
-                                        type=row2['Type'],
-                                        full_name=row2['FullName'],
-                                        country_code=row2['CountryCode'],
-                                        adm1_code=row2['ADM1Code'],
-                                        adm2_code=row2['ADM2Code'],
-                                        latitude=row2['Latitude'],
-                                        longitude=row2['Longitude'],
-                                        source='GDELT')
-                    self.graph.add_edge("GD_A_{}".format(row["GKGRECORDID"]),
-                                        "GD_L_{}".format(row2['FeatureID']),
-                                        elabel='MENTIONS', source='GDELT',
-                                        position=row2['Position'])
-
+        nodes, edges = parse_chunk(df)
+        self.insert_tables(nodes, edges)
+
+    def insert_tables(self, nodes, edges):
+        for table in nodes:
+            self.graph.add_nodes_from(zip(table.index,
+                                          table.to_dict('records')))
+        for table in edges:
+            self.graph.add_edges_from(zip(table['from'], table['to'],
+                                          table.drop(columns=['from', 'to']
+                                                     ).to_dict('records')))
@@ -12,4 +12,4 @@ for i, chunk in enumerate(df):
     nim.create_graph(chunk, (.7, '010', True))
 
 nim.print_statistics()
-nim.export('gdelt_graph.gpickle')
+nim.export('gdelt_graph')
@@ -12,7 +12,8 @@ links = links[links.str.contains("gkg").fillna(False)]
 links = links[(links >= url_prefix+'20180115') &
               (links < url_prefix+'20180118')]
 
-d = Downloader(links)
+# the archives are kept in ./data/gkg, so an interrupted run resumes
+d = Downloader(links, folder='./data/gkg')
 df = d.download_data()
 
 nim = GDELT_NetworkxImporter()
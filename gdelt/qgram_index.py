@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+eps = 1e-9
+
+
+class QgramIndex():
+    """Prefix-filtered inverted index over the q-gram sets of a reference
+    table, for Jaccard similarity searches with a fixed threshold.
+
+    Tokens are replaced by their rank in the reference, rarest first, and
+    only the prefix of every record that any match must share is indexed,
+    as in the PPJoin family of similarity joins. The posting list of a
+    token is sorted by record size, so a probe reads only the records that
+    pass the length filter. Candidates are then pruned by the position of
+    the first shared token and verified exactly, so a search returns the
+    same records as comparing the probe against every record.
+    """
+
+    def __init__(self, records, threshold):
+        self.threshold = threshold
+        records = list(records)
+        sizes = np.array([len(set(tokens)) for tokens in records],
+                         dtype=np.int64)
+        tokens = pd.Series([token for tokens in records
+                            for token in set(tokens)], dtype=object)
+        rids = np.repeat(np.arange(len(records)), sizes)
+
+        # rank of every distinct token by (frequency, token)
+        codes, uniques = pd.factorize(tokens)
+        counts = np.bincount(codes, minlength=len(uniques))
+        order = pd.DataFrame({'count': counts, 'token': uniques}).sort_values(
+                ['count', 'token']).index.values
+        rank = np.empty(len(uniques), dtype=np.int64)
+        rank[order] = np.arange(len(uniques))
+        self.ranks = dict(zip(uniques, rank))
+
+        # every record as a sorted run of ranks
+        ranks = rank[codes]
+        perm = np.lexsort((ranks, rids))
+        self.record_ranks = ranks[perm]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.sizes = sizes
+        positions = np.arange(len(perm)) - self.offsets[rids[perm]]
+
+        # postings of the prefix tokens, grouped by rank and sorted by size
+        prefix = positions < self.__prefix(sizes)[rids[perm]]
+        p_rank = self.record_ranks[prefix]
+        p_rid = rids[perm][prefix]
+        perm = np.lexsort((sizes[p_rid], p_rank))
+        self.post_rid = p_rid[perm]
+        self.post_pos = positions[prefix][perm]
+        self.post_size = sizes[self.post_rid]
+        width = self.post_size.max() + 1 if len(self.post_size) else 1
+        self.post_key = p_rank[perm] * width + self.post_size
+
+    def __prefix(self, size):
+        return size - np.ceil(self.threshold * size - eps).astype(
+                np.int64) + 1
+
+    def join(self, probes, batch=256):
+        """Jaccard join of a list of token lists against the index. Returns
+        two aligned arrays: the position of the probe and the position of
+        the record, for every pair with similarity at least the threshold.
+        The probes are handled ``batch`` at a time with array operations."""
+        probes = list(probes)
+        pairs = [self.__join(probes[i:i+batch])
+                 for i in range(0, len(probes), batch)]
+        if len(pairs) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return (np.concatenate([q + i * batch for i, (q, rid)
+                                in enumerate(pairs)]),
+                np.concatenate([rid for (q, rid) in pairs]))
+
+    def __join(self, probes):
+        t = self.threshold
+        empty = np.array([], dtype=np.int64)
+        # tokens missing from the reference rank first; they have no
+        # postings, which keeps the order consistent with the records
+        probes = [set(tokens) for tokens in probes]
+        n = np.array([len(tokens) for tokens in probes], dtype=np.int64)
+        q = np.repeat(np.arange(len(probes)), n)
+        ranks = np.array([self.ranks.get(token, -1) for tokens in probes
+                          for token in tokens], dtype=np.int64)
+        perm = np.lexsort((ranks, q))
+        ranks = ranks[perm]
+        k = np.arange(len(ranks)) - (np.cumsum(n) - n)[q]
+
+        # prefix tokens of the probes, and the slice of their posting list
+        # that passes the length filter
+        prefix = (k < self.__prefix(n)[q]) & (ranks >= 0)
+        pq, pk, pr = q[prefix], k[prefix], ranks[prefix]
+        width = self.post_size.max() + 1 if len(self.post_size) else 1
+        lo = np.searchsorted(self.post_key, pr * width + np.minimum(
+                np.ceil(t * n[pq] - eps).astype(np.int64), width), 'left')
+        hi = np.searchsorted(self.post_key, pr * width + np.minimum(
+                np.floor(n[pq] / t + eps).astype(np.int64), width - 1),
+                'right')
+        lengths = hi - lo
+        if lengths.sum() == 0:
+            return empty, empty
+        gather = np.repeat(lo - np.cumsum(lengths) + lengths,
+                           lengths) + np.arange(lengths.sum())
+        cq = np.repeat(pq, lengths)
+        ck = np.repeat(pk, lengths)
+        rid = self.post_rid[gather]
+        j = self.post_pos[gather]
+        m = self.post_size[gather]
+
+        # Position filter: if the token at k in the probe and j in the record
+        # is the first one they share, the overlap is at most
+        # 1 + min(n-k-1, m-j-1). Later shared tokens give a lower bound, so
+        # a pair may survive through its first posting only, which is enough
+        # since it is verified exactly below.
+        cn = n[cq]
+        needed = np.ceil(t / (1 + t) * (cn + m) - eps)
+        keep = 1 + np.minimum(cn - ck - 1, m - j - 1) >= needed
+        cq, rid, cn, m = cq[keep], rid[keep], cn[keep], m[keep]
+        if len(cq) == 0:
+            return empty, empty
+
+        # exact overlap of the remaining candidates: the (probe, rank) keys
+        # of the probes are already sorted, so every token of a candidate
+        # record is looked up with a binary search, in memory that does not
+        # depend on the size of the vocabulary; a pair met through several
+        # postings is verified more than once, which is cheaper than
+        # deduplicating them
+        width = len(self.ranks) + 1
+        keys = q * width + ranks + 1
+        gather = np.repeat(self.offsets[rid] - np.cumsum(m) + m,
+                           m) + np.arange(m.sum())
+        wanted = np.repeat(cq, m) * width + self.record_ranks[gather] + 1
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        hits = keys[found] == wanted
+        common = np.add.reduceat(hits.astype(np.int64), np.cumsum(m) - m)
+        match = common >= t * (cn + m - common) - eps
+        pair = np.unique(cq[match] * len(self.sizes) + rid[match])
+        return pair // len(self.sizes), pair % len(self.sizes)
+
+    def search(self, tokens):
+        # positions of the records whose Jaccard similarity with tokens is
+        # at least the threshold
+        return self.join([tokens])[1]
+
+    def matches(self, tokens):
+        return len(self.search(tokens)) > 0
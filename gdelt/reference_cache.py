@@ -0,0 +1,101 @@
+import json
+import os
+import pandas as pd
+from time import time
+
+
+def normalize(names):
+    return names.astype(str).str.replace(r'_+', ' ', regex=True).str.lower()
+
+
+def qgrams(name, q=3):
+    # padded q-grams, as py_stringmatching.QgramTokenizer(qval=q) produces
+    # them, kept as a sorted set
+    name = '#' * (q - 1) + name + '$' * (q - 1)
+    return sorted(set([name[i:i+q] for i in range(len(name) - q + 1)]))
+
+
+class ReferenceCache():
+    """Local snapshots of the reference entities that the GDELT filters
+    match against (Corpwatch locations, Wikidata persons, Corpwatch and
+    Wikidata organizations).
+
+    ``get(name, fetch)`` returns the snapshot stored in
+    ``folder/<name>.parquet`` if it is still valid, and otherwise calls
+    ``fetch()``, normalizes its result and stores it. A snapshot is valid
+    while it is younger than ``max_age`` seconds (None: no limit) and was
+    stored with the same ``version``, e.g. the date of the source dump.
+    Loaded snapshots are also kept in memory, so every chunk of a run uses
+    the same frame. Tables with a ``name`` column get it normalized and a
+    ``tokens`` column with its 3-grams.
+
+    Snapshots written by hand (for instance fixtures for offline runs) are
+    used as they are if they come with a matching ``<name>.json``.
+    """
+
+    def __init__(self, folder='./data/reference', max_age=24*60*60,
+                 version=None):
+        self.folder = folder
+        self.max_age = max_age
+        self.version = version
+        self.frames = {}
+
+    def __path(self, name, ext):
+        return os.path.join(self.folder, '{}.{}'.format(name, ext))
+
+    def is_valid(self, name):
+        try:
+            with open(self.__path(name, 'json'), 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if not os.path.exists(self.__path(name, 'parquet')):
+            return False
+        if meta.get('version') != self.version:
+            return False
+        return self.max_age is None or \
+            time() - meta.get('fetched', 0) < self.max_age
+
+    def get(self, name, fetch):
+        if name in self.frames:
+            return self.frames[name]
+        if self.is_valid(name):
+            df = pd.read_parquet(self.__path(name, 'parquet'))
+        else:
+            print("\t\tFetching reference snapshot {}".format(name))
+            df = self.store(name, fetch())
+        self.frames[name] = df
+        return df
+
+    def store(self, name, df):
+        df = df.copy()
+        if 'id' in df.columns:
+            df['id'] = df['id'].astype(str)
+        if not isinstance(df.index, pd.RangeIndex):
+            df.index = df.index.astype(str)
+        if 'name' in df.columns:
+            df = df[df['name'].notna()]
+            df['name'] = normalize(df['name'])
+            df['tokens'] = df['name'].apply(qgrams)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        df.to_parquet(self.__path(name, 'parquet'))
+        with open(self.__path(name, 'json'), 'w') as f:
+            json.dump({'fetched': time(), 'version': self.version,
+                       'rows': df.shape[0]}, f)
+        return df
+
+    def invalidate(self, name=None):
+        if name is not None:
+            names = [name]
+        elif os.path.exists(self.folder):
+            names = [os.path.splitext(file)[0]
+                     for file in os.listdir(self.folder)
+                     if file.endswith('.json')]
+        else:
+            names = []
+        for name in names:
+            self.frames.pop(name, None)
+            for ext in ['json', 'parquet']:
+                if os.path.exists(self.__path(name, ext)):
+                    os.remove(self.__path(name, ext))
@@ -1,24 +1,33 @@
 # Example: python batch.py 2020-01-01 2020-01-02
+# Parallel: python batch.py 2020-01-01 2020-01-31 32
 import os
 import sys
 from datetime import date, timedelta, datetime
 
-if len(sys.argv) == 3:
-    sdate = datetime.strptime(sys.argv[1], '%Y-%m-%d')   # start date
-    edate = datetime.strptime(sys.argv[2], '%Y-%m-%d')   # end date
-else:
-    sdate = date(2020, 1, 1)   # start date
-    edate = date(2020, 1, 1)   # end date
+if __name__ == "__main__":
+    if len(sys.argv) in (3, 4):
+        sdate = datetime.strptime(sys.argv[1], '%Y-%m-%d')   # start date
+        edate = datetime.strptime(sys.argv[2], '%Y-%m-%d')   # end date
+    else:
+        sdate = date(2020, 1, 1)   # start date
+        edate = date(2020, 1, 1)   # end date
 
-delta = edate - sdate       # as timedelta
+    delta = edate - sdate       # as timedelta
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else 1
 
-for i in range(delta.days + 1):
-    day = sdate + timedelta(days=i)
-    day = day.strftime('%Y%m%d')
-    print(day)
-    os.system('./fetch_data.sh ' + day)
-    os.system('mv ' + day + '_raw.txt ./data/')
-    os.system('python extract_data.py ' + day)
-    os.system('rm ./data/' + day + '_raw.txt')
-    os.system('rm ./data/' + day + '_graph.gpickle')
+    if workers > 1:
+        from parallel import extract_days
+        failed = extract_days([(sdate + timedelta(days=i)).strftime('%Y%m%d')
+                               for i in range(delta.days + 1)], workers)
+        sys.exit(1 if failed else 0)
+
+    for i in range(delta.days + 1):
+        day = sdate + timedelta(days=i)
+        day = day.strftime('%Y%m%d')
+        print(day)
+        os.system('./fetch_data.sh ' + day)
+        os.system('mv ' + day + '_raw.txt ./data/')
+        os.system('python extract_data.py ' + day)
+        os.system('rm ./data/' + day + '_raw.txt')
+        os.system('rm -r ./data/' + day + '_graph')
 
@@ -1,4 +1,5 @@
-from gdelt_networkx import GDELT_NetworkxImporter
+from gdelt_networkx import GDELT_NetworkxImporter, parse_chunk
+from multiprocessing import Pool
 from time import time
 import pandas as pd
 import sys
@@ -23,8 +24,9 @@ def read_data(path, chunksize):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    if len(sys.argv) not in (2, 3):
         raise ValueError("Date needed!")
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else 1
 
     t1 = time()
     nim = GDELT_NetworkxImporter()
@@ -32,16 +34,23 @@ if __name__ == "__main__":
     
     df = read_data('./data/{}_raw.txt'.format( date), chunksize=10000)
 
-    for i, chunk in enumerate(df):
-        print("Chunk {}".format(i))
-        nim.create_graph(chunk)
+    if workers > 1:
+        # chunks are parsed in parallel and merged in their original order
+        with Pool(workers) as pool:
+            for i, (nodes, edges) in enumerate(pool.imap(parse_chunk, df)):
+                print("Chunk {}".format(i))
+                nim.insert_tables(nodes, edges)
+    else:
+        for i, chunk in enumerate(df):
+            print("Chunk {}".format(i))
+            nim.create_graph(chunk)
     
     t2 = time()
     print('Elapsed {:.2f} sec'.format(t2-t1))
 
     nim.print_statistics()
     t2 = time()
-    nim.export_gpickle('./data/{}_graph.gpickle'.format(date))
+    nim.export_snapshot('./data/{}_graph'.format(date))
     t3 = time()
     print('Elapsed {:.2f} sec'.format(t3-t2))
     nim.export_filtered_csv('./data/{}_filtered.csv'.format(date))
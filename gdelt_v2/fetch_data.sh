@@ -1,18 +1,14 @@
 wget -nv http://data.gdeltproject.org/gdeltv2/masterfilelist.txt
 
-for File in $(cat masterfilelist.txt | grep '/'$1 | grep 'gkg' |  awk '{ print $3 }')
-do
-wget -nv $File
-sleep 2
-done
+# up to 4 downloads at a time; -c resumes partial files and failed
+# requests are retried with a growing wait
+cat masterfilelist.txt | grep '/'$1 | grep 'gkg' |  awk '{ print $3 }' | \
+    xargs -n 1 -P 4 wget -nv -c --tries=5 --waitretry=10 --retry-connrefused
 
 for File in $(ls *.zip)
 do
-unzip $File
+unzip -p $File >> $1"_raw.txt"
 rm $File
 done
 
-cat *.csv >> $1"_raw.txt"
-
 rm masterfilelist.txt
-rm *.csv
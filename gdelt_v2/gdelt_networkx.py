@@ -1,3 +1,4 @@
+import pickle
 import pandas as pd
 import networkx as nx
 from collections import Counter
@@ -6,66 +7,82 @@ def isNaN(s):
     return s != s
 
 
+def split_column(df, col, sep=';'):
+    return df[col].dropna().astype(str).str.split(sep)
+
+
+def parse_chunk(df):
+    # Splits the delimited GKG columns of a chunk once, with pandas string
+    # operations, into node tables (indexed by node id) and edge tables
+    # (with 'from' and 'to' columns), ready for add_nodes_from/add_edges_from
+    df = df.reset_index(drop=True)
+    articles = "A_" + df.GKGRECORDID.astype(str)
+    nodes = []
+    edges = []
+
+    tone = split_column(df, '5TONE', ',')
+    tone = pd.DataFrame(tone.tolist(), index=tone.index).reindex(
+            index=df.index, columns=range(7)).fillna(0)
+    nodes.append(pd.DataFrame({'nlabel': 'ART',
+                               'aid': df.GKGRECORDID,
+                               'url': df.DOCUMENTIDENTIFIER,
+                               'pos': tone[1],
+                               'neg': tone[2]}).set_index(articles))
+
+    sels = [('SOURCECOMMONNAME', 'SRC', "ART_SRC"),
+            ('PERSONS', 'PER', "ART_PER"),
+            ('ORGANIZATIONS', 'ORG', "ART_ORG"),
+            ('THEMES', 'THM', "ART_THM")]
+    for (sel, label, edge) in sels:
+        key = split_column(df, sel).explode()
+        key = key[key != '']
+        ids = "{}_".format(label[0]) + key
+
+        nodes.append(pd.DataFrame({'nlabel': label, 'name': key.values},
+                                  index=ids.values))
+        edges.append(pd.DataFrame({'from': articles.loc[key.index].values,
+                                   'to': ids.values, 'elabel': edge}))
+
+    # articles whose location entries do not all split into the 7 fields
+    # are skipped, like before
+    locations = split_column(df, 'LOCATIONS').explode()
+    fields = locations.str.count('#') + 1
+    locations = locations[fields.groupby(level=0).transform('max') == 7]
+    temp = locations.str.split('#')
+    temp = pd.DataFrame(temp.tolist(), index=temp.index).reindex(
+            columns=range(7))
+    temp.columns = ['Type', 'FullName', 'CountryCode', 'ADM1Code',
+                    'Latitude', 'Longitude', 'FeatureID']
+    temp = temp.astype(object).where(temp.notna(), None)
+    ids = ["L_{}".format(x) for x in temp.FeatureID]
+    nodes.append(pd.DataFrame({'nlabel': 'LOC',
+                               'lid': temp.FeatureID.values,
+                               'type': temp.Type.values,
+                               'name': temp.FullName.values,
+                               'cc': temp.CountryCode.values,
+                               'lat': temp.Latitude.values,
+                               'lon': temp.Longitude.values}, index=ids))
+    edges.append(pd.DataFrame({'from': articles.loc[temp.index].values,
+                               'to': ids, 'elabel': 'ART_LOC'}))
+    return nodes, edges
+
+
 class GDELT_NetworkxImporter():
     def __init__(self):
         self.graph = nx.MultiDiGraph()
     
     def create_graph(self, df):
-        for no, (index, row) in enumerate(df.iterrows()):
-            if df.shape[0] > 1000:
-                if no % 1000 == 0:
-                    print("\tArticle {} of {}".format(no, df.shape[0]))
-            if not isNaN(row['5TONE']):
-                tone = row['5TONE'].split(',')
-            else:
-                tone = [0 for i in range(7)]
-            self.graph.add_node("A_{}".format(row["GKGRECORDID"]),
-                                nlabel='ART',
-                                aid=row['GKGRECORDID'],
-                                url=row['DOCUMENTIDENTIFIER'],
-                                pos=tone[1],
-                                neg=tone[2])
-            
-            sels = [('SOURCECOMMONNAME', 'SRC', "ART_SRC"),
-                    ('PERSONS', 'PER', "ART_PER"),
-                    ('ORGANIZATIONS', 'ORG', "ART_ORG"),
-                    ('THEMES', 'THM', "ART_THM")]
-
-            for (sel, label, edge) in sels:
-                if not isNaN(row[sel]):
-                    temp = row[sel].split(";")
-                    for key in temp:
-                        if key == '':
-                            continue
-                        self.graph.add_node("{}_{}".format(label[0], key),
-                                            nlabel=label, name=key)
-                        self.graph.add_edge("A_{}".format(row["GKGRECORDID"]),
-                                    "{}_{}".format(label[0], key),
-                                    elabel=edge)
-            
-            sel = "LOCATIONS"
-            if not isNaN(row[sel]):
-                temp = pd.DataFrame.from_dict(
-                                dict(pd.Series(row[sel].split(";")).apply(
-                                            lambda x: x.split("#"))),"index")
+        nodes, edges = parse_chunk(df)
+        self.insert_tables(nodes, edges)
 
-                if temp.shape[1] != 7:
-                    continue
-                temp.columns = ['Type', 'FullName', 'CountryCode', 'ADM1Code',
-                                'Latitude', 'Longitude', 'FeatureID']
-
-                for index2, row2 in temp.iterrows():
-                    self.graph.add_node("L_{}".format(row2['FeatureID']),
-                                        nlabel='LOC',
-                                        lid=row2['FeatureID'],
-                                        type=row2['Type'],
-                                        name=row2['FullName'],
-                                        cc=row2['CountryCode'],
-                                        lat=row2['Latitude'],
-                                        lon=row2['Longitude'])
-                    self.graph.add_edge("A_{}".format(row["GKGRECORDID"]),
-                                        "L_{}".format(row2['FeatureID']),
-                                        elabel='ART_LOC')
+    def insert_tables(self, nodes, edges):
+        for table in nodes:
+            self.graph.add_nodes_from(zip(table.index,
+                                          table.to_dict('records')))
+        for table in edges:
+            self.graph.add_edges_from(zip(table['from'], table['to'],
+                                          table.drop(columns=['from', 'to']
+                                                     ).to_dict('records')))
 
     def print_statistics(self):
         print("Nodes:")
@@ -81,7 +98,7 @@ class GDELT_NetworkxImporter():
             print("\t{}: {:,}".format(edge,edges[edge]))
         print("Total: {:,}".format(len(self.graph.edges)))
     
-    def export_filtered_csv(self, file):
+    def export_filtered_csv(self, file, mode='w'):
         x = pd.DataFrame()
         cols = ['aid', 'url', 'pos', 'neg', 'nlabel']
         for col in cols:
@@ -99,8 +116,14 @@ class GDELT_NetworkxImporter():
         temp = temp[temp.index.map(lambda y: y.startswith("L_"))]
         x['Locations'] = pd.Series({i: list(filter(lambda z: z.startswith('L'), self.graph.neighbors(i))) for i in x.index})
         x['Locations']= x.Locations.apply(lambda y: ';'.join((temp[y].apply(lambda y: '#'.join(y.values()).replace('LOC#',''))).values))
-        x.to_csv(file, index=None, header=None)
+        x.to_csv(file, mode=mode, index=None, header=None)
     
     
     def export_gpickle(self, file):
-        nx.write_gpickle(self.graph, file)
+        with open(file, 'wb') as f:
+            pickle.dump(self.graph, f, pickle.HIGHEST_PROTOCOL)
+
+    def export_snapshot(self, path):
+        # versioned snapshot directory, see util/graph_snapshot.py
+        from util.graph_snapshot import write_snapshot
+        write_snapshot(self.graph, path)
@@ -0,0 +1,228 @@
+# Example: python incremental.py 2019-04-01
+# Parallel: python incremental.py 2019-04-01 8
+# Processes only the GKG files of masterfilelist.txt from the given date on
+# that are not in the ledger yet, so it can run from cron every 15 minutes.
+import fcntl
+import os
+import sys
+from datetime import datetime
+from multiprocessing import Pool
+from time import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from zipfile import BadZipFile
+import pandas as pd
+from gdelt_networkx import GDELT_NetworkxImporter
+from parallel import url_prefix, parse_link, imap_window
+
+
+class Ledger():
+    """Append-only record of the masterfilelist.txt entries already
+    processed (link, size, md5 and the time they were processed), kept as a
+    CSV file. An entry is new if its link is not in the ledger, or is there
+    with another checksum because GDELT republished the file.
+    """
+
+    def __init__(self, path='./data/ledger.csv'):
+        self.path = path
+        if os.path.exists(path):
+            df = pd.read_csv(path, dtype={'link': str, 'md5': str})
+            self.entries = dict(zip(df.link, df.md5))
+        else:
+            self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def new(self, entries):
+        return entries[entries.Link.map(self.entries.get) != entries.Hash]
+
+    def record(self, entries):
+        df = pd.DataFrame({'link': entries.Link, 'size': entries.Size,
+                           'md5': entries.Hash, 'processed': int(time())})
+        df.to_csv(self.path, mode='a', header=not os.path.exists(self.path),
+                  index=False)
+        self.entries.update(zip(df.link, df.md5))
+
+
+class MasterList():
+    """Reads masterfilelist.txt from where the previous run stopped. The
+    file at ``path`` keeps the byte offset up to which every GKG entry was
+    processed and the line that ends there; a run requests only the bytes
+    from that line on, and reads the whole list again if the server ignores
+    the range or the line is not there any more.
+    """
+
+    def __init__(self, source=url_prefix + 'masterfilelist.txt',
+                 path='./data/masterfilelist.pos'):
+        self.source = source
+        self.path = path
+        self.offset = 0
+        self.last = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                offset, self.last = f.read().split(b' ', 1)
+            self.offset = int(offset)
+
+    def __fetch(self):
+        # the offset of the first new byte of the list and the bytes from it
+        if self.offset > 0:
+            start = self.offset - len(self.last)
+            request = Request(self.source, headers={
+                    'Range': 'bytes={}-'.format(start)})
+            try:
+                with urlopen(request) as response:
+                    data = response.read()
+                    status = response.status
+            except HTTPError as e:
+                if e.code != 416:
+                    raise
+            else:
+                if status != 206:
+                    return 0, data
+                if data.startswith(self.last):
+                    return self.offset, data[len(self.last):]
+        with urlopen(self.source) as response:
+            return 0, response.read()
+
+    def entries(self, since):
+        # GKG entries of the new lines from the day since (YYYYMMDD) on, in
+        # publication order, with the offsets where their lines start and
+        # end; a line still being written is left for the next run
+        start, data = self.__fetch()
+        self.data = data[:data.rfind(b'\n') + 1]
+        self.start = start
+        rows = []
+        end = start
+        for line in self.data.split(b'\n')[:-1]:
+            end += len(line) + 1
+            fields = line.decode('utf-8').split(' ')
+            if len(fields) == 3 and 'gkg' in fields[2]:
+                rows.append(fields + [end - len(line) - 1, end])
+        entries = pd.DataFrame(rows, columns=['Size', 'Hash', 'Link',
+                                              'Start', 'End'])
+        day = entries.Link.str.rsplit('/', n=1).str[-1].str[:8]
+        entries = entries.assign(Size=entries.Size.astype('int64'), Day=day)
+        return entries[entries.Day >= since].sort_values('Link')
+
+    def save(self, offset):
+        # records that every entry before offset, one of the offsets of the
+        # lines read by entries(), is processed
+        if offset <= self.start:
+            return
+        line = self.data[:offset - self.start]
+        line = line[line.rfind(b'\n', 0, len(line) - 1) + 1:]
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write('{} '.format(offset).encode('utf-8') + line)
+        os.replace(self.path + '.tmp', self.path)
+        self.offset, self.last = offset, line
+
+
+def parse_entry(entry):
+    # runs inside a worker; a file that fails is left out of the ledger and
+    # tried again by the next run
+    link, size, md5 = entry
+    try:
+        return parse_link(link, size, md5)
+    except (OSError, ValueError, BadZipFile) as e:
+        print("\tFailed {}: {}".format(link, e))
+        return None
+
+
+def write_part(tables, path):
+    # the articles of one file, written under a temporary name and renamed,
+    # so a part is either complete or missing
+    nim = GDELT_NetworkxImporter()
+    nim.insert_tables(*tables)
+    if nim.graph.number_of_nodes() > 0:
+        nim.export_filtered_csv(path + '.tmp')
+    else:
+        open(path + '.tmp', 'w').close()
+    os.replace(path + '.tmp', path)
+
+
+def write_day(parts, path):
+    # the filtered file of a day, rebuilt from the parts of its files in
+    # link order and renamed into place
+    with open(path + '.tmp', 'wb') as out:
+        for name in sorted(os.listdir(parts)):
+            if name.endswith('.csv'):
+                with open(os.path.join(parts, name), 'rb') as f:
+                    out.write(f.read())
+    os.replace(path + '.tmp', path)
+
+
+def extract_new(since, workers=1, folder='./data',
+                source=url_prefix + 'masterfilelist.txt'):
+    # writes the articles of every new file to ./data/<date>_parts/, one
+    # part per file, and rebuilds ./data/<date>_filtered.csv from the parts
+    # of the day before the files are recorded in the ledger. A republished
+    # file replaces its part, and a run that dies before recording its
+    # files only writes the same parts again, so no article is written
+    # twice. Returns the number of files processed.
+    # the lock is held on the open file, so the system releases it when a
+    # run dies, and the file itself is left in place
+    lock = open(os.path.join(folder, 'ledger.lock'), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Another run holds {}".format(lock.name))
+        lock.close()
+        return 0
+
+    pool = None
+    try:
+        ledger = Ledger(os.path.join(folder, 'ledger.csv'))
+        master = MasterList(source, os.path.join(folder,
+                                                 'masterfilelist.pos'))
+        entries = ledger.new(master.entries(since))
+        print("{} new files, {} in the ledger".format(len(entries),
+                                                     len(ledger)))
+        tasks = list(zip(entries.Link, entries.Size, entries.Hash))
+        if workers > 1 and len(tasks) > 1:
+            pool = Pool(workers)
+            results = imap_window(pool, parse_entry, tasks, 2 * workers)
+        else:
+            results = map(parse_entry, tasks)
+
+        processed = 0
+        # the list is read again from the first file that failed
+        offset = master.start + len(master.data)
+        for day, group in entries.groupby('Day', sort=True):
+            t1 = time()
+            parts = os.path.join(folder, '{}_parts'.format(day))
+            if not os.path.exists(parts):
+                os.makedirs(parts)
+            done = []
+            for link, start in zip(group.Link, group.Start):
+                tables = next(results)
+                if tables is None:
+                    offset = min(offset, start)
+                    continue
+                write_part(tables, os.path.join(
+                        parts, os.path.basename(link) + '.csv'))
+                done.append(link)
+
+            if len(done) > 0:
+                write_day(parts, os.path.join(
+                        folder, '{}_filtered.csv'.format(day)))
+            ledger.record(group[group.Link.isin(done)])
+            processed += len(done)
+            print("{}: {} of {} files in {:.2f} sec".format(
+                    day, len(done), len(group), time()-t1))
+        master.save(offset)
+        return processed
+    finally:
+        if pool is not None:
+            pool.terminate()
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        since = datetime.strptime(sys.argv[1], '%Y-%m-%d').strftime('%Y%m%d')
+    else:
+        since = datetime.utcnow().strftime('%Y%m%d')
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    extract_new(since, workers)
@@ -0,0 +1,116 @@
+from gdelt_networkx import GDELT_NetworkxImporter, parse_chunk
+from extract_data import read_data
+from collections import deque
+from multiprocessing import Pool
+from io import BytesIO
+from zipfile import BadZipFile, ZipFile
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from time import sleep, time
+import hashlib
+import pandas as pd
+
+url_prefix = 'http://data.gdeltproject.org/gdeltv2/'
+
+
+def fetch_links(days):
+    links = pd.read_csv(urlopen(url_prefix + 'masterfilelist.txt'), sep=' ',
+                        names=['Size', 'Hash', 'Link']).Link.dropna()
+    links = links[links.str.contains('gkg')]
+    return {day: sorted(links[links.str.startswith(url_prefix + day)])
+            for day in days}
+
+
+def fetch_link(link, size=None, md5=None, timeout=60, retries=3,
+               backoff=5):
+    # downloads one file, tried up to retries more times, backoff, 2 *
+    # backoff, ... seconds apart, if the request fails, times out or the
+    # data does not match size and md5; a 4xx response is not retried
+    for attempt in range(retries + 1):
+        try:
+            data = urlopen(link, timeout=timeout).read()
+            if (size is not None and len(data) != size) or \
+                    (md5 is not None and
+                     hashlib.md5(data).hexdigest() != md5):
+                raise ValueError("Checksum mismatch for {}".format(link))
+            return data
+        except (OSError, ValueError) as e:
+            if attempt == retries or \
+                    (isinstance(e, HTTPError) and 400 <= e.code < 500):
+                raise
+            sleep(backoff * 2 ** attempt)
+
+
+def parse_link(link, size=None, md5=None):
+    # runs inside a worker: fetches one 15-minute GKG file and returns its
+    # node and edge tables; size and md5, as listed in masterfilelist.txt,
+    # are checked when given
+    data = fetch_link(link, size, md5)
+    zipfile = ZipFile(BytesIO(data))
+    df = read_data(zipfile.open(zipfile.namelist()[0]), None)
+    return parse_chunk(df)
+
+
+def try_link(link):
+    # runs inside a worker: the tables of a file, or None if it failed, so
+    # one bad file does not stop the other days
+    try:
+        return parse_link(link)
+    except (OSError, ValueError, BadZipFile) as e:
+        print("\tFailed {}: {}".format(link, e))
+        return None
+
+
+def imap_window(pool, func, tasks, window):
+    # pool.imap with backpressure: the results in input order, with at most
+    # window tasks submitted ahead of the one the caller waits for, so the
+    # parsed tables of later days do not pile up while a day is merged
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def extract_days(days, workers):
+    # fans every GKG file of every day out to the pool; imap_window keeps
+    # the input order, so the partials of each day are merged in file order and the
+    # output does not depend on the number of workers. Each day is written
+    # from the files that succeeded and the failed ones are listed at the
+    # end (and returned) to be fetched again.
+    links = fetch_links(days)
+    tasks = [link for day in days for link in links[day]]
+    print("{} files for {} days on {} workers".format(len(tasks), len(days),
+                                                     workers))
+
+    with Pool(workers) as pool:
+        results = imap_window(pool, try_link, tasks, 2 * workers)
+        failed = []
+        for day in days:
+            t1 = time()
+            print(day)
+            nim = GDELT_NetworkxImporter()
+            for i, link in enumerate(links[day]):
+                print("\tFile {} of {}".format(i+1, len(links[day])))
+                tables = next(results)
+                if tables is None:
+                    failed.append(link)
+                    continue
+                nim.insert_tables(*tables)
+
+            if nim.graph.number_of_nodes() == 0:
+                print("\tNo data for {}".format(day))
+                continue
+            nim.print_statistics()
+            nim.export_filtered_csv('./data/{}_filtered.csv'.format(day))
+            t2 = time()
+            print('Elapsed {:.2f} sec'.format(t2-t1))
+
+    if failed:
+        print("{} files failed, their days are incomplete:".format(
+                len(failed)))
+        for link in failed:
+            print("\t{}".format(link))
+    return failed
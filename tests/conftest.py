@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules are imported as util.<module>, and the scripts of each dataset
+# folder by their own name, as when they are run from the repository
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from numpy import nan
+from util.compact_graph import Column, CompactGraph, missing
+from util.indexed_graph import IndexedMultiDiGraph
+
+
+@pytest.mark.parametrize('cls', [CompactGraph, IndexedMultiDiGraph])
+def test_counts_of_missing_and_none(cls):
+    graph = cls()
+    graph.add_node('a', source=None)
+    graph.add_node('b', source=None)
+    graph.add_node('c')
+    graph.add_node('d', nlabel=None)
+    graph.add_node('e', nlabel='X', source=None)
+    graph.add_node('f', nlabel='X')
+    graph.add_edge('a', 'c', elabel='E', source=None)
+    graph.add_edge('b', 'c', elabel='E')
+
+    assert graph.count_nodes(None, None) == 4
+    assert graph.count_nodes(None, 'X') == 2
+    assert graph.count_edges(None, 'E', None, None) == 2
+
+
+def values_of(column):
+    # the values of a column with their types, NaN made comparable
+    return [('nan', float) if value != value else (value, type(value))
+            for value in map(column.get, range(len(column)))]
+
+
+@pytest.mark.parametrize('batches', [
+    [[1, 2, np.int64(3)], [4, None, missing]],
+    [[1.5, nan, None, missing], [2.0, np.float64(3.5)]],
+    [['a', 'b', 'a', None], ['c', nan]],
+    [[1, 2], [1.5, 'x'], [True, None]],
+    [['s{}'.format(i) for i in range(1500)], ['é', 't', missing]],
+])
+def test_column_extend_and_update_match_append_and_set(batches):
+    extended, appended = Column(), Column()
+    for batch in batches:
+        extended.extend(batch)
+        for value in batch:
+            appended.append(value)
+    assert values_of(extended) == values_of(appended)
+    assert extended.kind == appended.kind
+
+    rows = list(range(0, len(appended), 2))
+    values = [batches[0][i % len(batches[0])] for i in range(len(rows))]
+    extended.update(np.array(rows), values)
+    for row, value in zip(rows, values):
+        appended.set(row, value)
+    assert values_of(extended) == values_of(appended)
@@ -0,0 +1,112 @@
+import os
+import sys
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'corpwatch'))
+from corpwatch_networkx import CW_NetworkxImporter, ids  # noqa: E402
+
+
+def maybe(random, values, p=.3):
+    values = pd.Series(values, dtype=object)
+    values[random.rand(len(values)) < p] = np.nan
+    return values
+
+
+def tables(n=300):
+    r = np.random.RandomState(0)
+    companies = pd.DataFrame({
+            'cw_id': r.randint(1, n, n), 'year': r.randint(2000, 2020, n),
+            'cik': maybe(r, r.randint(1, n, n).astype(float)),
+            'irs_number': maybe(r, ['%09d' % x for x in r.randint(0, 99, n)]),
+            'num_parents': r.randint(0, 3, n),
+            'num_children': r.randint(0, 9, n),
+            'top_parent_id': r.randint(1, n, n),
+            'company_name': ['Company %d' % x for x in r.randint(0, n, n)],
+            'sic_code': maybe(r, r.randint(100, 120, n).astype(float))})
+    locations = pd.DataFrame({
+            'cw_id': r.randint(1, n, n),
+            'type': r.choice(['business', 'mail'], n),
+            'street_1': ['%d Main St' % x for x in r.randint(0, n, n)],
+            'street_2': maybe(r, ['Suite %d' % x for x in range(n)], .7),
+            'city': r.choice(['NY', 'LA'], n), 'state': 'NY',
+            'postal_code': maybe(r, r.randint(10000, 10100, n).astype(str)),
+            'country_code': maybe(r, r.choice(['US', 'GR'], n)),
+            'subdiv_code': maybe(r, r.choice(['NY', 'CA'], n))})
+    filers = pd.DataFrame({
+            'cik': r.randint(1, n, n).astype(float),
+            'cw_id': r.randint(1, n, n),
+            'business_phone': maybe(r, ['555-%04d' % x for x in range(n)]),
+            'match_name': ['m %d' % x for x in range(n)],
+            'conformed_name': ['C %d' % x for x in range(n)],
+            'irs_number': maybe(r, r.randint(0, 99, n).astype(float)),
+            'business_street_1': maybe(r, ['%d Main St' % x for x
+                                           in r.randint(0, n, n)]),
+            'business_street_2': np.nan, 'business_city': 'NY',
+            'business_state': 'NY', 'business_zip': '10001',
+            'mail_street_1': maybe(r, ['%d Main St' % x for x
+                                       in r.randint(0, n, n)]),
+            'mail_street_2': 'x', 'mail_city': 'LA', 'mail_state': 'CA',
+            'mail_zip': maybe(r, ['90001'] * n)})
+    relationships = pd.DataFrame({
+            'filer_cik': r.randint(1, n, n).astype(float),
+            'cw_id': r.randint(1, n, n),
+            'parent_cw_id': maybe(r, r.randint(1, n, n).astype(float), .5),
+            'filing_id': r.randint(1, 10**6, n)})
+    return companies, locations, filers, relationships
+
+
+def normalized(value):
+    if isinstance(value, float) and value != value:
+        return 'nan'
+    return (value, type(value))
+
+
+def load(compact):
+    nim = CW_NetworkxImporter(compact)
+    companies, locations, filers, relationships = tables()
+    for i in range(0, 300, 100):
+        nim.create_companies(companies[i:i + 100].reset_index(drop=True))
+    nim.create_locations(locations)
+    nim.create_filers(filers)
+    for i in range(0, 300, 100):
+        nim.create_relationships(
+                relationships[i:i + 100].reset_index(drop=True))
+    graph = nim.graph
+    nodes = [(node, {key: normalized(value) for key, value in attr.items()})
+             for node, attr in graph.nodes.data()]
+    edges = Counter((u, v, tuple(sorted((key, normalized(value))
+                                        for key, value in attr.items())))
+                    for u, v, attr in graph.edges.data())
+    return nodes, edges, nim.stubs
+
+
+def test_ids_format_nan_as_str_format_does():
+    assert ids('CW_SD_', [np.nan, 'US'], ['NY', np.nan]) == \
+        ['CW_SD_nan_NY', 'CW_SD_US_nan']
+    assert ids('CW_F_', [1.0, 2]) == ['CW_F_1.0', 'CW_F_2']
+
+
+def test_compact_columns_match_networkx():
+    assert load(True) == load(False)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_stub_parts_never_clobber(compact):
+    nim = CW_NetworkxImporter(compact)
+    nim.graph.add_node('a', nlabel='Company', name='A')
+    rows = np.arange(3)
+    nim.upsert_node_parts([
+            (rows, ['a', 'b', 'c'], {'nlabel': 'Filer',
+                                     'source': 'Corpwatch'}),
+            (rows[1:], ['b', 'b'], {'nlabel': 'Filer', 'name': ['B', 'B2'],
+                                    'source': 'Corpwatch'})])
+    assert dict(nim.graph.nodes['a']) == {'nlabel': 'Company', 'name': 'A',
+                                          'source': 'Corpwatch'}
+    assert dict(nim.graph.nodes['b']) == {'nlabel': 'Filer', 'name': 'B2',
+                                          'source': 'Corpwatch'}
+    assert list(nim.graph.nodes) == ['a', 'b', 'c']
+    assert nim.stubs == {'c'}
@@ -0,0 +1,134 @@
+import io
+import os
+import sys
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'gdelt'))
+from gdelt_downloader import Downloader  # noqa: E402
+
+
+def make_zip(name, rows):
+    lines = []
+    for i in range(rows):
+        fields = ['{}-{}'.format(name, i), '2019010100{:04d}'.format(i)]
+        fields += ['{} f{} é'.format(name, j) for j in range(25)]
+        lines.append('\t'.join(fields))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name + '.csv', '\n'.join(lines).encode('ISO-8859-1'))
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    # serves self.server.files; self.server.faults maps a name to a list of
+    # faults, one used up per request: a status code to answer with, or
+    # 'cut' to close the connection halfway through the body
+
+    def do_GET(self):
+        name = self.path.lstrip('/')
+        self.server.requests.append((name, self.headers.get('Range')))
+        faults = self.server.faults.get(name)
+        fault = faults.pop(0) if faults else None
+        if name not in self.server.files or isinstance(fault, int):
+            self.send_error(fault if isinstance(fault, int) else 404)
+            return
+        data = self.server.files[name]
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if fault == 'cut':
+            self.wfile.write(data[start:start + (len(data) - start) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.files = {}
+    httpd.faults = {}
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, name):
+    return 'http://127.0.0.1:{}/{}'.format(server.server_port, name)
+
+
+def expected(files, names):
+    downloader = Downloader()
+    frames = []
+    for name in names:
+        with zipfile.ZipFile(io.BytesIO(files[name])) as archive:
+            with archive.open(archive.namelist()[0]) as f:
+                frames.append(downloader.parse(f))
+    return pd.concat(frames, ignore_index=True)
+
+
+def downloader(links, **kwargs):
+    return Downloader(links, concurrency=2, retries=3, backoff=0.01,
+                      interval=0, timeout=10, **kwargs)
+
+
+def test_download_with_faults(server):
+    names = ['a.gkg.csv.zip', 'b.gkg.csv.zip', 'c.gkg.csv.zip']
+    server.files = {name: make_zip(name, 2000) for name in names}
+    server.faults = {'a.gkg.csv.zip': [503, 503],
+                     'b.gkg.csv.zip': ['cut']}
+    links = [url(server, name) for name in names + ['missing.gkg.csv.zip']]
+    d = downloader(links)
+    df = d.download_data()
+
+    pd.testing.assert_frame_equal(df, expected(server.files, names))
+    assert d.failed == [url(server, 'missing.gkg.csv.zip')]
+    requests = server.requests
+    assert [r for r in requests if r[0] == 'a.gkg.csv.zip'] == [
+            ('a.gkg.csv.zip', None)] * 3
+    # the retry after the disconnect resumes from the last byte received
+    b = [r for r in requests if r[0] == 'b.gkg.csv.zip']
+    assert len(b) == 2 and b[0][1] is None and b[1][1].startswith('bytes=')
+    assert int(b[1][1][len('bytes='):-1]) > 0
+    # a 404 is not retried
+    assert requests.count(('missing.gkg.csv.zip', None)) == 1
+
+
+def test_resume_kept_archives(server, tmp_path):
+    names = ['a.gkg.csv.zip', 'b.gkg.csv.zip']
+    server.files = {name: make_zip(name, 2000) for name in names}
+    data = server.files['a.gkg.csv.zip']
+    with open(os.path.join(str(tmp_path), 'a.gkg.csv.zip.part'), 'wb') as f:
+        f.write(data[:len(data) // 3])
+    with open(os.path.join(str(tmp_path), 'b.gkg.csv.zip'), 'wb') as f:
+        f.write(server.files['b.gkg.csv.zip'])
+
+    links = [url(server, name) for name in names]
+    df = downloader(links, folder=str(tmp_path)).download_data()
+
+    pd.testing.assert_frame_equal(df, expected(server.files, names))
+    assert server.requests == [
+            ('a.gkg.csv.zip', 'bytes={}-'.format(len(data) // 3))]
+    assert sorted(os.listdir(str(tmp_path))) == names
+    with open(os.path.join(str(tmp_path), 'a.gkg.csv.zip'), 'rb') as f:
+        assert f.read() == data
@@ -0,0 +1,67 @@
+import re
+import networkx as nx
+import numpy as np
+from util.gpickle_to_neo4j import Neo4jImporter
+from util.neo4j_stub import StubDriver
+
+
+def graph():
+    g = nx.MultiDiGraph()
+    g.add_node('C_1', nlabel='Company', name='Acme', revenue=np.float64(1.5),
+               city=None, employees=np.int64(3))
+    g.add_node('C_2', nlabel='Company', name='Beta', revenue=float('nan'),
+               aliases={'b'})
+    g.add_node('L_1', nlabel='Location', city='Athens')
+    g.add_edge('C_1', 'L_1', elabel='LOCATED_AT', type='main', since=None)
+    g.add_edge('C_2', 'L_1', elabel='LOCATED_AT', type=None, since=2019)
+    g.add_edge('C_1', 'L_1', elabel='LOCATED_AT', type='branch',
+               since=np.int64(2020))
+    return g
+
+
+def batches(driver):
+    return [(query, row) for (query, parameters) in driver.log
+            for row in parameters.get('rows', [])]
+
+
+def test_import_nodes():
+    driver = StubDriver(record=True)
+    nim = Neo4jImporter(None, driver)
+    assert nim.import_nodes(graph(), 'nlabel', batch=2) == []
+
+    rows = {row['id']: (query, row) for (query, row) in batches(driver)}
+    assert rows['C_1'][1] == {'nlabel': 'Company', 'name': 'Acme',
+                              'revenue': 1.5, 'employees': 3, 'id': 'C_1'}
+    assert type(rows['C_1'][1]['employees']) is int
+    assert rows['C_2'][1] == {'nlabel': 'Company', 'name': 'Beta',
+                              'aliases': ['b'], 'id': 'C_2'}
+    assert rows['L_1'][0].startswith(
+            'UNWIND $rows AS row MERGE (n:`Location` {id: row.id})')
+    # one query per label, in batches of at most 2 rows
+    assert driver.rows == 3 and driver.transactions == 2
+
+
+def test_import_edges_merge_keys():
+    driver = StubDriver(record=True)
+    nim = Neo4jImporter(None, driver)
+    assert nim.import_edges(graph(), 'nlabel', 'elabel') == []
+
+    rows = batches(driver)
+    assert len(rows) == 3
+    for (query, row) in rows:
+        # no null in a MERGE pattern, and the pattern has exactly the
+        # properties of its rows
+        assert None not in row['props'].values()
+        keys = re.findall(r'row\.props\.`([^`]+)`', query)
+        assert sorted(keys) == sorted(row['props'])
+    props = sorted([sorted(row['props'].items()) for (_, row) in rows])
+    assert props == [[('elabel', 'LOCATED_AT'), ('since', 2019)],
+                     [('elabel', 'LOCATED_AT'), ('since', 2020),
+                      ('type', 'branch')],
+                     [('elabel', 'LOCATED_AT'), ('type', 'main')]]
+
+
+def test_delete_graph():
+    driver = StubDriver(record=True)
+    Neo4jImporter(None, driver).delete_graph()
+    assert driver.log[0][0] == 'MATCH (n) DETACH DELETE(n)'
@@ -0,0 +1,127 @@
+import re
+import numpy as np
+import pytest
+from util.compact_graph import CompactGraph
+from util.graph_cleaner import clean_attributes, clean_graph, clean_nodes
+from util.indexed_graph import IndexedMultiDiGraph
+
+
+def isNaN(s):
+    return s != s
+
+
+def reference(attr):
+    # the per-node cleaning the column-wise one replaced, with the intended
+    # [^\w] pattern
+    attr = dict(attr)
+    for key in list(attr):
+        value = attr[key]
+        if isinstance(value, (list, set)):
+            value = ' '.join(value)
+        if isinstance(value, str):
+            value = re.sub(r'[^\w]', '_', value)
+        if isNaN(value):
+            del attr[key]
+        else:
+            attr[key] = value
+    return attr
+
+
+def fixture_nodes():
+    return [
+        ('a', {'nlabel': 'Sector Group', 'name': 'Société Générale S.A.',
+               'aliases': ['BNP Paribas', 'Crédit-Agricole'],
+               'employees': np.int64(42), 'revenue': np.float64('nan')}),
+        ('b', {'name': 'Ελληνικά & 日本語 (株)', 'nlabel': 'Sector Group',
+               'labels': {'x y'}, 'founded': None, 'lat': 1.5,
+               'code': np.str_('a-b c')}),
+        ('c', {'nlabel': 'Organization', 'lat': float('nan'),
+               'name': 'ok_name', 'tags': [], 'flag': np.bool_(True)}),
+        ('d', {'nlabel': 'Organization', 'name': 'O\'Neil\t"quoted"\n',
+               'lat': np.float32(2.5), 'lng': np.nan}),
+        ('e', {'nlabel': 'Sector Group', 'employees': np.int64(7),
+               'name': float('nan'), 'aliases': ['ünïcödé', 'ß-straße']}),
+        ('f', {'name': 'no label'}),
+        ('g', {}),
+    ]
+
+
+def test_clean_attributes_matches_reference():
+    nodes = fixture_nodes()
+    cleaned = clean_attributes([attr for (_, attr) in nodes])
+    for (_, attr), result in zip(nodes, cleaned):
+        expected = reference(attr)
+        assert list(result) == list(expected)
+        for key in expected:
+            assert type(result[key]) is type(expected[key])
+            assert result[key] == expected[key]
+
+
+def test_golden_values():
+    cleaned = dict(clean_nodes(fixture_nodes()))
+    assert cleaned['a'] == {'nlabel': 'Sector_Group',
+                            'name': 'Société_Générale_S_A_',
+                            'aliases': 'BNP_Paribas_Crédit_Agricole',
+                            'employees': 42}
+    assert cleaned['b']['name'] == 'Ελληνικά___日本語__株_'
+    assert cleaned['b']['founded'] is None
+    assert cleaned['b']['code'] == 'a_b_c'
+    assert cleaned['c'] == {'nlabel': 'Organization', 'name': 'ok_name',
+                            'tags': '', 'flag': True}
+    assert cleaned['e'] == {'nlabel': 'Sector_Group', 'employees': 7,
+                            'aliases': 'ünïcödé_ß_straße'}
+    assert cleaned['g'] == {}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_clean_nodes_blocks(workers):
+    nodes = fixture_nodes() * 3
+    nodes = [('{}{}'.format(node, i), attr)
+             for i, (node, attr) in enumerate(nodes)]
+    cleaned = list(clean_nodes(nodes, block=4, workers=workers))
+    assert [node for (node, _) in cleaned] == [node for (node, _) in nodes]
+    for (_, attr), (_, result) in zip(nodes, cleaned):
+        assert result == reference(attr)
+
+
+class WDGraph(IndexedMultiDiGraph):
+    pending_attr = 'label'
+
+
+class WDCompactGraph(CompactGraph):
+    pending_attr = 'label'
+
+
+@pytest.mark.parametrize('cls', [WDGraph, WDCompactGraph])
+def test_clean_graph_keeps_indexes(cls):
+    graph = cls()
+    graph.add_node('x', nlabel='Sector Group', source='Wiki data',
+                   label=float('nan'), name='a-b')
+    graph.add_node('y', nlabel='Org', source='Wiki data', label='ok',
+                   aliases=['p q', 'r'])
+    graph.add_edge('x', 'y', elabel='E', source='Wiki data')
+    clean_graph(graph)
+
+    assert dict(graph.nodes['x']) == reference({
+            'nlabel': 'Sector Group', 'source': 'Wiki data',
+            'label': float('nan'), 'name': 'a-b'})
+    assert set(graph.nodes_by('nlabel', 'Sector_Group')) == {'x'}
+    assert set(graph.nodes_by('nlabel', 'Sector Group')) == set()
+    assert graph.count_nodes('Wiki_data', 'Sector_Group') == 1
+    assert graph.count_edges('Wiki data', 'E', 'Sector_Group', 'Org') == 1
+    assert set(graph.pending_nodes('Sector_Group')) == {'x'}
+
+
+def test_clean_graph_skips_equal_values():
+    class Graph(WDGraph):
+        def add_node(self, node, **attr):
+            updates.append((node, attr))
+            super().add_node(node, **attr)
+
+    updates = []
+    graph = Graph()
+    graph.add_node('x', nlabel='Org', count=1, name='ab')
+    graph.add_node('y', nlabel='Org', count=1.0, name='a-b')
+    del updates[:]
+    clean_graph(graph, block=1, workers=2)
+    assert updates == [('y', {'name': 'a_b'})]
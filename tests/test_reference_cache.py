@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'gdelt'))
+from reference_cache import ReferenceCache, qgrams  # noqa: E402
+from gdelt_networkx import GDELT_NetworkxImporter  # noqa: E402
+
+
+class Fetch():
+
+    def __init__(self, df):
+        self.df = df
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.df
+
+
+def people():
+    return pd.DataFrame({'id': [1, 2], 'name': ['John_Smith', None]})
+
+
+def test_snapshot_is_reused(tmp_path):
+    fetch = Fetch(people())
+    df = ReferenceCache(str(tmp_path)).get('person', fetch)
+    assert fetch.calls == 1
+    assert df['name'].tolist() == ['john smith']
+    assert df['id'].tolist() == ['1']
+    assert list(df['tokens'][0]) == qgrams('john smith')
+
+    # a new cache (a new run) reads the snapshot instead of fetching
+    again = ReferenceCache(str(tmp_path)).get('person', fetch)
+    assert fetch.calls == 1
+    assert again['name'].tolist() == ['john smith']
+
+
+def test_expiry(tmp_path):
+    fetch = Fetch(people())
+    ReferenceCache(str(tmp_path), max_age=60).get('person', fetch)
+    path = os.path.join(str(tmp_path), 'person.json')
+    with open(path) as f:
+        meta = json.load(f)
+    meta['fetched'] -= 120
+    with open(path, 'w') as f:
+        json.dump(meta, f)
+
+    assert not ReferenceCache(str(tmp_path), max_age=60).is_valid('person')
+    assert ReferenceCache(str(tmp_path), max_age=None).is_valid('person')
+    ReferenceCache(str(tmp_path), max_age=60).get('person', fetch)
+    assert fetch.calls == 2
+
+
+def test_version_change(tmp_path):
+    fetch = Fetch(people())
+    ReferenceCache(str(tmp_path), version='2019-04').get('person', fetch)
+    ReferenceCache(str(tmp_path), version='2019-04').get('person', fetch)
+    assert fetch.calls == 1
+    cache = ReferenceCache(str(tmp_path), version='2019-05')
+    assert not cache.is_valid('person')
+    cache.get('person', fetch)
+    assert fetch.calls == 2
+    assert ReferenceCache(str(tmp_path), version='2019-05').is_valid('person')
+
+
+def test_invalidate(tmp_path):
+    cache = ReferenceCache(str(tmp_path))
+    fetch = Fetch(people())
+    cache.get('person', fetch)
+    cache.get('organization', fetch)
+
+    cache.invalidate('person')
+    assert not cache.is_valid('person')
+    assert cache.is_valid('organization')
+    cache.get('person', fetch)
+    assert fetch.calls == 3
+
+    cache.invalidate()
+    assert os.listdir(str(tmp_path)) == []
+    cache.get('organization', fetch)
+    assert fetch.calls == 4
+
+
+def test_filters_run_offline(tmp_path, monkeypatch):
+    # the reference snapshots are fixtures and there are no Neo4j
+    # credentials in the working directory, so any fetch would fail
+    monkeypatch.chdir(str(tmp_path))
+    cache = ReferenceCache(os.path.join(str(tmp_path), 'reference'))
+    cache.store('locations', pd.DataFrame({'lat': [37.98], 'lng': [23.72]},
+                                          index=['CW_L_1']))
+    cache.store('person', pd.DataFrame({'id': ['Q1'],
+                                        'name': ['Barack_Obama']}))
+    cache.store('organization', pd.DataFrame({'id': ['Q2'],
+                                              'name': ['Acme Corporation']}))
+
+    nim = GDELT_NetworkxImporter(ReferenceCache(cache.folder))
+    df = pd.DataFrame({
+            'ENHANCEDLOCATIONS': ['1#Athens#GR#GR35##37.98#23.72#-1#10',
+                                  '1#Paris#FR#FR00##48.85#2.35#-2#10',
+                                  None, None],
+            'ENHANCEDPERSONS': [None, None, 'Barack Obama,5;Joe Doe,9',
+                                'Jane Roe,3'],
+            'ENHANCEDORGANIZATIONS': [None, 'acme corporation,1', None,
+                                      'Other Ltd,2']})
+    rows = nim.filter_df(df, (0.8, '111', False))
+    assert sorted(rows) == [0, 1, 2]
+    assert nim._driver is None
@@ -0,0 +1,1214 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+from array import array
+from collections import Counter, defaultdict
+from collections.abc import MutableMapping, Set
+from itertools import compress, islice, repeat
+from operator import is_, is_not
+
+
+class Missing():
+    # marks an attribute that a node or edge does not have; pickled by name
+    # so it stays a singleton
+
+    def __reduce__(self):
+        return 'missing'
+
+    def __repr__(self):
+        return 'missing'
+
+
+missing = Missing()
+
+
+def view(buffer):
+    # temporary numpy view of an array; it must not be kept, since the array
+    # cannot grow while a view of it exists
+    return np.frombuffer(buffer, dtype=buffer.typecode)
+
+
+def marks(values, value):
+    # whether each of the values is the given object
+    return np.fromiter(map(is_, values, repeat(value)), dtype=bool,
+                       count=len(values))
+
+
+class Column():
+    """Values of one attribute, one row per node (or edge) of a table.
+
+    A flag per row tells whether the value is missing, NaN, None or stored.
+    Stored values are kept by type: integers and floats in arrays, strings
+    as codes into the distinct values while they repeat, or as UTF-8 bytes
+    with offsets once most of them are distinct, and anything else (lists,
+    booleans, mixed types) as a list of objects.
+    """
+
+    absent, value, nan, none = 0, 1, 2, 3
+    placeholders = {'int': 0, 'float': 0.0, 'code': -1, 'object': None}
+
+    def __init__(self, rows=0):
+        self.flags = bytearray(rows)
+        self.kind = None
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __flag(self, value):
+        if value is missing:
+            return self.absent
+        if value is None:
+            return self.none
+        if isinstance(value, float) and value != value:
+            return self.nan
+        return self.value
+
+    def __kind(self, value):
+        if isinstance(value, bool):
+            return 'object'
+        if isinstance(value, (int, np.integer)) and \
+                -(1 << 63) <= value < (1 << 63):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        if isinstance(value, str):
+            return 'code'
+        return 'object'
+
+    def __create(self, kind):
+        rows = len(self.flags)
+        self.kind = kind
+        if kind == 'int':
+            self.data = array('q', bytes(8 * rows))
+        elif kind == 'float':
+            self.data = array('d', bytes(8 * rows))
+        elif kind == 'code':
+            self.data = array('i', [-1]) * rows
+            self.values = []
+            self.lookup = {}
+        else:
+            self.data = [None] * rows
+
+    def __convert(self, kind):
+        # re-encodes the stored values, to plain strings or to objects
+        if kind == 'str' and self.kind == 'code':
+            codes = view(self.data).copy()
+            codes[np.frombuffer(self.flags, dtype=np.uint8) != self.value] = -1
+            values = self.values + ['']
+            self.kind = 'str'
+            self.data = (array('q'), array('i'), bytearray())
+            starts, sizes = self.__strings(map(values.__getitem__,
+                                               codes.tolist()))
+            self.data[0].frombytes(starts.tobytes())
+            self.data[1].frombytes(sizes.astype(np.int32).tobytes())
+            return
+        values = [self.get(row) for row in range(len(self.flags))]
+        flags = self.flags
+        self.flags = bytearray(0)
+        if kind == 'str':
+            self.kind = 'str'
+            self.data = (array('q'), array('i'), bytearray())
+        else:
+            self.__create(kind)
+            self.data = []
+        for value in values:
+            self.__append(value if value is not missing and
+                          value is not None and value == value else None)
+        self.flags = flags
+
+    def __fits(self, value):
+        kind = self.__kind(value)
+        if self.kind is None:
+            self.__create(kind)
+        elif kind != self.kind and self.kind != 'object' and \
+                not (kind == 'code' and self.kind == 'str'):
+            self.__convert('object')
+
+    def __encode(self, value):
+        if self.kind == 'int':
+            return int(value)
+        if self.kind == 'code':
+            code = self.lookup.get(value)
+            if code is None:
+                code = len(self.values)
+                self.lookup[value] = code
+                self.values.append(value)
+            return code
+        return value
+
+    def __append(self, value):
+        if self.kind == 'str':
+            (starts, lengths, buffer) = self.data
+            data = b'' if value is None else value.encode('utf-8')
+            starts.append(len(buffer))
+            lengths.append(len(data))
+            buffer.extend(data)
+        elif value is None:
+            self.data.append(self.placeholders[self.kind])
+        else:
+            self.data.append(self.__encode(value))
+
+    def __check(self):
+        # strings stay coded while the distinct values are few
+        if self.kind == 'code' and len(self.values) > 1024 and \
+                4 * len(self.values) > len(self.flags):
+            self.__convert('str')
+
+    def append(self, value):
+        flag = self.__flag(value)
+        if flag == self.value:
+            self.__fits(value)
+        self.flags.append(flag)
+        if self.kind is not None:
+            self.__append(value if flag == self.value else None)
+            self.__check()
+
+    def __batch(self, values):
+        # the flags of the values, the values to store and their kind if
+        # they are all integers, all floats or all strings that fit the
+        # column ('none' if there are none), or None if they have to be
+        # stored one by one
+        n = len(values)
+        types = set(map(type, values))
+        flags = np.full(n, self.value, dtype=np.uint8)
+        if Missing in types:
+            flags[marks(values, missing)] = self.absent
+        if type(None) in types:
+            flags[marks(values, None)] = self.none
+        if all(issubclass(t, float) for t in types):
+            flags[np.isnan(np.array(values, dtype=np.float64))] = self.nan
+        elif any(issubclass(t, float) for t in types):
+            floats = np.flatnonzero(np.fromiter(
+                    map(isinstance, values, repeat(float)), dtype=bool,
+                    count=n))
+            nan = np.isnan(np.array([values[i] for i in floats.tolist()],
+                                    dtype=np.float64))
+            flags[floats[nan]] = self.nan
+        if (flags == self.value).all():
+            stored = values
+        else:
+            stored = list(compress(values, flags == self.value))
+            types = set(map(type, stored))
+        flags = bytearray(flags.tobytes())
+        if not types:
+            return flags, stored, 'none'
+        if types <= {int, np.int64} and \
+                -(1 << 63) <= min(stored) and max(stored) < (1 << 63):
+            kind = 'int'
+        elif types <= {float, np.float64}:
+            kind = 'float'
+        elif types == {str}:
+            kind = 'code'
+        else:
+            kind = None
+        if kind is not None and (self.kind in (None, kind, 'object') or
+                                 (self.kind, kind) == ('str', 'code')):
+            return flags, stored, kind
+        return flags, stored, None
+
+    def __codes(self, values):
+        # the codes of the strings, adding the new ones
+        codes, uniques = pd.factorize(np.array(values, dtype=object))
+        lookup = self.lookup
+        uniques = [lookup.setdefault(value, len(lookup))
+                   for value in uniques.tolist()]
+        self.values.extend(islice(lookup, len(self.values), None))
+        return np.array(uniques, dtype=np.int32)[codes]
+
+    def __strings(self, values):
+        # appends the UTF-8 bytes of the strings to the buffer; returns
+        # where they start and their lengths
+        (starts, lengths, buffer) = self.data
+        values = list(values)
+        data = ''.join(values)
+        if data.isascii():
+            data = data.encode('ascii')
+        else:
+            values = [value.encode('utf-8') for value in values]
+            data = b''.join(values)
+        sizes = np.fromiter(map(len, values), dtype=np.int64,
+                            count=len(values))
+        offsets = len(buffer) + np.cumsum(sizes) - sizes
+        buffer.extend(data)
+        return offsets, sizes
+
+    def extend(self, values):
+        # appends the values as append does one by one, with a pass over
+        # them when they fit the column
+        values = values.tolist() if isinstance(values, np.ndarray) \
+            else list(values)
+        flags, stored, kind = self.__batch(values)
+        if kind is None:
+            for value in values:
+                self.append(value)
+            return
+        if self.kind is None and kind != 'none':
+            self.__create(kind)
+        if self.kind in ('int', 'float', 'code'):
+            mask = np.frombuffer(flags, dtype=np.uint8) == self.value
+            data = np.full(len(values), self.placeholders[self.kind],
+                           dtype={'int': np.int64, 'float': np.float64,
+                                  'code': np.int32}[self.kind])
+            data[mask] = self.__codes(stored) if self.kind == 'code' \
+                else stored
+            self.data.frombytes(data.tobytes())
+        elif self.kind == 'str':
+            starts, sizes = self.__strings([
+                    value if flag == self.value else ''
+                    for value, flag in zip(values, flags)])
+            self.data[0].frombytes(starts.tobytes())
+            self.data[1].frombytes(sizes.astype(np.int32).tobytes())
+        elif self.kind == 'object':
+            self.data.extend([value if flag == self.value else None
+                              for value, flag in zip(values, flags)])
+        self.flags.extend(flags)
+        self.__check()
+
+    def update(self, rows, values):
+        # sets the values at the given rows as set does row by row, with a
+        # pass over them when they fit the column
+        values = values.tolist() if isinstance(values, np.ndarray) \
+            else list(values)
+        flags, stored, kind = self.__batch(values)
+        if kind is None:
+            for row, value in zip(np.asarray(rows).tolist(), values):
+                self.set(row, value)
+            return
+        if self.kind is None and kind != 'none':
+            self.__create(kind)
+        rows = np.asarray(rows, dtype=np.int64)
+        flags = np.frombuffer(flags, dtype=np.uint8)
+        column_flags = np.frombuffer(self.flags, dtype=np.uint8)
+        column_flags[rows] = flags
+        del column_flags
+        rows = rows[flags == self.value]
+        if self.kind in ('int', 'float', 'code'):
+            data = view(self.data)
+            data[rows] = self.__codes(stored) if self.kind == 'code' \
+                else stored
+            del data
+        elif self.kind == 'str':
+            starts, sizes = self.__strings(stored)
+            data = view(self.data[0]), view(self.data[1])
+            data[0][rows] = starts
+            data[1][rows] = sizes
+            del data
+        elif self.kind == 'object':
+            for row, value in zip(rows.tolist(), stored):
+                self.data[row] = value
+        self.__check()
+
+    def set(self, row, value):
+        flag = self.__flag(value)
+        if flag == self.value:
+            self.__fits(value)
+        self.flags[row] = flag
+        if flag != self.value:
+            return
+        if self.kind == 'str':
+            (starts, lengths, buffer) = self.data
+            data = value.encode('utf-8')
+            starts[row] = len(buffer)
+            lengths[row] = len(data)
+            buffer.extend(data)
+        else:
+            self.data[row] = self.__encode(value)
+            self.__check()
+
+    def get(self, row):
+        flag = self.flags[row]
+        if flag != self.value:
+            return (missing, None, float('nan'), None)[flag]
+        if self.kind == 'code':
+            return self.values[self.data[row]]
+        if self.kind == 'str':
+            (starts, lengths, buffer) = self.data
+            start = starts[row]
+            return buffer[start:start + lengths[row]].decode('utf-8')
+        return self.data[row]
+
+    def factorize(self, rows):
+        # codes of the values at the given rows and the values they stand
+        # for; rows without a value get the code of None
+        if self.kind == 'code':
+            codes = view(self.data)[rows].astype(np.int64)
+            flags = np.frombuffer(self.flags, dtype=np.uint8)[rows]
+            codes[flags != self.value] = len(self.values)
+            return codes, self.values + [None]
+        lookup = {}
+        codes = [lookup.setdefault(None if value is missing else value,
+                                   len(lookup))
+                 for value in [self.get(row) for row in rows.tolist()]]
+        return np.array(codes, dtype=np.int64), list(lookup)
+
+
+class Table():
+    # columnar attributes of the nodes (or edges) that share a label; rows
+    # of removed elements are left empty
+
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.size = 0
+        self.columns = {}
+
+    def append(self, attr):
+        row = self.rows
+        for key, value in attr.items():
+            if key not in self.columns:
+                self.columns[key] = Column(row)
+            self.columns[key].append(value)
+        for column in self.columns.values():
+            if len(column) == row:
+                column.append(missing)
+        self.rows += 1
+        self.size += 1
+        return row
+
+    def extend(self, columns, n):
+        # appends n rows given as columns, with missing where a row has no
+        # value; returns the first of them
+        row = self.rows
+        for key, values in columns.items():
+            if key not in self.columns:
+                if marks(values, missing).all():
+                    continue
+                self.columns[key] = Column(row)
+            self.columns[key].extend(values)
+        for column in self.columns.values():
+            if len(column) == row:
+                column.extend([missing] * n)
+        self.rows += n
+        self.size += n
+        return row
+
+    def update(self, rows, key, values):
+        # sets one attribute at the given rows
+        if key not in self.columns:
+            self.columns[key] = Column(self.rows)
+        self.columns[key].update(rows, values)
+
+    def get(self, row):
+        attr = {}
+        for key, column in self.columns.items():
+            value = column.get(row)
+            if value is not missing:
+                attr[key] = value
+        return attr
+
+    def set(self, row, key, value):
+        if key not in self.columns:
+            self.columns[key] = Column(self.rows)
+        self.columns[key].set(row, value)
+
+    def remove(self, row):
+        for column in self.columns.values():
+            column.set(row, missing)
+        self.size -= 1
+
+
+class KeySet(Set):
+    # read-only set of node keys, backed by node ids: ids() lists them and
+    # test(i) tells whether id i belongs to the set
+
+    def __init__(self, graph, ids, test):
+        self.graph = graph
+        self.ids = ids
+        self.test = test
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def __contains__(self, key):
+        i = self.graph.ids.get(key)
+        return i is not None and self.test(i)
+
+    def __iter__(self):
+        keys = self.graph.keys
+        return (keys[i] for i in self.ids())
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __and__(self, other):
+        # iterates the smaller side and tests membership in the other one
+        if not isinstance(other, Set):
+            other = set(other)
+        small, large = (self, other) if len(self) <= len(other) \
+            else (other, self)
+        return set(key for key in small if key in large)
+
+    __rand__ = __and__
+
+
+class Attributes(MutableMapping):
+    # attribute dict of one node or edge; writes go through the graph, so
+    # its indexes stay up to date
+
+    def __init__(self, graph, kind, i):
+        self.graph = graph
+        self.kind = kind
+        self.i = i
+
+    def __data(self):
+        return self.graph.get_attributes(self.kind, self.i)
+
+    def __getitem__(self, key):
+        return self.__data()[key]
+
+    def __setitem__(self, key, value):
+        self.graph.set_attributes(self.kind, self.i, {key: value})
+
+    def __delitem__(self, key):
+        if key not in self.__data():
+            raise KeyError(key)
+        self.graph.set_attributes(self.kind, self.i, {key: missing})
+
+    def __iter__(self):
+        return iter(self.__data())
+
+    def __len__(self):
+        return len(self.__data())
+
+    def __repr__(self):
+        return repr(self.__data())
+
+
+class NodeView():
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return self
+        return self.data(data, default)
+
+    def __iter__(self):
+        keys = self.graph.keys
+        return (keys[i] for i in self.graph.node_ids())
+
+    def __len__(self):
+        return self.graph.number_of_nodes()
+
+    def __contains__(self, n):
+        return n in self.graph.ids
+
+    def __getitem__(self, n):
+        return Attributes(self.graph, 'node', self.graph.ids[n])
+
+    def keys(self):
+        return iter(self)
+
+    def data(self, data=True, default=None):
+        graph = self.graph
+        for i in graph.node_ids():
+            attr = graph.get_attributes('node', i)
+            yield (graph.keys[i], attr if data is True
+                   else attr.get(data, default))
+
+
+class EdgeView():
+    # edges are (u, v, key) triples; the key of an edge added without one
+    # is its position in the edge arrays
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __call__(self, data=False, keys=False, default=None):
+        if data is False and not keys:
+            return self
+        return self.data(data, keys, default)
+
+    def __iter__(self):
+        for (u, v, k, e) in self.graph.edge_tuples():
+            yield (u, v, k)
+
+    def __len__(self):
+        return self.graph.number_of_edges()
+
+    def __getitem__(self, edge):
+        return Attributes(self.graph, 'edge', self.graph.edge_id(*edge))
+
+    def keys(self):
+        return iter(self)
+
+    def data(self, data=True, keys=False, default=None):
+        graph = self.graph
+        for (u, v, k, e) in graph.edge_tuples():
+            attr = graph.get_attributes('edge', e)
+            if data is not True:
+                attr = attr.get(data, default)
+            yield (u, v, k, attr) if keys else (u, v, attr)
+
+
+class CompactGraph():
+    """Memory-efficient alternative to IndexedMultiDiGraph with the same
+    mutators and lookups, for graphs that do not fit in memory as networkx
+    dictionaries.
+
+    Node keys are interned to integer ids (``ids`` and ``keys``), edges are
+    stored as arrays of source and target ids, and the attributes of nodes
+    and edges are kept in one columnar table per nlabel and elabel. The
+    index attributes other than nlabel are stored as small integer codes.
+    Nodes and edges are removed by marking them, and the incident edges of
+    a node are found through a CSR index of the edges, rebuilt when enough
+    edges have been added since.
+
+    ``nodes`` and ``edges`` behave like the networkx views used by the
+    importers and writers; ``graph.nodes[n]`` is a live attribute mapping.
+    Edges added without a key get their position as key. Counts and
+    values of the indexes are computed with numpy when they are asked for.
+    ``to_networkx`` and ``from_networkx`` convert from and to networkx.
+    """
+
+    index_attrs = ('nlabel', 'source')
+    pending_attr = None
+
+    def __init__(self):
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.keys = []
+        self.node_table = array('i')
+        self.node_row = array('q')
+        self.node_tables = []
+        self.node_labels = {}
+        self.codes = {a: array('i') for a in self.index_attrs
+                      if a != 'nlabel'}
+        self.values = {a: [] for a in self.codes}
+        self.value_codes = {a: {} for a in self.codes}
+        self.pending = defaultdict(set)
+        self.no_nodes = 0
+        self.clear_edges()
+
+    def clear_edges(self):
+        self.src = array('q')
+        self.dst = array('q')
+        self.edge_table = array('i')
+        self.edge_row = array('q')
+        self.edge_tables = []
+        self.edge_labels = {}
+        self.edge_keys = {}
+        self.key_of = {}
+        self.no_edges = 0
+        self.csr = None
+        self.stats = None
+        self.version += 1
+
+    @property
+    def nodes(self):
+        return NodeView(self)
+
+    @property
+    def edges(self):
+        return EdgeView(self)
+
+    def __len__(self):
+        return self.no_nodes
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __contains__(self, n):
+        return n in self.ids
+
+    def has_node(self, n):
+        return n in self.ids
+
+    def number_of_nodes(self):
+        return self.no_nodes
+
+    def number_of_edges(self):
+        return self.no_edges
+
+    # storage
+
+    def __table(self, tables, labels, label):
+        if label not in labels:
+            labels[label] = len(tables)
+            tables.append(Table(label))
+        return labels[label]
+
+    def __code(self, attr, value):
+        if value is missing:
+            return -1
+        codes = self.value_codes[attr]
+        if value not in codes:
+            codes[value] = len(self.values[attr])
+            self.values[attr].append(value)
+        return codes[value]
+
+    def __code_all(self, attr, values):
+        # __code of each of the values
+        codes, values = pd.factorize(np.asarray(values, dtype=object),
+                                     use_na_sentinel=False)
+        return np.array([self.__code(attr, value) for value
+                         in values.tolist()], dtype=np.int32)[codes]
+
+    def __columns(self, attr, label):
+        # the label and, for nodes, the coded index attributes are not
+        # stored in the tables
+        return {key: value for key, value in attr.items() if key != label
+                and (label != 'nlabel' or key not in self.codes)}
+
+    def node_ids(self):
+        return np.flatnonzero(view(self.node_table) >= 0)
+
+    def get_attributes(self, kind, i):
+        if kind == 'node':
+            table = self.node_tables[self.node_table[i]]
+            attr = table.get(self.node_row[i])
+            if table.label is not None:
+                attr['nlabel'] = table.label
+            for a, codes in self.codes.items():
+                if codes[i] >= 0:
+                    attr[a] = self.values[a][codes[i]]
+            return attr
+        table = self.edge_tables[self.edge_table[i]]
+        attr = table.get(self.edge_row[i])
+        if table.label is not None:
+            attr['elabel'] = table.label
+        return attr
+
+    def set_attributes(self, kind, i, attr):
+        # updates the attributes of node or edge i; a value of missing
+        # removes the attribute
+        if kind == 'node':
+            self.__update_node(i, attr)
+        else:
+            self.__update_edge(i, attr)
+        self.version += 1
+
+    def __has(self, i, key):
+        if key == 'nlabel':
+            return self.node_tables[self.node_table[i]].label is not None
+        if key in self.codes:
+            return self.codes[key][i] >= 0
+        table = self.node_tables[self.node_table[i]]
+        column = table.columns.get(key)
+        return column is not None and \
+            column.get(self.node_row[i]) is not missing
+
+    def __insert_node(self, n, attr):
+        i = len(self.keys)
+        self.ids[n] = i
+        self.keys.append(n)
+        label = attr.get('nlabel', missing)
+        label = None if label is missing else label
+        t = self.__table(self.node_tables, self.node_labels, label)
+        self.node_table.append(t)
+        self.node_row.append(self.node_tables[t].append(
+                self.__columns(attr, 'nlabel')))
+        for a, codes in self.codes.items():
+            codes.append(self.__code(a, attr.get(a, missing)))
+        if self.pending_attr is not None and not self.__has(
+                i, self.pending_attr):
+            self.pending[label].add(i)
+        self.no_nodes += 1
+        return i
+
+    def __update_node(self, i, attr):
+        t = self.node_table[i]
+        table = self.node_tables[t]
+        row = self.node_row[i]
+        old = table.label
+        if 'nlabel' in attr:
+            label = None if attr['nlabel'] is missing else attr['nlabel']
+        else:
+            label = old
+        if label != old:
+            # the node moves to the table of its new label
+            values = table.get(row)
+            values.update(self.__columns(attr, 'nlabel'))
+            table.remove(row)
+            t = self.__table(self.node_tables, self.node_labels, label)
+            self.node_table[i] = t
+            self.node_row[i] = self.node_tables[t].append(
+                    {key: value for key, value in values.items()
+                     if value is not missing})
+        else:
+            for key, value in self.__columns(attr, 'nlabel').items():
+                table.set(row, key, value)
+        for a, codes in self.codes.items():
+            if a in attr:
+                codes[i] = self.__code(a, attr[a])
+
+        if self.pending_attr is not None:
+            self.__discard_pending(old, i)
+            if not self.__has(i, self.pending_attr):
+                self.pending[label].add(i)
+
+    def __discard_pending(self, label, i):
+        nodes = self.pending.get(label)
+        if nodes is not None:
+            nodes.discard(i)
+            if not nodes:
+                del self.pending[label]
+
+    def __update_edge(self, e, attr):
+        t = self.edge_table[e]
+        table = self.edge_tables[t]
+        row = self.edge_row[e]
+        label = table.label
+        if 'elabel' in attr:
+            label = None if attr['elabel'] is missing else attr['elabel']
+        if label != table.label:
+            values = table.get(row)
+            values.update(self.__columns(attr, 'elabel'))
+            table.remove(row)
+            t = self.__table(self.edge_tables, self.edge_labels, label)
+            self.edge_table[e] = t
+            self.edge_row[e] = self.edge_tables[t].append(
+                    {key: value for key, value in values.items()
+                     if value is not missing})
+        else:
+            for key, value in attr.items():
+                if key != 'elabel':
+                    table.set(row, key, value)
+
+    # mutators
+
+    def add_node(self, node_for_adding, **attr):
+        i = self.ids.get(node_for_adding)
+        if i is None:
+            self.__insert_node(node_for_adding, attr)
+        else:
+            self.__update_node(i, attr)
+        self.version += 1
+
+    def remove_node_attrs(self, n, keys):
+        # deletes attributes of node n, as IndexedMultiDiGraph does
+        self.set_attributes('node', self.ids[n],
+                            {key: missing for key in keys})
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        for n in nodes_for_adding:
+            try:
+                hash(n)
+                newdict = attr
+            except TypeError:
+                n, ndict = n
+                newdict = attr.copy()
+                newdict.update(ndict)
+            self.add_node(n, **newdict)
+
+    def node_ids_of(self, keys):
+        # the ids of the node keys, -1 for the keys not in the graph
+        return np.fromiter(map(self.ids.get, keys, repeat(-1)),
+                           dtype=np.int64, count=len(keys))
+
+    def has_attributes(self, ids, key):
+        # whether each node of ids has attribute key
+        ids = np.asarray(ids, dtype=np.int64)
+        if key in self.codes:
+            return view(self.codes[key])[ids] >= 0
+        tables = view(self.node_table)[ids]
+        rows = view(self.node_row)[ids]
+        has = np.zeros(len(ids), dtype=bool)
+        for t in np.unique(tables).tolist():
+            table = self.node_tables[t]
+            at = tables == t
+            if key == 'nlabel':
+                has[at] = table.label is not None
+            elif key in table.columns:
+                flags = np.frombuffer(table.columns[key].flags,
+                                      dtype=np.uint8)
+                has[at] = flags[rows[at]] != Column.absent
+                del flags
+        return has
+
+    def add_node_columns(self, keys, attrs):
+        """Adds nodes that are not in the graph, as add_nodes_from would,
+        given their keys and their attributes as columns: object arrays
+        with a value per node, or missing where a node does not have the
+        attribute. The nodes of a label are appended to its table with a
+        pass per column."""
+        n = len(keys)
+        start = len(self.keys)
+        labels = attrs.get('nlabel', [missing] * n)
+        label_tables = {}
+        tables = np.array([label_tables[label] if label in label_tables
+                           else label_tables.setdefault(label, self.__table(
+                                   self.node_tables, self.node_labels,
+                                   None if label is missing else label))
+                           for label in labels], dtype=np.int32)
+        rows = np.zeros(n, dtype=np.int64)
+        columns = {key: values for key, values in attrs.items()
+                   if key != 'nlabel' and key not in self.codes}
+        for t in np.unique(tables).tolist():
+            at = np.flatnonzero(tables == t)
+            rows[at] = self.node_tables[t].extend(
+                    {key: values[at] for key, values in columns.items()},
+                    len(at)) + np.arange(len(at))
+        self.ids.update(zip(keys, range(start, start + n)))
+        self.keys.extend(keys)
+        self.node_table.frombytes(tables.tobytes())
+        self.node_row.frombytes(rows.tobytes())
+        for a, codes in self.codes.items():
+            codes.frombytes(self.__code_all(
+                    a, attrs.get(a, [missing] * n)).tobytes())
+        if self.pending_attr is not None:
+            for i in range(start, start + n):
+                if not self.__has(i, self.pending_attr):
+                    self.pending[self.node_tables[
+                            self.node_table[i]].label].add(i)
+        self.no_nodes += n
+        self.version += 1
+
+    def update_node_columns(self, ids, attrs):
+        """Sets attributes of nodes as add_node would node by node, given
+        their ids and the attributes as columns: object arrays with a value
+        per node, or missing where a node keeps what it has. A node whose
+        nlabel changes moves to its new table on its own."""
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = attrs.get('nlabel')
+        if labels is not None:
+            old = np.empty(len(self.node_tables), dtype=object)
+            for t, table in enumerate(self.node_tables):
+                old[t] = table.label
+            moved = ~marks(labels, missing) & \
+                (labels != old[view(self.node_table)[ids]])
+            for j in np.flatnonzero(moved).tolist():
+                self.__update_node(int(ids[j]), {
+                        key: values[j] for key, values in attrs.items()
+                        if values[j] is not missing})
+            ids = ids[~moved]
+            attrs = {key: values[~moved] for key, values in attrs.items()}
+        given = {key: ~marks(values, missing) for key, values
+                 in attrs.items() if key != 'nlabel'}
+        for a, codes in self.codes.items():
+            if a in attrs:
+                data = view(codes)
+                data[ids[given[a]]] = self.__code_all(a,
+                                                      attrs[a][given[a]])
+                del data
+        tables = view(self.node_table)[ids]
+        rows = view(self.node_row)[ids]
+        for t in np.unique(tables).tolist():
+            at = tables == t
+            for key, values in attrs.items():
+                if key == 'nlabel' or key in self.codes:
+                    continue
+                at_key = at & given[key]
+                if at_key.any():
+                    self.node_tables[t].update(rows[at_key], key,
+                                               values[at_key])
+        if self.pending_attr is not None:
+            for i in ids.tolist():
+                label = self.node_tables[self.node_table[i]].label
+                self.__discard_pending(label, i)
+                if not self.__has(i, self.pending_attr):
+                    self.pending[label].add(i)
+        self.version += 1
+
+    def add_edge(self, u_for_edge, v_for_edge, key=None, **attr):
+        u = self.ids.get(u_for_edge)
+        if u is None:
+            u = self.__insert_node(u_for_edge, {})
+        v = self.ids.get(v_for_edge)
+        if v is None:
+            v = self.__insert_node(v_for_edge, {})
+        self.version += 1
+
+        if key is not None and (u, v, key) in self.edge_keys:
+            self.__update_edge(self.edge_keys[(u, v, key)], attr)
+            return key
+
+        e = len(self.src)
+        self.src.append(u)
+        self.dst.append(v)
+        label = attr.get('elabel')
+        t = self.__table(self.edge_tables, self.edge_labels, label)
+        self.edge_table.append(t)
+        self.edge_row.append(self.edge_tables[t].append(
+                self.__columns(attr, 'elabel')))
+        self.no_edges += 1
+        if key is None:
+            return e
+        self.edge_keys[(u, v, key)] = e
+        self.key_of[e] = key
+        return key
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        keylist = []
+        for e in ebunch_to_add:
+            ne = len(e)
+            if ne == 4:
+                u, v, key, dd = e
+            elif ne == 3:
+                u, v, dd = e
+                key = None
+            elif ne == 2:
+                u, v = e
+                dd = {}
+                key = None
+            else:
+                raise nx.NetworkXError(
+                        "Edge tuple {} must be a 2-tuple, 3-tuple or "
+                        "4-tuple.".format(e))
+            ddd = {}
+            ddd.update(attr)
+            try:
+                ddd.update(dd)
+            except (TypeError, ValueError):
+                if ne != 3:
+                    raise
+                key = dd
+            keylist.append(self.add_edge(u, v, key, **ddd))
+        return keylist
+
+    def add_edge_columns(self, sources, targets, attrs):
+        """Adds edges without keys, as add_edges_from would, given their
+        endpoints and their attributes as columns: object arrays with a
+        value per edge, or missing where an edge does not have the
+        attribute. Endpoints that are not in the graph are added first."""
+        n = len(sources)
+        u = self.node_ids_of(sources)
+        v = self.node_ids_of(targets)
+        for e in np.flatnonzero((u < 0) | (v < 0)).tolist():
+            for n_for_edge in (sources[e], targets[e]):
+                if n_for_edge not in self.ids:
+                    self.__insert_node(n_for_edge, {})
+            u[e], v[e] = self.ids[sources[e]], self.ids[targets[e]]
+        labels = attrs.get('elabel', [None] * n)
+        label_tables = {}
+        tables = np.array([label_tables[label] if label in label_tables
+                           else label_tables.setdefault(label, self.__table(
+                                   self.edge_tables, self.edge_labels,
+                                   None if label is missing else label))
+                           for label in labels], dtype=np.int32)
+        rows = np.zeros(n, dtype=np.int64)
+        columns = {key: values for key, values in attrs.items()
+                   if key != 'elabel'}
+        for t in np.unique(tables).tolist():
+            at = np.flatnonzero(tables == t)
+            rows[at] = self.edge_tables[t].extend(
+                    {key: values[at] for key, values in columns.items()},
+                    len(at)) + np.arange(len(at))
+        self.src.frombytes(u.tobytes())
+        self.dst.frombytes(v.tobytes())
+        self.edge_table.frombytes(tables.tobytes())
+        self.edge_row.frombytes(rows.tobytes())
+        self.no_edges += n
+        self.version += 1
+
+    def __remove_edge(self, e):
+        self.edge_tables[self.edge_table[e]].remove(self.edge_row[e])
+        key = self.key_of.pop(e, None)
+        if key is not None:
+            del self.edge_keys[(self.src[e], self.dst[e], key)]
+        self.src[e] = -1
+        self.dst[e] = -1
+        self.no_edges -= 1
+
+    def remove_node(self, n):
+        i = self.ids.get(n)
+        if i is None:
+            raise nx.NetworkXError("The node {} is not in the graph."
+                                   .format(n))
+        for e in self.__incident(i):
+            self.__remove_edge(e)
+        table = self.node_tables[self.node_table[i]]
+        if self.pending_attr is not None:
+            self.__discard_pending(table.label, i)
+        table.remove(self.node_row[i])
+        self.node_table[i] = -1
+        for codes in self.codes.values():
+            codes[i] = -1
+        self.keys[i] = None
+        del self.ids[n]
+        self.no_nodes -= 1
+        self.version += 1
+
+    def remove_nodes_from(self, nodes):
+        for n in list(nodes):
+            if n in self.ids:
+                self.remove_node(n)
+
+    def remove_edge(self, u, v, key=None):
+        iu, iv = self.ids.get(u, -1), self.ids.get(v, -1)
+        edges = [e for e in self.__incident(iu)
+                 if self.src[e] == iu and self.dst[e] == iv]
+        if key is not None:
+            edges = [e for e in edges if self.key_of.get(e, e) == key]
+        if len(edges) == 0:
+            raise nx.NetworkXError("The edge {}-{} is not in the graph."
+                                   .format(u, v))
+        self.__remove_edge(edges[-1])
+        self.version += 1
+
+    # adjacency
+
+    def __incident(self, i):
+        # live edges of node i: the CSR index covers the edges that existed
+        # when it was built, newer ones are scanned
+        if i < 0:
+            return []
+        no = len(self.src)
+        if self.csr is None or no - self.csr[0] > max(self.csr[0] // 4,
+                                                      1 << 16):
+            src, dst = view(self.src), view(self.dst)
+            out = np.argsort(src, kind='stable')
+            inc = np.argsort(dst, kind='stable')
+            self.csr = (no, out, src[out], inc, dst[inc])
+            del src, dst
+        built, out, out_keys, inc, inc_keys = self.csr
+        src, dst = view(self.src), view(self.dst)
+        edges = [out[np.searchsorted(out_keys, i, 'left'):
+                     np.searchsorted(out_keys, i, 'right')],
+                 inc[np.searchsorted(inc_keys, i, 'left'):
+                     np.searchsorted(inc_keys, i, 'right')],
+                 built + np.flatnonzero((src[built:] == i) |
+                                        (dst[built:] == i))]
+        edges = np.unique(np.concatenate(edges))
+        edges = edges[(src[edges] == i) | (dst[edges] == i)]
+        del src, dst
+        return edges.tolist()
+
+    def successors(self, n):
+        i = self.ids[n]
+        return iter(dict.fromkeys([self.keys[self.dst[e]] for e
+                                   in self.__incident(i)
+                                   if self.src[e] == i]))
+
+    neighbors = successors
+
+    def predecessors(self, n):
+        i = self.ids[n]
+        return iter(dict.fromkeys([self.keys[self.src[e]] for e
+                                   in self.__incident(i)
+                                   if self.dst[e] == i]))
+
+    def has_edge(self, u, v, key=None):
+        try:
+            self.edge_id(u, v, key)
+            return True
+        except KeyError:
+            return False
+
+    def edge_id(self, u, v, key=None):
+        if u in self.ids and v in self.ids:
+            u, v = self.ids[u], self.ids[v]
+            if key is not None and (u, v, key) in self.edge_keys:
+                return self.edge_keys[(u, v, key)]
+            for e in self.__incident(u):
+                if self.src[e] == u and self.dst[e] == v and \
+                        (key is None or self.key_of.get(e, e) == key):
+                    return e
+        raise KeyError((u, v, key))
+
+    def edge_tuples(self):
+        keys = self.keys
+        src, dst = view(self.src), view(self.dst)
+        edges = np.flatnonzero(src >= 0)
+        us, vs = src[edges].tolist(), dst[edges].tolist()
+        del src, dst
+        for e, u, v in zip(edges.tolist(), us, vs):
+            yield (keys[u], keys[v], self.key_of.get(e, e), e)
+
+    # lookups
+
+    def nodes_by(self, attr, value):
+        if attr == 'nlabel':
+            t = self.node_labels.get(value)
+            if t is None:
+                return set()
+            return KeySet(self, lambda: np.flatnonzero(
+                    view(self.node_table) == t),
+                          lambda i: self.node_table[i] == t)
+        code = self.value_codes[attr].get(value)
+        if code is None:
+            return set()
+        codes = self.codes[attr]
+        return KeySet(self, lambda: np.flatnonzero(view(codes) == code),
+                      lambda i: codes[i] == code)
+
+    def pending_nodes(self, nlabel):
+        nodes = self.pending.get(nlabel, set())
+        return KeySet(self, lambda: nodes, lambda i: i in nodes)
+
+    def node_values(self, attr):
+        if attr == 'nlabel':
+            return set([table.label for table in self.node_tables
+                        if table.label is not None and table.size > 0])
+        codes = view(self.codes[attr])
+        used = np.unique(codes[codes >= 0]).tolist()
+        del codes
+        return set([self.values[attr][code] for code in used])
+
+    def __statistics(self):
+        # node and edge counts by (source, labels), recomputed after changes
+        if self.stats is not None and self.stats[0] == self.version:
+            return self.stats[1], self.stats[2]
+        labels = [table.label for table in self.node_tables] + [None]
+        sources = self.values.get('source', []) + [None]
+
+        node_table = view(self.node_table)
+        alive = node_table >= 0
+        if 'source' in self.codes:
+            node_source = view(self.codes['source']).astype(np.int64)
+        else:
+            node_source = np.full(len(node_table), -1)
+        # the codes are combined into one integer key per node and edge;
+        # -1 (no source) is the last entry of sources and labels
+        width = len(labels)
+        keys, counts = np.unique(node_source[alive] % len(sources) * width +
+                                 node_table[alive], return_counts=True)
+        # an explicit None and a missing source (or label) are the same key,
+        # so their counts are added up
+        node_counts = Counter()
+        for k, c in zip(keys.tolist(), counts.tolist()):
+            node_counts[(sources[k // width], labels[k % width])] += c
+
+        edge_counts = Counter()
+        src, dst = view(self.src), view(self.dst)
+        edge_table, edge_row = view(self.edge_table), view(self.edge_row)
+        for t, table in enumerate(self.edge_tables):
+            edges = np.flatnonzero((edge_table == t) & (src >= 0))
+            if len(edges) == 0:
+                continue
+            column = table.columns.get('source', Column(table.rows))
+            source, names = column.factorize(edge_row[edges])
+            keys, counts = np.unique(
+                    (source * width + node_table[src[edges]]) * width +
+                    node_table[dst[edges]], return_counts=True)
+            for k, c in zip(keys.tolist(), counts.tolist()):
+                edge_counts[(names[k // width // width], table.label,
+                             labels[k // width % width],
+                             labels[k % width])] += c
+        del node_table, src, dst, edge_table, edge_row
+        self.stats = (self.version, node_counts, edge_counts)
+        return node_counts, edge_counts
+
+    def count_nodes(self, source, nlabel):
+        return self.__statistics()[0][(source, nlabel)]
+
+    def edge_values(self):
+        return set([(elabel, nlabel1, nlabel2) for (source, elabel, nlabel1,
+                                                    nlabel2)
+                    in self.__statistics()[1] if elabel is not None])
+
+    def count_edges(self, source, elabel, nlabel1, nlabel2):
+        return self.__statistics()[1][(source, elabel, nlabel1, nlabel2)]
+
+    # conversion
+
+    def to_networkx(self, graph=None):
+        # copies the graph into graph, by default a new nx.MultiDiGraph;
+        # edge keys are kept
+        graph = graph if graph is not None else nx.MultiDiGraph()
+        graph.add_nodes_from(self.nodes.data())
+        graph.add_edges_from(self.edges.data(keys=True))
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph):
+        # the networkx edge keys are dropped, parallel edges are kept
+        compact = cls()
+        compact.add_nodes_from(graph.nodes.data())
+        compact.add_edges_from(graph.edges.data())
+        return compact
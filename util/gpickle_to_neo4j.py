@@ -1,9 +1,9 @@
 from time import time
 import yaml
 from neo4j import GraphDatabase, exceptions
-import networkx as nx
 import os
-import re
+import pickle
+from collections import defaultdict
 
 
 def isNaN(s):
@@ -12,9 +12,13 @@ def isNaN(s):
 
 class Neo4jImporter(object):
 
-    def __init__(self, creds):
-        self._driver = GraphDatabase.driver(creds["uri"], auth=(creds["user"],
-                                            creds["password"]))
+    def __init__(self, creds, driver=None):
+        # any object with the driver/session/transaction interface can be
+        # passed as driver, e.g. the StubDriver of neo4j_stub.py
+        if driver is None:
+            driver = GraphDatabase.driver(creds["uri"], auth=(creds["user"],
+                                          creds["password"]))
+        self._driver = driver
         self.session = self._driver.session()
 
     def close(self):
@@ -48,51 +52,122 @@ class Neo4jImporter(object):
         print("Nodes Deleted: {:,}".format(results.nodes_deleted))
         print("Edges Deleted: {:,}".format(results.relationships_deleted))
 
-    def import_nodes(self, graph, nlab):
+    def __value(self, value):
+        if isinstance(value, (set, tuple)):
+            return [self.__value(v) for v in value]
+        if isinstance(value, list):
+            return [self.__value(v) for v in value]
+        if hasattr(value, 'item') and not isinstance(value, str):
+            return value.item()
+        return value
+
+    def __props(self, attr):
+        # null properties are left out: neo4j does not store them and
+        # rejects them in a MERGE pattern
+        return {key: self.__value(attr[key]) for key in attr.keys()
+                if attr[key] is not None and not isNaN(attr[key])}
+
+    def __name(self, name):
+        return '`{}`'.format(str(name).replace('`', '``'))
+
+    def __run_batch(self, query, rows):
+        tx = self.session.begin_transaction()
+        try:
+            tx.run(query, rows=rows)
+            tx.commit()
+        except exceptions.Neo4jError:
+            tx.rollback()
+            raise
+
+    def __flush(self, groups, key, query, batch, error):
+        rows = groups[key]
+        if len(rows) == 0 or len(rows) < batch:
+            return
+        try:
+            self.__run_batch(query, rows)
+        except exceptions.Neo4jError:
+            error += [row['id'] if 'id' in row else
+                      (row['source'], row['target']) for row in rows]
+        groups[key] = []
+
+    def node_query(self, label, mode='MERGE'):
+        if mode == 'MERGE':
+            return "UNWIND $rows AS row MERGE (n:{} {{id: row.id}}) "\
+                   "SET n += row".format(self.__name(label))
+        elif mode == 'CREATE':
+            return "UNWIND $rows AS row CREATE (n:{}) "\
+                   "SET n = row".format(self.__name(label))
+        raise ValueError('Not a valid mode. Choose either "MERGE" or '
+                         '"CREATE".')
+
+    def edge_query(self, elabel, nlabel1, nlabel2, keys, mode='MERGE'):
+        query = "UNWIND $rows AS row "\
+                "MATCH (a:{} {{id: row.source}}) "\
+                "MATCH (b:{} {{id: row.target}}) ".format(
+                        self.__name(nlabel1), self.__name(nlabel2))
+        if mode == 'MERGE':
+            # relationships are merged on all their properties, so parallel
+            # edges with different properties are kept apart
+            props = ', '.join(['{}: row.props.{}'.format(self.__name(key),
+                               self.__name(key)) for key in keys])
+            return query + "MERGE (a)-[r:{} {{{}}}]->(b)".format(
+                    self.__name(elabel), props)
+        elif mode == 'CREATE':
+            return query + "CREATE (a)-[r:{}]->(b) SET r = row.props".format(
+                    self.__name(elabel))
+        raise ValueError('Not a valid mode. Choose either "MERGE" or '
+                         '"CREATE".')
+
+    def import_nodes(self, graph, nlab, batch=10000, mode='MERGE'):
+        # nodes are sent in UNWIND batches of parameters, one explicit
+        # transaction per batch and label
         error = []
+        groups = defaultdict(list)
+        queries = {}
         for (node, attr) in graph.nodes.data():
-            query = "MERGE (n:{} {{id:'{}'".format(attr[nlab], node)
-            for key in attr.keys():
-                if isNaN(attr[key]):
-                    continue
-
-                if isinstance(attr[key], str):
-                    attr[key] = re.sub('"', '\\"', attr[key])
-
-                    query += ', {}: "{}"'.format(key, attr[key])
-                else:
-                    query += ", {}: {}".format(key, attr[key])
-            query += "})"
-            #query = re.sub(b'\xa0', b'', query.encode('utf-8'))
-            try:
-                self.session.run(query)
-            except exceptions.CypherSyntaxError:
-                error += [node]
+            label = attr[nlab]
+            if label not in queries:
+                queries[label] = self.node_query(label, mode)
+            row = self.__props(attr)
+            row['id'] = node
+            groups[label].append(row)
+            self.__flush(groups, label, queries[label], batch, error)
+
+        for label in groups:
+            self.__flush(groups, label, queries[label], 1, error)
         return error
 
-    def import_edges(self, graph, nlab, elab):
-        for (n0, n1, attr) in graph.edges.data():
-            query = "MATCH (a:{} {{id: '{}'}})".format(
-                    graph.nodes[n0][nlab], n0)
-            query += " MATCH (b:{} {{id: '{}'}})".format(
-                     graph.nodes[n1][nlab], n1)
-            query += " MERGE (a) - [:{} {{elabel: '{}'".format(
-                     attr[elab], attr[elab])
-
-            for key in attr.keys():
-                if isNaN(attr[key]):
-                    continue
-
-                if isinstance(attr[key], str):
-                    query += ', {}: "{}"'.format(key, attr[key])
-                else:
-                    query += ", {}: {}".format(key, attr[key])
+    def __labeled_edges(self, graph, nlab):
+        # a GraphSnapshot knows the labels of the endpoints of its edges
+        if hasattr(graph, 'labeled_edges'):
+            return graph.labeled_edges()
+        return ((n0, n1, attr, graph.nodes[n0][nlab], graph.nodes[n1][nlab])
+                for (n0, n1, attr) in graph.edges.data())
 
-            query += "}] -> (b)"
-            self.session.run(query)
+    def import_edges(self, graph, nlab, elab, batch=10000, mode='MERGE'):
+        error = []
+        groups = defaultdict(list)
+        queries = {}
+        for (n0, n1, attr, label0, label1) in self.__labeled_edges(graph,
+                                                                   nlab):
+            props = self.__props(attr)
+            key = (attr[elab], label0, label1)
+            if mode == 'MERGE':
+                key += tuple(sorted(props.keys()))
+            if key not in queries:
+                queries[key] = self.edge_query(*key[:3], keys=key[3:],
+                                               mode=mode)
+            groups[key].append({'source': n0, 'target': n1, 'props': props})
+            self.__flush(groups, key, queries[key], batch, error)
+
+        for key in groups:
+            self.__flush(groups, key, queries[key], 1, error)
+        return error
 
 
 if __name__ == '__main__':
+    from util.graph_snapshot import GraphSnapshot, is_snapshot
+
     with open("neo4j_creds.yaml", 'r') as stream:
         try:
             creds = yaml.safe_load(stream)
@@ -103,16 +178,29 @@ if __name__ == '__main__':
     nim.constraints()
     nim.delete_graph()
 
-    for file in os.listdir('./gpickle/'):
-        if not file.endswith('.gpickle'):
+    # snapshots are streamed; pickled graphs of ./gpickle/ are still read
+    files = [os.path.join('./snapshot/', file) for file
+             in sorted(os.listdir('./snapshot/'))] \
+        if os.path.exists('./snapshot/') else []
+    if os.path.exists('./gpickle/'):
+        files += [os.path.join('./gpickle/', file) for file
+                  in sorted(os.listdir('./gpickle/'))
+                  if file.endswith('.gpickle')]
+
+    for path in files:
+        if not is_snapshot(path) and not path.endswith('.gpickle'):
             continue
-        print('\n{}'.format(file))
+        print('\n{}'.format(os.path.basename(path)))
 
         t1 = time()
-        print('\tReading gpickle')
-        graph = nx.read_gpickle('./gpickle/'+file)
+        print('\tReading graph')
+        if is_snapshot(path):
+            graph = GraphSnapshot(path)
+        else:
+            with open(path, 'rb') as f:
+                graph = pickle.load(f)
         t2 = time()
-        print("\t\tTime elapsed for reading gpickle: {:.2f} sec".format(t2-t1))
+        print("\t\tTime elapsed for reading graph: {:.2f} sec".format(t2-t1))
         t1 = time()
         print('\tImporting nodes')
         error = nim.import_nodes(graph, 'nlabel')
@@ -120,7 +208,7 @@ if __name__ == '__main__':
         print("\t\tTime elapsed for importing nodes: {:.2f} sec".format(t2-t1))
         t1 = time()
         print('\tImporting edges')
-        nim.import_edges(graph, 'nlabel', 'elabel')
+        error += nim.import_edges(graph, 'nlabel', 'elabel')
         t2 = time()
         print("\t\tTime elapsed for importing edges: {:.2f} sec".format(t2-t1))
         t1 = time()
@@ -0,0 +1,136 @@
+import re
+from collections import defaultdict
+from itertools import islice
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from util.compact_graph import missing
+
+non_word = re.compile(r'[^\w]')
+
+
+def isNaN(s):
+    return s != s
+
+
+def sanitize(values):
+    # replaces the non-word characters of an array of strings; the distinct
+    # strings are replaced once, with pandas' str.replace, which uses re and
+    # so keeps the unicode meaning of \w
+    codes, uniques = pd.factorize(values)
+    cleaned = pd.Series(uniques, dtype=object).str.replace(non_word, '_',
+                                                           regex=True)
+    return cleaned.values[codes]
+
+
+def clean_column(values):
+    """Cleans an object array of the values of one attribute, with missing
+    where a node does not have it: lists and sets are joined with spaces,
+    strings are sanitized and NaN values are dropped. Returns the cleaned
+    values and a mask of the ones to keep."""
+    types = pd.Series(values, dtype=object).map(type)
+    kind = {t: 1 if issubclass(t, (list, set)) else
+            2 if issubclass(t, str) else 0 for t in types.unique()}
+    kinds = types.map(kind).values
+    keep = (types != type(missing)).values.copy()
+
+    joined = np.flatnonzero(kinds == 1)
+    if len(joined) > 0:
+        values[joined] = [' '.join(value) for value in values[joined]]
+    strings = np.flatnonzero(kinds > 0)
+    if len(strings) > 0:
+        values[strings] = sanitize(values[strings])
+    others = np.flatnonzero(keep & (kinds == 0))
+    if len(others) > 0:
+        keep[others] = [not isNaN(value) for value in values[others]]
+    return values, keep
+
+
+def clean_table(attrs):
+    # cleans the attributes of nodes of the same label column by column.
+    # The dicts are rebuilt for groups of nodes with the same keys, in
+    # order, so every node keeps the order of its keys.
+    shapes = defaultdict(list)
+    for i, attr in enumerate(attrs):
+        shapes[tuple(attr)].append(i)
+    columns = {}
+    for key in dict.fromkeys(key for keys in shapes for key in keys):
+        values = np.empty(len(attrs), dtype=object)
+        values[:] = [attr.get(key, missing) for attr in attrs]
+        columns[key] = clean_column(values)
+
+    cleaned = [None] * len(attrs)
+    for keys, rows in shapes.items():
+        if len(keys) == 0:
+            for i in rows:
+                cleaned[i] = {}
+            continue
+        rows = np.array(rows)
+        values = [columns[key][0][rows].tolist() for key in keys]
+        for i, row in zip(rows.tolist(), zip(*values)):
+            cleaned[i] = dict(zip(keys, row))
+        for key in keys:
+            for i in rows[~columns[key][1][rows]].tolist():
+                del cleaned[i][key]
+    return cleaned
+
+
+def clean_attributes(attrs, nlab='nlabel'):
+    """Cleans a list of node attribute dicts for GraphML export, as one
+    table per label, and returns new dicts in the same order. Lists and
+    sets are joined with spaces, every non-word character of a string value
+    (labels included) is replaced by '_' and NaN values are dropped."""
+    partitions = defaultdict(list)
+    for i, attr in enumerate(attrs):
+        partitions[attr.get(nlab)].append(i)
+    cleaned = [None] * len(attrs)
+    for rows in partitions.values():
+        for i, attr in zip(rows, clean_table([attrs[i] for i in rows])):
+            cleaned[i] = attr
+    return cleaned
+
+
+def clean_block(block):
+    nlab, attrs = block
+    return clean_attributes(attrs, nlab)
+
+
+def clean_nodes(nodes, nlab='nlabel', block=100000, workers=1):
+    """Cleans a stream of (node, attr) tuples, block nodes at a time, with
+    the blocks spread over workers processes. The nodes are yielded in the
+    order they came."""
+    nodes = iter(nodes)
+    blocks = iter(lambda: list(islice(nodes, block)), [])
+
+    def tasks(blocks, keys):
+        for items in blocks:
+            keys.append([node for (node, _) in items])
+            yield (nlab, [attr for (_, attr) in items])
+
+    keys = []
+    if workers > 1:
+        with Pool(workers) as pool:
+            for attrs in pool.imap(clean_block, tasks(blocks, keys)):
+                yield from zip(keys.pop(0), attrs)
+    else:
+        for attrs in map(clean_block, tasks(blocks, keys)):
+            yield from zip(keys.pop(0), attrs)
+
+
+def clean_graph(graph, nlab='nlabel', block=100000, workers=1):
+    # cleans the node attributes of a graph in place, through add_node and
+    # remove_node_attrs so that the indexes of the graph stay up to date
+    cleaned = list(clean_nodes(graph.nodes.data(), nlab, block, workers))
+    for (node, attr) in cleaned:
+        data = graph.nodes[node]
+        removed = [key for key in data if key not in attr]
+        # by value and type: the cleaned values of a worker are new objects
+        changed = {key: value for key, value in attr.items()
+                   if key not in data or (data[key] is not value and (
+                       type(data[key]) is not type(value) or
+                       not data[key] == value))}
+        if removed:
+            graph.remove_node_attrs(node, removed)
+        if changed:
+            graph.add_node(node, **changed)
+    return graph
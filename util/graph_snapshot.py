@@ -0,0 +1,476 @@
+import gc
+import json
+import os
+import pickle
+import shutil
+from array import array
+from collections import defaultdict
+from time import time
+import numpy as np
+from util.compact_graph import CompactGraph, missing
+from util.indexed_graph import IndexedMultiDiGraph
+
+snapshot_format = 'graph-snapshot'
+snapshot_version = 1
+
+
+def isNaN(s):
+    return s != s
+
+
+# types of the common values, checked before the general case
+value_types = {str: 'str', int: 'int', float: 'float', bool: 'bool',
+               type(None): 'none'}
+
+
+def value_type(value):
+    kind = value_types.get(type(value))
+    if kind is None:
+        if isinstance(value, bool) or type(value).__name__.startswith('bool'):
+            kind = 'bool'
+        elif isinstance(value, int) or \
+                type(value).__name__.startswith('int'):
+            kind = 'int'
+        elif isinstance(value, float) or \
+                type(value).__name__.startswith('float'):
+            kind = 'float'
+        elif isinstance(value, str):
+            kind = 'str'
+        elif isinstance(value, list) and all(isinstance(v, str)
+                                             for v in value):
+            return 'list'
+        else:
+            return 'object'
+    if kind == 'float' and isNaN(value):
+        return 'nan'
+    return kind
+
+
+def column_type(types):
+    # (type, flags) of a column from the types of its values. A NaN or None
+    # in a column of another type is kept in a flag column next to it;
+    # mixed columns are pickled, which keeps every value as it is.
+    values = types - {'none', 'nan'}
+    if len(values) == 0 or values == {'float'}:
+        return ('float', 'none' in types)
+    if len(values) == 1 and 'object' not in values:
+        return (values.pop(), len(types) > 1)
+    return ('object', False)
+
+
+def arrow_type(kind):
+    import pyarrow as pa
+    return {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(),
+            'bool': pa.bool_(), 'list': pa.list_(pa.string()),
+            'object': pa.binary()}[kind]
+
+
+# flag values: 0 for a value or a missing attribute, else NaN or None
+flag_values = {'nan': 1, 'none': 2}
+
+
+def flag_column(key):
+    return '{}.__flag__'.format(key)
+
+
+class TableWriter():
+    # buffers the rows of one node or edge label and writes them as Parquet
+    # row groups of row_group rows
+
+    def __init__(self, path, key, columns, row_group):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.columns = columns
+        self.row_group = row_group
+        self.key = key
+        fields = []
+        if key is not None:
+            fields.append(pa.field('__key', arrow_type(key)))
+        for name, meta in columns.items():
+            fields.append(pa.field(name, arrow_type(meta['type'])))
+            if meta['flags']:
+                fields.append(pa.field(flag_column(name), pa.int8()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.keys = []
+        self.rows = []
+
+    def append(self, key, attr):
+        self.keys.append(key)
+        self.rows.append(attr)
+        if len(self.rows) == self.row_group:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        if len(self.rows) == 0:
+            return
+        data = []
+        if self.key is not None:
+            data.append(self.__encode(self.keys, self.key))
+        for name, meta in self.columns.items():
+            values = [attr.get(name, missing) for attr in self.rows]
+            data.append(self.__encode(values, meta['type']))
+            if meta['flags']:
+                data.append([flag_values.get(value_type(attr[name]), 0)
+                             if name in attr else 0
+                             for attr in self.rows])
+        self.writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for (values, field)
+                 in zip(data, self.schema)], schema=self.schema))
+        self.keys = []
+        self.rows = []
+
+    def __encode(self, values, kind):
+        if kind == 'object':
+            return [None if v is missing else
+                    pickle.dumps(v, pickle.HIGHEST_PROTOCOL) for v in values]
+        if kind == 'float':
+            return [None if v is missing else v for v in values]
+        return [None if v is missing or v is None or isNaN(v) else v
+                for v in values]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def write_snapshot(graph, path, nlab='nlabel', elab='elabel',
+                   row_group=100000):
+    """Writes a graph as a snapshot directory:
+
+    * ``manifest.json`` with the format version, the labels and the schema
+      of every node and edge table;
+    * ``nodes/<i>.parquet``, one table per node label, with the node key in
+      the ``__key`` column and one column per attribute;
+    * ``edges/<i>.src.npy`` and ``edges/<i>.dst.npy``, one pair of int64
+      arrays per edge label with the ids of the endpoints, and
+      ``edges/<i>.parquet`` with the edge attributes, if there are any.
+
+    The id of a node is its row in the table of its label plus the offset
+    of the table. Edge keys of multigraphs are not kept. The snapshot is
+    written next to path and moved in place once complete.
+    """
+    # first pass: labels and the types of their attributes
+    node_types = defaultdict(lambda: defaultdict(set))
+    key_types = defaultdict(set)
+    for node, attr in graph.nodes.data():
+        label = attr.get(nlab)
+        key_types[label].add(value_type(node))
+        types = node_types[label]
+        for key, value in attr.items():
+            if key != nlab:
+                types[key].add(value_type(value))
+    edge_types = defaultdict(lambda: defaultdict(set))
+    for _, _, attr in graph.edges.data():
+        types = edge_types[attr.get(elab)]
+        for key, value in attr.items():
+            if key != elab:
+                types[key].add(value_type(value))
+
+    def schema(types):
+        columns = {}
+        for key, kinds in types.items():
+            kind, flag = column_type(kinds)
+            columns[key] = {'type': kind, 'flags': flag}
+        return columns
+
+    tmp = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(os.path.join(tmp, 'nodes'))
+    os.makedirs(os.path.join(tmp, 'edges'))
+
+    # second pass: node tables, and the id of every node
+    manifest = {'format': snapshot_format, 'version': snapshot_version,
+                'created': int(time()), 'nlab': nlab, 'elab': elab,
+                'row_group': row_group, 'nodes': [], 'edges': []}
+    writers = {}
+    for i, label in enumerate(node_types):
+        kind, flag = column_type(key_types[label])
+        meta = {'label': label, 'file': 'nodes/{}.parquet'.format(i),
+                'key': 'object' if flag else kind,
+                'rows': 0, 'offset': 0, 'columns': schema(node_types[label])}
+        manifest['nodes'].append(meta)
+        writers[label] = TableWriter(os.path.join(tmp, meta['file']),
+                                     meta['key'], meta['columns'], row_group)
+    ids = {}
+    rows = defaultdict(list)
+    for node, attr in graph.nodes.data():
+        label = attr.get(nlab)
+        rows[label].append(node)
+        writers[label].append(node, attr)
+    offset = 0
+    for meta in manifest['nodes']:
+        writers[meta['label']].close()
+        nodes = rows.pop(meta['label'])
+        meta['rows'] = len(nodes)
+        meta['offset'] = offset
+        ids.update(zip(nodes, range(offset, offset + len(nodes))))
+        offset += len(nodes)
+
+    # edges: endpoint arrays and attribute tables per edge label
+    writers = {}
+    ends = {}
+    for i, label in enumerate(edge_types):
+        columns = schema(edge_types[label])
+        meta = {'label': label, 'src': 'edges/{}.src.npy'.format(i),
+                'dst': 'edges/{}.dst.npy'.format(i), 'file': None, 'rows': 0,
+                'columns': columns}
+        if len(columns) > 0:
+            meta['file'] = 'edges/{}.parquet'.format(i)
+            writers[label] = TableWriter(os.path.join(tmp, meta['file']),
+                                         None, columns, row_group)
+        manifest['edges'].append(meta)
+        ends[label] = (array('q'), array('q'))
+    for u, v, attr in graph.edges.data():
+        label = attr.get(elab)
+        src, dst = ends[label]
+        src.append(ids[u])
+        dst.append(ids[v])
+        if label in writers:
+            writers[label].append(None, attr)
+    for meta in manifest['edges']:
+        if meta['label'] in writers:
+            writers[meta['label']].close()
+        src, dst = ends.pop(meta['label'])
+        meta['rows'] = len(src)
+        np.save(os.path.join(tmp, meta['src']), np.frombuffer(src, np.int64))
+        np.save(os.path.join(tmp, meta['dst']), np.frombuffer(dst, np.int64))
+
+    manifest['no_nodes'] = offset
+    manifest['no_edges'] = sum(meta['rows'] for meta in manifest['edges'])
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def decode(table, columns):
+    # the columns of a row group as lists of values, missing where a row
+    # does not have the attribute
+    decoded = []
+    for name, meta in columns.items():
+        values = table.column(name).to_pylist()
+        if meta['type'] == 'object':
+            values = [missing if v is None else pickle.loads(v)
+                      for v in values]
+        else:
+            values = [missing if v is None else v for v in values]
+        if meta['flags']:
+            flag = table.column(flag_column(name)).to_numpy()
+            for row in np.flatnonzero(flag):
+                values[row] = float('nan') if flag[row] == 1 else None
+        decoded.append((name, values))
+    return decoded
+
+
+def rows(decoded, size, attr=()):
+    for row in range(size):
+        data = dict(attr)
+        for name, values in decoded:
+            if values[row] is not missing:
+                data[name] = values[row]
+        yield data
+
+
+class SnapshotNodes():
+    # the part of the networkx node view the writers and loaders use
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __iter__(self):
+        for meta in self.snapshot.node_tables:
+            yield from self.snapshot.keys(meta)
+
+    def __len__(self):
+        return self.snapshot.number_of_nodes()
+
+    def data(self):
+        return self.snapshot.node_data()
+
+
+class SnapshotEdges():
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __iter__(self):
+        for (u, v, _) in self.snapshot.edge_data():
+            yield (u, v)
+
+    def __len__(self):
+        return self.snapshot.number_of_edges()
+
+    def data(self):
+        return self.snapshot.edge_data()
+
+
+class GraphSnapshot():
+    """Read side of a snapshot written by write_snapshot.
+
+    Nothing is loaded up front: ``nodes.data()`` and ``edges.data()``
+    stream the tables one Parquet row group at a time, with the files and
+    the edge arrays memory-mapped, so the GraphML and Neo4j writers and
+    loaders can read a snapshot as if it were a graph. ``nlabels`` and
+    ``elabels`` restrict it to some node and edge labels; edges are kept
+    only if both their endpoints are. ``load`` builds an in-memory graph.
+    """
+
+    def __init__(self, path, nlabels=None, elabels=None):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != snapshot_format or \
+                manifest.get('version', 0) > snapshot_version:
+            raise ValueError('Not a graph snapshot of version {} or older: '
+                             '{}'.format(snapshot_version, path))
+        self.path = path
+        self.manifest = manifest
+        self.nlab = manifest['nlab']
+        self.elab = manifest['elab']
+        self.node_tables = [meta for meta in manifest['nodes']
+                            if nlabels is None or meta['label'] in nlabels]
+        self.edge_tables = [meta for meta in manifest['edges']
+                            if elabels is None or meta['label'] in elabels]
+        self.offsets = np.array([meta['offset'] for meta
+                                 in manifest['nodes']], dtype=np.int64)
+        self.labels = np.empty(len(manifest['nodes']), dtype=object)
+        self.labels[:] = [meta['label'] for meta in manifest['nodes']]
+        self.selected = np.array([meta in self.node_tables for meta
+                                  in manifest['nodes']], dtype=bool)
+        self.nodes = SnapshotNodes(self)
+        self.edges = SnapshotEdges(self)
+        self.__keys = None
+        self.__no_edges = None
+
+    def __file(self, name):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(os.path.join(self.path, name),
+                              memory_map=True)
+
+    def __array(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+    def number_of_nodes(self):
+        return sum(meta['rows'] for meta in self.node_tables)
+
+    def number_of_edges(self):
+        if self.__no_edges is None:
+            self.__no_edges = sum(int(self.__mask(meta).sum()) if
+                                  self.__filtered() else meta['rows']
+                                  for meta in self.edge_tables)
+        return self.__no_edges
+
+    def keys(self, meta):
+        # the node keys of a node table, in id order
+        f = self.__file(meta['file'])
+        column = {'__key': {'type': meta['key'], 'flags': False}}
+        for i in range(f.num_row_groups):
+            yield from decode(f.read_row_group(i, columns=['__key']),
+                              column)[0][1]
+
+    def node_data(self):
+        nlab = self.nlab
+        for meta in self.node_tables:
+            f = self.__file(meta['file'])
+            key = {'__key': {'type': meta['key'], 'flags': False}}
+            attr = () if meta['label'] is None else ((nlab, meta['label']),)
+            for i in range(f.num_row_groups):
+                table = f.read_row_group(i)
+                keys = decode(table, key)[0][1]
+                yield from zip(keys, rows(decode(table, meta['columns']),
+                                          table.num_rows, attr))
+
+    def __filtered(self):
+        return not self.selected.all()
+
+    def __table(self, ids):
+        return np.searchsorted(self.offsets, ids, 'right') - 1
+
+    def __mask(self, meta, start=0, stop=None):
+        src = self.__array(meta['src'])[start:stop]
+        dst = self.__array(meta['dst'])[start:stop]
+        return self.selected[self.__table(src)] & \
+            self.selected[self.__table(dst)]
+
+    def __node_keys(self):
+        # the keys of the selected nodes by id, looked up for the edges
+        if self.__keys is None:
+            keys = np.empty(self.manifest['no_nodes'], dtype=object)
+            for meta in self.node_tables:
+                keys[meta['offset']:meta['offset'] + meta['rows']] = \
+                    list(self.keys(meta))
+            self.__keys = keys
+        return self.__keys
+
+    def __chunks(self, meta):
+        # (src, dst, attributes) of every edge, by row group
+        elab = self.elab
+        attr = () if meta['label'] is None else ((elab, meta['label']),)
+        src = self.__array(meta['src'])
+        dst = self.__array(meta['dst'])
+        if meta['file'] is None:
+            step = self.manifest['row_group']
+            for start in range(0, meta['rows'], step):
+                yield (np.asarray(src[start:start+step]),
+                       np.asarray(dst[start:start+step]),
+                       rows((), min(step, meta['rows'] - start), attr))
+            return
+        f = self.__file(meta['file'])
+        start = 0
+        for i in range(f.num_row_groups):
+            table = f.read_row_group(i)
+            stop = start + table.num_rows
+            yield (np.asarray(src[start:stop]), np.asarray(dst[start:stop]),
+                   rows(decode(table, meta['columns']), table.num_rows,
+                        attr))
+            start = stop
+
+    def __edges(self):
+        keys = self.__node_keys()
+        for meta in self.edge_tables:
+            for (src, dst, data) in self.__chunks(meta):
+                if self.__filtered():
+                    keep = self.selected[self.__table(src)] & \
+                        self.selected[self.__table(dst)]
+                    data = (attr for (attr, k) in zip(data, keep) if k)
+                    src, dst = src[keep], dst[keep]
+                yield src, dst, keys[src], keys[dst], data
+
+    def edge_data(self):
+        for (_, _, u, v, data) in self.__edges():
+            yield from zip(u.tolist(), v.tolist(), data)
+
+    def labeled_edges(self):
+        """Yields ``(u, v, attr, nlabel_u, nlabel_v)``, with the labels of
+        the endpoints taken from the ids instead of looking the nodes up."""
+        for (src, dst, u, v, data) in self.__edges():
+            yield from zip(u.tolist(), v.tolist(), data,
+                           self.labels[self.__table(src)].tolist(),
+                           self.labels[self.__table(dst)].tolist())
+
+    def load(self, graph=None):
+        if graph is None:
+            graph = IndexedMultiDiGraph()
+        # the cyclic collector would rescan the growing graph over and over
+        # while millions of attribute dicts are added
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            graph.add_nodes_from(self.nodes.data())
+            graph.add_edges_from(self.edges.data())
+        finally:
+            if enabled:
+                gc.enable()
+        return graph
+
+
+def read_snapshot(path, nlabels=None, elabels=None, compact=False):
+    graph = CompactGraph() if compact else IndexedMultiDiGraph()
+    return GraphSnapshot(path, nlabels, elabels).load(graph)
+
+
+def is_snapshot(path):
+    return os.path.isfile(os.path.join(path, 'manifest.json'))
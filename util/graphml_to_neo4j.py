@@ -43,7 +43,9 @@ class Neo4jImporter(object):
 
     def import_files(self, files, path):
         queries = ["CALL apoc.import.graphml('{}{}', {{batchSize:10000, "
-                   "storeNodeIds: true, readLabels: true}})".format(path, file)
+                   "storeNodeIds: true, readLabels: true{}}})".format(
+                           path, file, ", compression: 'GZIP'"
+                           if file.endswith('.gz') else '')
                    for file in files]
 
         for file, query in zip(files, queries):
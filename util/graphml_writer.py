@@ -0,0 +1,131 @@
+import gzip
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+
+class GraphMLWriter():
+    """Streaming GraphML serializer.
+
+    Nodes and edges are written from iterators of ``(node, attr)`` and
+    ``(source, target, attr)`` tuples into a temporary body file while the
+    key schema is collected; on close the header and the <key> declarations
+    are written and the body is copied after them. Memory stays bounded by
+    the key schema and one output block, regardless of the graph size.
+    Node ids are the graph keys themselves, so no id map is kept.
+    """
+
+    header = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+              'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+              'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns'
+              ' http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+
+    def __init__(self, path, nlab='nlabel', elab='elabel', rename=None,
+                 quote=(), compress=False, block=10000):
+        self.path = path + '.gz' if compress and \
+            not path.endswith('.gz') else path
+        self.nlab = nlab
+        self.elab = elab
+        self.rename = dict(rename) if rename is not None else {}
+        self.quote = set(quote)
+        self.compress = compress
+        self.block = block
+
+        self.node_keys = {'labels': None}
+        self.edge_keys = {'label': None}
+        self.no_nodes = 0
+        self.no_edges = 0
+        self.body = tempfile.TemporaryFile(
+                dir=os.path.dirname(os.path.abspath(self.path)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.body.close()
+
+    def __value(self, key, value):
+        value = escape('{}'.format(value))
+        if key in self.quote:
+            return '"{}"'.format(value)
+        return value
+
+    def __write(self, lines):
+        self.body.write(''.join(lines).encode('utf-8'))
+
+    def write_nodes(self, nodes):
+        lines = []
+        for (node, attr) in nodes:
+            label = escape('{}'.format(attr[self.nlab]))
+            lines.append('<node id={} labels=":{}">'
+                         '<data key="labels">:{}</data>\n'.format(
+                                 quoteattr('{}'.format(node)), label, label))
+            for key in attr:
+                if key == self.nlab:
+                    continue
+                name = self.rename.get(key, key)
+                self.node_keys[name] = None
+                lines.append('  <data key={}>{}</data>\n'.format(
+                        quoteattr(name), self.__value(key, attr[key])))
+            lines.append('</node>\n')
+            self.no_nodes += 1
+
+            if self.no_nodes % self.block == 0:
+                self.__write(lines)
+                lines = []
+        self.__write(lines)
+
+    def write_edges(self, edges):
+        lines = []
+        for (s, t, attr) in edges:
+            label = escape('{}'.format(attr[self.elab]))
+            lines.append('<edge id="e{}" source={} target={} label="{}">'
+                         '<data key="label">{}</data>\n'.format(
+                                 self.no_edges, quoteattr('{}'.format(s)),
+                                 quoteattr('{}'.format(t)), label, label))
+            for key in attr:
+                if key == self.elab:
+                    continue
+                self.edge_keys[key] = None
+                lines.append('  <data key={}>{}</data>\n'.format(
+                        quoteattr(key), self.__value(key, attr[key])))
+            lines.append('</edge>\n')
+            self.no_edges += 1
+
+            if self.no_edges % self.block == 0:
+                self.__write(lines)
+                lines = []
+        self.__write(lines)
+
+    def close(self):
+        if self.compress:
+            f = gzip.open(self.path, 'wb', compresslevel=6)
+        else:
+            f = open(self.path, 'wb', buffering=1 << 24)
+        with f:
+            lines = [self.header]
+            for key in self.node_keys:
+                lines.append('<key id={} for="node" attr.name={}/>\n'.format(
+                        quoteattr(key), quoteattr(key)))
+            for key in self.edge_keys:
+                lines.append('<key id={} for="edge" attr.name={}/>\n'.format(
+                        quoteattr(key), quoteattr(key)))
+            lines.append('<graph id="G" edgedefault="directed">\n')
+            f.write(''.join(lines).encode('utf-8'))
+
+            self.body.seek(0)
+            shutil.copyfileobj(self.body, f, 1 << 24)
+            f.write(b'</graph>\n</graphml>\n')
+        self.body.close()
+
+
+def write_graphml(graph, path, nlab='nlabel', elab='elabel', **kwargs):
+    with GraphMLWriter(path, nlab, elab, **kwargs) as writer:
+        writer.write_nodes(graph.nodes.data())
+        writer.write_edges(graph.edges.data())
+    return writer.path
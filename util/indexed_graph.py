@@ -0,0 +1,337 @@
+import networkx as nx
+from collections import Counter, defaultdict
+
+# networkx 3 caches views of a graph and clears them when it is changed
+clear_cache = getattr(nx, '_clear_cache', lambda graph: None)
+
+
+class IndexedMultiDiGraph(nx.MultiDiGraph):
+    """MultiDiGraph that keeps secondary indexes up to date as nodes and
+    edges are added or removed:
+
+        node_index[attr][value] -> set of nodes, for attr in index_attrs
+        node_counts[(source, nlabel)] -> number of nodes
+        edge_counts[(source, elabel, nlabel_u, nlabel_v)] -> number of edges
+        pending[nlabel] -> set of nodes without pending_attr, if it is set
+
+    Attributes written directly through ``graph.nodes[n][attr] = value``
+    bypass the indexes, so indexed attributes must be set with add_node.
+    """
+
+    index_attrs = ('nlabel', 'source')
+    pending_attr = None
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        self.node_index = {a: defaultdict(set) for a in self.index_attrs}
+        self.pending = defaultdict(set)
+        self.node_counts = Counter()
+        self.edge_counts = Counter()
+        nx.MultiDiGraph.__init__(self, incoming_graph_data, **attr)
+
+    # index maintenance
+
+    def __values(self, attrs):
+        values = tuple(attrs.get(a) for a in self.index_attrs)
+        if self.pending_attr is not None:
+            values += ((attrs.get('nlabel'), self.pending_attr not in attrs),)
+        return values
+
+    def __update_pending(self, n, old, new):
+        if old == new:
+            return
+        if old is not None and old[1]:
+            nodes = self.pending.get(old[0])
+            if nodes is not None:
+                nodes.discard(n)
+                if not nodes:
+                    del self.pending[old[0]]
+        if new is not None and new[1]:
+            self.pending[new[0]].add(n)
+
+    def __count(self, counter, key, delta):
+        counter[key] += delta
+        if counter[key] <= 0:
+            del counter[key]
+
+    def __update_node(self, n, old):
+        new = self.__values(self._node[n]) if n in self._node else None
+        if old == new:
+            return
+        for i, attr in enumerate(self.index_attrs):
+            o = old[i] if old is not None else None
+            v = new[i] if new is not None else None
+            if o == v:
+                continue
+            if o is not None:
+                nodes = self.node_index[attr].get(o)
+                if nodes is not None:
+                    nodes.discard(n)
+                    if not nodes:
+                        del self.node_index[attr][o]
+            if v is not None:
+                self.node_index[attr][v].add(n)
+        if old is not None:
+            self.__count(self.node_counts, self.__node_key(old), -1)
+        if new is not None:
+            self.__count(self.node_counts, self.__node_key(new), 1)
+        if self.pending_attr is not None:
+            self.__update_pending(n, old[-1] if old is not None else None,
+                                  new[-1] if new is not None else None)
+
+    def __node_key(self, values):
+        values = dict(zip(self.index_attrs, values))
+        return (values.get('source'), values.get('nlabel'))
+
+    def __edge_key(self, u, v, attr):
+        return (attr.get('source'), attr.get('elabel'),
+                self._node[u].get('nlabel'), self._node[v].get('nlabel'))
+
+    def __changes(self, data, attr):
+        # whether updating data with attr would change any value or type
+        for key, value in attr.items():
+            if key not in data:
+                return True
+            old = data[key]
+            if old is not value and (type(old) is not type(value) or
+                                     not old == value):
+                return True
+        return False
+
+    def __incident_edges(self, n):
+        edges = [(n, v, d) for v, keydict in self._succ[n].items()
+                 for d in keydict.values()]
+        edges += [(u, n, d) for u, keydict in self._pred[n].items()
+                  if u != n for d in keydict.values()]
+        return edges
+
+    # overridden mutators
+
+    def add_node(self, node_for_adding, **attr):
+        n = node_for_adding
+        old = None
+        edges = []
+        if n in self._node:
+            old = self.__values(self._node[n])
+            if 'nlabel' in attr and \
+                    attr['nlabel'] != self._node[n].get('nlabel'):
+                edges = self.__incident_edges(n)
+        old_keys = [self.__edge_key(u, v, d) for (u, v, d) in edges]
+
+        nx.MultiDiGraph.add_node(self, n, **attr)
+        self.__update_node(n, old)
+
+        for key in old_keys:
+            self.__count(self.edge_counts, key, -1)
+        for (u, v, d) in edges:
+            self.__count(self.edge_counts, self.__edge_key(u, v, d), 1)
+
+    def remove_node_attrs(self, n, keys):
+        # deletes attributes of node n through the indexes, which writes to
+        # graph.nodes[n] would bypass
+        data = self._node[n]
+        keys = [key for key in keys if key in data]
+        if not keys:
+            return
+        old = self.__values(data)
+        edges = self.__incident_edges(n) if 'nlabel' in keys else []
+        old_keys = [self.__edge_key(u, v, d) for (u, v, d) in edges]
+        for key in keys:
+            del data[key]
+        self.__update_node(n, old)
+
+        for key in old_keys:
+            self.__count(self.edge_counts, key, -1)
+        for (u, v, d) in edges:
+            self.__count(self.edge_counts, self.__edge_key(u, v, d), 1)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        # bulk path: a new node is created and indexed directly, and an
+        # update that changes no value is skipped; other updates go through
+        # add_node, which also recounts the incident edges
+        for n in nodes_for_adding:
+            try:
+                hash(n)
+                newdict = attr
+            except TypeError:
+                n, ndict = n
+                newdict = attr.copy()
+                newdict.update(ndict)
+            data = self._node.get(n)
+            if data is None and n is not None:
+                self._succ[n] = self.adjlist_inner_dict_factory()
+                self._pred[n] = self.adjlist_inner_dict_factory()
+                data = self._node[n] = self.node_attr_dict_factory()
+                data.update(newdict)
+                self.__update_node(n, None)
+            elif data is None or self.__changes(data, newdict):
+                self.add_node(n, **newdict)
+        clear_cache(self)
+
+    def add_edge(self, u_for_edge, v_for_edge, key=None, **attr):
+        u, v = u_for_edge, v_for_edge
+        new_u = u not in self._node
+        new_v = v not in self._node
+        if key is not None and not new_u and v in self._succ[u] \
+                and key in self._succ[u][v]:
+            self.__count(self.edge_counts,
+                         self.__edge_key(u, v, self._succ[u][v][key]), -1)
+
+        key = nx.MultiDiGraph.add_edge(self, u, v, key, **attr)
+        if new_u:
+            self.__update_node(u, None)
+        if new_v and v != u:
+            self.__update_node(v, None)
+        self.__count(self.edge_counts,
+                     self.__edge_key(u, v, self._succ[u][v][key]), 1)
+        return key
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        keylist = []
+        for e in ebunch_to_add:
+            ne = len(e)
+            if ne == 4:
+                u, v, key, dd = e
+            elif ne == 3:
+                u, v, dd = e
+                key = None
+            elif ne == 2:
+                u, v = e
+                dd = {}
+                key = None
+            else:
+                raise nx.NetworkXError(
+                        "Edge tuple {} must be a 2-tuple, 3-tuple or "
+                        "4-tuple.".format(e))
+            ddd = {}
+            ddd.update(attr)
+            try:
+                ddd.update(dd)
+            except (TypeError, ValueError):
+                if ne != 3:
+                    raise
+                key = dd
+            if key is None and u in self._node and v in self._node:
+                keylist.append(self.__append_edge(u, v, ddd))
+            else:
+                keylist.append(self.add_edge(u, v, key, **ddd))
+        clear_cache(self)
+        return keylist
+
+    def __append_edge(self, u, v, attr):
+        # add_edge between existing nodes, with a new key, inlined for
+        # add_edges_from
+        keydict = self._succ[u].get(v)
+        if keydict is None:
+            key = 0
+            keydict = self.edge_key_dict_factory()
+            self._succ[u][v] = keydict
+            self._pred[v][u] = keydict
+        else:
+            key = len(keydict)
+            while key in keydict:
+                key += 1
+        datadict = keydict[key] = self.edge_attr_dict_factory()
+        datadict.update(attr)
+        self.edge_counts[self.__edge_key(u, v, datadict)] += 1
+        return key
+
+    def remove_node(self, n):
+        if n in self._node:
+            for (u, v, d) in self.__incident_edges(n):
+                self.__count(self.edge_counts, self.__edge_key(u, v, d), -1)
+            old = self.__values(self._node[n])
+        nx.MultiDiGraph.remove_node(self, n)
+        self.__update_node(n, old)
+
+    def remove_nodes_from(self, nodes):
+        # bulk path: the edges of the removed nodes are uncounted together,
+        # each once, and only the adjacency of the remaining nodes is
+        # updated, instead of a networkx remove_node per node
+        nodes = set(n for n in nodes if n in self._node)
+        removed = Counter()
+        for n in nodes:
+            for v, keydict in self._succ[n].items():
+                for d in keydict.values():
+                    removed[self.__edge_key(n, v, d)] += 1
+            for u, keydict in self._pred[n].items():
+                if u not in nodes:
+                    for d in keydict.values():
+                        removed[self.__edge_key(u, n, d)] += 1
+        for key, count in removed.items():
+            self.__count(self.edge_counts, key, -count)
+
+        # the nodes are grouped by their index values, which are then
+        # dropped with one set difference per group
+        groups = defaultdict(list)
+        for n in nodes:
+            groups[self.__values(self._node[n])].append(n)
+            for v in self._succ[n]:
+                if v not in nodes:
+                    del self._pred[v][n]
+            for u in self._pred[n]:
+                if u not in nodes:
+                    del self._succ[u][n]
+            del self._succ[n]
+            del self._pred[n]
+            del self._node[n]
+        for values, group in groups.items():
+            for attr, value in zip(self.index_attrs, values):
+                if value is not None:
+                    self.__discard(self.node_index[attr], value, group)
+            self.__count(self.node_counts, self.__node_key(values),
+                         -len(group))
+            if self.pending_attr is not None and values[-1][1]:
+                self.__discard(self.pending, values[-1][0], group)
+        clear_cache(self)
+
+    def __discard(self, index, value, nodes):
+        remaining = index.get(value)
+        if remaining is not None:
+            remaining.difference_update(nodes)
+            if not remaining:
+                del index[value]
+
+    def remove_edge(self, u, v, key=None):
+        try:
+            keydict = self._succ[u][v]
+            if key is None:
+                key = next(reversed(keydict))
+            attr = keydict[key]
+        except (KeyError, StopIteration):
+            # let networkx raise its own error
+            return nx.MultiDiGraph.remove_edge(self, u, v, key)
+        nx.MultiDiGraph.remove_edge(self, u, v, key)
+        self.__count(self.edge_counts, self.__edge_key(u, v, attr), -1)
+
+    def clear(self):
+        nx.MultiDiGraph.clear(self)
+        self.node_index = {a: defaultdict(set) for a in self.index_attrs}
+        self.pending = defaultdict(set)
+        self.node_counts = Counter()
+        self.edge_counts = Counter()
+
+    def clear_edges(self):
+        nx.MultiDiGraph.clear_edges(self)
+        self.edge_counts = Counter()
+
+    # lookups
+
+    def nodes_by(self, attr, value):
+        return self.node_index[attr].get(value, set())
+
+    def pending_nodes(self, nlabel):
+        return self.pending.get(nlabel, set())
+
+    def node_values(self, attr):
+        return set(self.node_index[attr].keys())
+
+    def count_nodes(self, source, nlabel):
+        return self.node_counts[(source, nlabel)]
+
+    def edge_values(self):
+        return set([(elabel, nlabel1, nlabel2)
+                    for (source, elabel, nlabel1, nlabel2) in self.edge_counts
+                    if elabel is not None])
+
+    def count_edges(self, source, elabel, nlabel1, nlabel2):
+        return self.edge_counts[(source, elabel, nlabel1, nlabel2)]
@@ -0,0 +1,194 @@
+import csv
+import gzip
+import io
+import os
+import numpy as np
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def isNaN(s):
+    return s != s
+
+
+def value_type(value):
+    if isinstance(value, (bool, np.bool_)):
+        return 'boolean'
+    if isinstance(value, (list, set, tuple)):
+        return 'string[]'
+    if isinstance(value, int) or type(value).__name__.startswith('int'):
+        return 'long'
+    if isinstance(value, float) or type(value).__name__.startswith('float'):
+        return 'double'
+    return 'string'
+
+
+def merge_types(types):
+    if len(types) == 1:
+        return types.pop()
+    if types == {'long', 'double'}:
+        return 'double'
+    return 'string'
+
+
+# separates the items of array properties; set as --array-delimiter in
+# import.args, since neo4j-admin has no escape for it and ';' occurs in
+# names
+array_delimiter = '\x1f'
+
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, set, tuple)):
+        return array_delimiter.join(['{}'.format(v) for v in value])
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if isNaN(value):
+        return ''
+    return value
+
+
+def write_part(path, rows, compress):
+    # runs in the thread pool: zlib and file I/O release the GIL
+    data = rows.getvalue().encode('utf-8')
+    if compress:
+        data = gzip.compress(data, compresslevel=6)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class Neo4jCSVWriter():
+    """Writes a graph as neo4j-admin bulk-import CSV files: one header and
+    one or more part files per node label and per relationship type, plus
+    an argument file for ``neo4j-admin import @import.args``.
+
+    The property schema of every label and type is collected in a first pass
+    over the graph; the rows are then streamed into parts of ``part_size``
+    rows, which are (optionally gzipped and) written by ``workers`` threads.
+    The graph keys are the import ids and are stored in the ``key``
+    property; an ``id`` attribute is written like any other. Nodes without
+    a label get ``default_label``.
+    """
+
+    def __init__(self, path, nlab='nlabel', elab='elabel', compress=False,
+                 workers=1, part_size=1000000, default_label='Node'):
+        self.path = path
+        self.nlab = nlab
+        self.elab = elab
+        self.default_label = default_label
+        self.compress = compress
+        self.workers = workers
+        self.part_size = part_size
+        self.files = {'nodes': defaultdict(list),
+                      'relationships': defaultdict(list)}
+
+    def __schema(self, items):
+        types = defaultdict(lambda: defaultdict(set))
+        for (label, attr) in items:
+            keys = types[label]
+            for key in attr:
+                if key in (self.nlab, self.elab) or isNaN(attr[key]):
+                    continue
+                keys[key].add(value_type(attr[key]))
+        return {label: [(key, merge_types(t)) for key, t in keys.items()]
+                for label, keys in types.items()}
+
+    def __file(self, kind, label, name):
+        folder = os.path.join(self.path, kind)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return os.path.join(folder, '{}.{}'.format(
+                str(label).replace(os.sep, '_'), name))
+
+    def __write_header(self, kind, label, header):
+        path = self.__file(kind, label, 'header.csv')
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerow(header)
+        self.files[kind][label].insert(0, path)
+
+    def __write(self, kind, items, row, pool):
+        buffers = {}
+        counts = defaultdict(int)
+        parts = defaultdict(int)
+        futures = deque()
+
+        def flush(label):
+            path = self.__file(kind, label, 'part{:04d}.csv{}'.format(
+                    parts[label], '.gz' if self.compress else ''))
+            parts[label] += 1
+            # at most workers parts wait for a thread, so the buffered rows
+            # stay bounded when the writes are slower than the rows
+            while len(futures) > self.workers:
+                futures.popleft().result()
+            futures.append(pool.submit(write_part, path,
+                                       buffers.pop(label)[0], self.compress))
+            self.files[kind][label].append(path)
+
+        for (label, item) in items:
+            if label not in buffers:
+                buffer = io.StringIO()
+                buffers[label] = (buffer, csv.writer(buffer))
+            buffers[label][1].writerow(row(label, item))
+            counts[label] += 1
+            if counts[label] % self.part_size == 0:
+                flush(label)
+
+        for label in list(buffers.keys()):
+            flush(label)
+        for future in futures:
+            future.result()
+        return counts
+
+    def write(self, graph):
+        nlab, elab = self.nlab, self.elab
+
+        def node_label(attr):
+            return attr.get(nlab, self.default_label)
+
+        node_schema = self.__schema((node_label(attr), attr) for (node, attr)
+                                    in graph.nodes.data())
+        edge_schema = self.__schema((attr[elab], attr) for (s, t, attr)
+                                    in graph.edges.data())
+
+        for label in node_schema:
+            self.__write_header('nodes', label, ['key:ID'] + [
+                    '{}:{}'.format(key, t) for (key, t)
+                    in node_schema[label]] + [':LABEL'])
+        for label in edge_schema:
+            self.__write_header('relationships', label,
+                                [':START_ID', ':END_ID'] + [
+                                    '{}:{}'.format(key, t) for (key, t)
+                                    in edge_schema[label]] + [':TYPE'])
+
+        def node_row(label, item):
+            (node, attr) = item
+            return [node] + [format_value(attr.get(key)) for (key, t)
+                             in node_schema[label]] + [label]
+
+        def edge_row(label, item):
+            (s, t, attr) = item
+            return [s, t] + [format_value(attr.get(key)) for (key, _)
+                             in edge_schema[label]] + [label]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            no_nodes = self.__write('nodes', ((node_label(attr), (node, attr))
+                                    for (node, attr) in graph.nodes.data()),
+                                    node_row, pool)
+            no_edges = self.__write('relationships',
+                                    ((attr[elab], (s, t, attr))
+                                     for (s, t, attr) in graph.edges.data()),
+                                    edge_row, pool)
+
+        with open(os.path.join(self.path, 'import.args'), 'w') as f:
+            f.write('--array-delimiter=U+{:04X}\n'.format(
+                    ord(array_delimiter)))
+            for kind in ['nodes', 'relationships']:
+                for label, files in self.files[kind].items():
+                    f.write('--{}={}\n'.format(kind, ','.join(files)))
+        return no_nodes, no_edges
+
+
+def write_neo4j_csv(graph, path, nlab='nlabel', elab='elabel', **kwargs):
+    return Neo4jCSVWriter(path, nlab, elab, **kwargs).write(graph)
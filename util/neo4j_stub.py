@@ -0,0 +1,118 @@
+from collections import Counter
+from time import time, sleep
+
+
+class StubResult():
+
+    def __init__(self):
+        self.records = []
+
+    def data(self):
+        return self.records
+
+    def values(self):
+        return self.records
+
+    def summary(self):
+        return self
+
+    @property
+    def counters(self):
+        return self
+
+    nodes_deleted = 0
+    relationships_deleted = 0
+
+
+class StubTransaction():
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwparameters):
+        # simulated round trip to the server
+        if self.driver.latency:
+            sleep(self.driver.latency)
+        parameters = dict(parameters or {}, **kwparameters)
+        self.driver.queries[query] += 1
+        self.driver.rows += len(parameters.get('rows', [None]))
+        self.driver.round_trips += 1
+        if self.driver.record:
+            self.driver.log.append((query, parameters))
+        return StubResult()
+
+    def commit(self):
+        self.driver.transactions += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubSession(StubTransaction):
+
+    def begin_transaction(self):
+        return StubTransaction(self.driver)
+
+    def run(self, query, parameters=None, **kwparameters):
+        result = StubTransaction.run(self, query, parameters, **kwparameters)
+        self.commit()
+        return result
+
+
+class StubDriver():
+    """Stands in for neo4j.GraphDatabase.driver without a server. It records
+    the queries, rows, round trips and transactions it receives and can add a
+    fixed latency per round trip, so loaders can be benchmarked offline.
+    With record=True every query is also kept with its parameters in
+    ``log``, so loaders can be tested offline."""
+
+    def __init__(self, latency=0.0, record=False):
+        self.latency = latency
+        self.record = record
+        self.log = []
+        self.queries = Counter()
+        self.rows = 0
+        self.round_trips = 0
+        self.transactions = 0
+
+    def session(self):
+        return StubSession(self)
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    import networkx as nx
+    import random
+    from gpickle_to_neo4j import Neo4jImporter
+
+    random.seed(1924)
+    no_nodes = 100000
+    no_edges = 300000
+    labels = ['Company', 'Filer', 'Location']
+    graph = nx.MultiDiGraph()
+    for i in range(no_nodes):
+        graph.add_node('N_{}'.format(i), nlabel=random.choice(labels),
+                       name='name "{}"'.format(i), source='Stub')
+    for i in range(no_edges):
+        graph.add_edge('N_{}'.format(random.randrange(no_nodes)),
+                       'N_{}'.format(random.randrange(no_nodes)),
+                       elabel=random.choice(['PARENT', 'FILED']),
+                       source='Stub')
+
+    for batch in [100, 1000, 10000]:
+        driver = StubDriver(latency=0.0005)
+        nim = Neo4jImporter(None, driver)
+        t1 = time()
+        nim.import_nodes(graph, 'nlabel', batch=batch)
+        nim.import_edges(graph, 'nlabel', 'elabel', batch=batch)
+        t2 = time()
+        print("Batch {:,}: {:,} rows in {:,} round trips, {:,} transactions, "
+              "{} distinct queries, {:.2f} sec ({:,.0f} rows/sec)".format(
+                      batch, driver.rows, driver.round_trips,
+                      driver.transactions, len(driver.queries), t2-t1,
+                      driver.rows/(t2-t1)))
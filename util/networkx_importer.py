@@ -1,60 +1,296 @@
-
-from numpy import nan
 import pandas as pd
 import networkx as nx
-from collections import Counter
-import re
+import pickle
+import numpy as np
+from util.indexed_graph import IndexedMultiDiGraph
+from util.compact_graph import CompactGraph, missing
+from util.graph_cleaner import clean_graph
+from util.graph_snapshot import write_snapshot
+from util.graphml_writer import write_graphml
+from util.neo4j_csv_writer import write_neo4j_csv
 
 def isNaN(s):
     return s != s
 
 
+# merge policies of upsert_nodes, for an attribute a node already has
+OVERWRITE = 'overwrite'          # the last value, as add_node does
+KEEP_FIRST = 'keep_first'        # the first value
+KEEP_NON_NULL = 'keep_non_null'  # the last value that is not None or NaN
+UNION = 'union'                  # the union of the lists, in arrival order
+
+
+def isNull(value):
+    return value is None or (isinstance(value, float) and isNaN(value))
+
+
+def merge_values(policy, old, new):
+    if policy == KEEP_FIRST:
+        return old
+    if policy == KEEP_NON_NULL:
+        return old if isNull(new) else new
+    if policy == UNION:
+        if isNull(old):
+            return new
+        if isNull(new):
+            return old
+        if isinstance(old, set) and isinstance(new, set):
+            return old | new
+        old = old if isinstance(old, (list, set)) else [old]
+        new = new if isinstance(new, (list, set)) else [new]
+        return list(old) + [value for value in new if value not in old]
+    return new
+
+
+def part_order(parts):
+    # parts: (rows, ...) with the row of every item. The positions of the
+    # items in the parts one after the other, in the order a loop over the
+    # rows would have added them: by row, and by part within a row.
+    if not parts:
+        return np.zeros(0, dtype=np.int64)
+    rows = np.concatenate([np.asarray(part[0], dtype=np.int64)
+                           for part in parts])
+    part = np.repeat(np.arange(len(parts)), [len(part[0]) for part in parts])
+    return np.lexsort((part, rows))
+
+
+def records(n, attrs):
+    # the attribute dicts of n items from attrs, which maps every key to a
+    # list with a value per item or to a constant
+    keys = list(attrs)
+    values = [value if isinstance(value, list) else [value] * n
+              for value in attrs.values()]
+    if not values:
+        return [{} for i in range(n)]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def objects(values, n):
+    # a list with a value per item or a constant as an object array
+    if isinstance(values, list):
+        return np.fromiter(values, dtype=object, count=n)
+    array = np.empty(n, dtype=object)
+    array.fill(values)
+    return array
+
+
+def pick_records(nodes, order, select, n, last=False):
+    # for every one of n nodes, the position of its first (or last)
+    # selected record, -1 if it has none; order lists the records by node
+    # and, within a node, in the order they come
+    picked = np.full(n, -1, dtype=np.int64)
+    order = order[select[order]]
+    if len(order) == 0:
+        return picked
+    nodes = nodes[order]
+    if last:
+        edge = np.append(nodes[1:] != nodes[:-1], True)
+    else:
+        edge = np.insert(nodes[1:] != nodes[:-1], 0, True)
+    picked[nodes[edge]] = order[edge]
+    return picked
+
+
 class NetworkxImporter():
 
-    def __init__(self, source):
-        self.graph = nx.MultiDiGraph()
+    # a record with no other attributes than these only stands for a node
+    # that is linked to, and never overwrites what the node already has
+    stub_attrs = frozenset(['nlabel', 'source', 'id'])
+    # merge policy per attribute, OVERWRITE if not given
+    policies = {}
+    # classes of the graph, overridden by importers that need more indexes
+    graph_class = IndexedMultiDiGraph
+    compact_graph_class = CompactGraph
+
+    def __init__(self, source, compact=False):
+        # compact=True stores the graph as a CompactGraph: integer ids,
+        # edge arrays and columnar attributes instead of networkx dicts
+        self.graph = self.compact_graph_class() if compact else \
+            self.graph_class()
         self.source = source
+        # nodes that so far were only added by stub records
+        self.stubs = set()
+
+    def __merge(self, data, attr, stub):
+        # the attributes of attr that change data, under the merge policies
+        changes = {}
+        for key, value in attr.items():
+            if key not in data:
+                changes[key] = value
+            elif not stub:
+                old = data[key]
+                merged = merge_values(self.policies.get(key, OVERWRITE), old,
+                                      value)
+                if merged is not old and (type(merged) is not type(old) or
+                                          not merged == old):
+                    changes[key] = merged
+        return changes
+
+    def upsert_nodes(self, nodes):
+        """Adds or updates the nodes of (node, attr) tuples, in one pass and
+        in any order: a stub record (see stub_attrs) only adds the
+        attributes a node does not have, and a full one merges every
+        attribute with its policy. New nodes are added at the end with one
+        add_nodes_from, in the order they first came, and nodes only seen
+        in stub records are kept in self.stubs."""
+        graph = self.graph
+        new = {}
+        for node, attr in nodes:
+            stub = self.stub_attrs.issuperset(attr)
+            data = new.get(node)
+            if data is not None:
+                data.update(self.__merge(data, attr, stub))
+            elif node in graph:
+                changes = self.__merge(graph.nodes[node], attr, stub)
+                if changes:
+                    graph.add_node(node, **changes)
+            else:
+                new[node] = dict(attr)
+                if stub:
+                    self.stubs.add(node)
+                continue
+            if not stub:
+                self.stubs.discard(node)
+        graph.add_nodes_from(new.items())
+
+    def upsert_node_parts(self, parts):
+        """upsert_nodes for nodes parsed as columns: parts of (rows, keys,
+        attrs), with the row of every node and attrs as records() takes
+        them, whose records are upserted in the order of part_order. A
+        CompactGraph takes them a column at a time when every attribute is
+        overwritten: a node gets the value of its last full record that has
+        the attribute, else the one it has, else that of its first stub
+        record."""
+        names = dict.fromkeys(key for (rows, keys, attrs) in parts
+                              for key in attrs)
+        if not isinstance(self.graph, CompactGraph) or any(
+                self.policies.get(key, OVERWRITE) != OVERWRITE
+                for key in names):
+            items = [item for (rows, keys, attrs) in parts
+                     for item in zip(keys, records(len(rows), attrs))]
+            self.upsert_nodes([items[i] for i in part_order(parts)])
+            return
+
+        graph = self.graph
+        order = part_order(parts)
+        if len(order) == 0:
+            return
+        sizes = [len(part[0]) for part in parts]
+        starts = np.cumsum([0] + sizes)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        # the nodes numbered in the order they first come
+        keys = np.concatenate([objects(part[1], len(part[0]))
+                               for part in parts])
+        nodes = np.empty(len(order), dtype=np.int64)
+        nodes[order], keys = pd.factorize(keys[order], use_na_sentinel=False)
+        keys = keys.tolist()
+        ids = graph.node_ids_of(keys)
+        new = ids < 0
+        stub = np.repeat([self.stub_attrs.issuperset(part[2])
+                          for part in parts], sizes)
+        full = np.zeros(len(keys), dtype=bool)
+        full[nodes[~stub]] = True
+
+        by_node = np.lexsort((rank, nodes))
+        columns = {}
+        for name in names:
+            values = np.full(len(order), missing, dtype=object)
+            given = np.zeros(len(order), dtype=bool)
+            for p, part in enumerate(parts):
+                if name in part[2]:
+                    values[starts[p]:starts[p + 1]] = objects(part[2][name],
+                                                              sizes[p])
+                    given[starts[p]:starts[p + 1]] = True
+            last = pick_records(nodes, by_node, given & ~stub, len(keys),
+                                last=True)
+            first = pick_records(nodes, by_node, given & stub, len(keys))
+            column = np.full(len(keys), missing, dtype=object)
+            column[last >= 0] = values[last[last >= 0]]
+            stubbed = np.flatnonzero((last < 0) & (first >= 0))
+            if not new.all():
+                # an existing node keeps what it has
+                old = stubbed[~new[stubbed]]
+                stubbed = np.concatenate([
+                        stubbed[new[stubbed]],
+                        old[~graph.has_attributes(ids[old], name)]])
+            column[stubbed] = values[first[stubbed]]
+            columns[name] = column
+
+        if not new.all():
+            graph.update_node_columns(ids[~new], {
+                    name: column[~new] for name, column in columns.items()})
+        if new.any():
+            graph.add_node_columns([keys[i] for i in np.flatnonzero(new)], {
+                    name: column[new] for name, column in columns.items()})
+        self.stubs.difference_update([keys[i] for i in np.flatnonzero(full)])
+        self.stubs.update([keys[i] for i in np.flatnonzero(new & ~full)])
+
+    def add_edge_parts(self, parts):
+        """add_edges_from for edges parsed as columns: parts of (rows,
+        sources, targets, attrs), added in the order of part_order; a
+        CompactGraph takes them a column at a time."""
+        order = part_order(parts)
+        if not isinstance(self.graph, CompactGraph):
+            items = [(u, v, attr) for (rows, sources, targets, attrs) in parts
+                     for (u, v, attr) in zip(sources, targets,
+                                             records(len(rows), attrs))]
+            self.graph.add_edges_from([items[i] for i in order])
+            return
+
+        sizes = [len(rows) for (rows, sources, targets, attrs) in parts]
+        starts = np.cumsum([0] + sizes)
+        sources = [u for part in parts for u in part[1]]
+        targets = [v for part in parts for v in part[2]]
+        columns = {}
+        for p, (rows, _, _, attrs) in enumerate(parts):
+            for name, values in attrs.items():
+                if name not in columns:
+                    columns[name] = np.full(len(order), missing, dtype=object)
+                columns[name][starts[p]:starts[p + 1]] = objects(values,
+                                                                 sizes[p])
+        self.graph.add_edge_columns(
+                [sources[i] for i in order.tolist()],
+                [targets[i] for i in order.tolist()],
+                {name: column[order] for name, column in columns.items()})
+
+    def upsert_node(self, node, **attr):
+        self.upsert_nodes([(node, attr)])
+
+    def remove_nodes(self, nodes):
+        nodes = list(nodes)
+        self.graph.remove_nodes_from(nodes)
+        self.stubs.difference_update(nodes)
 
     def __get_nodes_ids(self, attribute, value):
-        return [key for key in self.graph.nodes()
+        if attribute in self.graph.index_attrs:
+            return list(self.graph.nodes_by(attribute, value) &
+                        self.graph.nodes_by('source', self.source))
+        return [key for key in self.graph.nodes_by('source', self.source)
                 if attribute in self.graph.nodes[key].keys()
-                and self.graph.nodes[key][attribute] == value
-                and 'source' in self.graph.nodes[key].keys()
-                and self.graph.nodes[key]['source'] == self.source]
+                and self.graph.nodes[key][attribute] == value]
 
     def __get_edges_ids(self, attribute, value):
         return [key for key in self.graph.edges()
                 if self.graph.edge[key][attribute] == value
                 and self.graph.edges[key]['source'] == self.source]
 
-    def __get_nodes_statistics(self, val, choice=0):
-        if choice == 0:
-            self.no_nodes = Counter([self.graph.nodes[key]['nlabel']
-                                    for key in self.graph.nodes()
-                                    if 'nlabel' in self.graph.nodes[key].keys()
-                                    and 'source' in self.graph.nodes[key].keys()
-                                    and self.graph.nodes[key]['source'] == self.source                                        
-                                     ])
-        return self.no_nodes[val]
-
-    def __get_edges_statistics(self, val, _from=None, _to=None, choice=0):
-        if choice == 0:
-            self.no_edges = Counter(["{}_{}_{}".format(
-                                self.graph.edges[edge]['elabel'],
-                                self.graph.nodes[edge[0]]['nlabel'],
-                                self.graph.nodes[edge[1]]['nlabel'])
-                                for edge in self.graph.edges
-                                if 'elabel' in self.graph.edges[edge].keys()
-                                and 'source' in self.graph.edges[edge].keys()
-                                and self.graph.edges[edge]['source'] == self.source])
-        return self.no_edges["{}_{}_{}".format(val, _from, _to)]
+    def __get_nodes_statistics(self, val):
+        return self.graph.count_nodes(self.source, val)
+
+    def __get_edges_statistics(self, val, _from=None, _to=None):
+        return self.graph.count_edges(self.source, val, _from, _to)
 
     def __get_nodes_values(self, attr):
+        if attr in self.graph.index_attrs:
+            return self.graph.node_values(attr)
         return set([self.graph.nodes[node][attr]
                     for node in self.graph.nodes()
-                    if attr in self.graph.node[node].keys()])
+                    if attr in self.graph.nodes[node].keys()])
 
     def __get_edges_values(self, attr):
+        if attr == 'elabel':
+            return self.graph.edge_values()
         return set([(self.graph.edges[edge][attr],
                      self.graph.nodes[edge[0]]['nlabel'],
                      self.graph.nodes[edge[1]]['nlabel'])
@@ -66,98 +302,42 @@ class NetworkxImporter():
                                               self.graph.number_of_nodes()))
 
         nodes = self.__get_nodes_values('nlabel')
-        for i, node in enumerate(nodes):
+        for node in nodes:
             print("\t\t{} {} Nodes: {:,}".format(self.source, node,
                                                  self.__get_nodes_statistics(
-                                                         node, i)))
+                                                         node)))
 
         print("\tTotal {} Edges: {:,}".format(self.source,
                                               self.graph.number_of_edges()))
 
         edges = self.__get_edges_values('elabel')
-        for i, (elabel, nlabel1, nlabel2) in enumerate(edges):
+        for elabel, nlabel1, nlabel2 in edges:
             print("\t\t{} {}({},{}) Edges: {:,}".format(self.source, elabel,
                               nlabel1, nlabel2, self.__get_edges_statistics(
-                              elabel, nlabel1, nlabel2, i)))
+                              elabel, nlabel1, nlabel2)))
         return nodes
 
-    def __clean(self):
-        for node in self.graph.nodes:
-            del_keys = []
-            for key in self.graph.nodes[node].keys():
-                if isinstance(self.graph.nodes[node][key], list):
-                    self.graph.nodes[node][key] = ' '.join(
-                            self.graph.nodes[node][key])
-                elif isinstance(self.graph.nodes[node][key], set):
-                    self.graph.nodes[node][key] = ' '.join(
-                            self.graph.nodes[node][key])
-                if isinstance(self.graph.nodes[node][key], str):
-                    self.graph.nodes[node][key] = re.sub(r'[^w]', '_',
-                                                   self.graph.nodes[node][key])
-                if isNaN(self.graph.nodes[node][key]):
-                    del_keys += [key]
-            for key in del_keys:
-                del(self.graph.nodes[node][key])
-
-    def __write_graphml(self, file, nlab='nlabel', elab='elabel'):
-        with open('./graphml/{}.graphml'.format(file.split('.')[0]), 'w') as f:
-            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
-                    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-                    'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns'
-                    ' http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
-
-            for key in set.union(*[set(attr.keys()) for (node, attr)
-                                   in self.graph.nodes.data()]):
-                f.write('<key id="{}" for="node" attr.name="{}"/>\n'.format(
-                        key, key))
-            f.write('<key id="label" for="node" attr.name="label"/>\n')
-
-            for key in set.union(*[set(attr.keys()) for (s, t, attr)
-                                   in self.graph.edges.data()]):
-                f.write('<key id="{}" for="edge" attr.name="{}"/>\n'.format(
-                        key, key))
-
-            f.write('<key id="label" for="edge" attr.name="label"/>\n')
-            f.write('<graph id="G" edgedefault="directed">\n')
-
-            nodes = {}
-            for no, (node, attr) in enumerate(self.graph.nodes.data()):
-                temp = node.split("_")
-                nodes[node] = '{}_{}_{}'.format(temp[0], temp[1], no)
-
-                f.write('<node id="{}" labels=":{}">'
-                        '<data key="labels">:{}</data>\n'.format(
-                                nodes[node], attr[nlab], attr[nlab]))
-                for key in attr:
-                    if key == 'labels':
-                        f.write('  <data key="wdlabels">{}</data>\n'.format(
-                                attr['labels']))
-                    elif key == nlab:
-                        continue
-                    else:
-                        f.write('  <data key="{}">{}</data>\n'.format(key,
-                                attr[key]))
-                f.write('</node>\n')
-
-            for i, (s, t, attr) in enumerate(self.graph.edges.data()):
-                f.write('<edge id="e{}" source="{}" target="{}" label="{}">'
-                        '<data key="label">{}</data>\n'.format(i, nodes[s],
-                                                               nodes[t],
-                                                               attr[elab],
-                                                               attr[elab]))
-                for key in attr:
-                    if key == elab:
-                        continue
-                    else:
-                        f.write('  <data key="{}">{}</data>\n'.format(key,
-                                attr[key]))
-                f.write('</edge>\n')
-            f.write('</graph>\n</graphml>\n')
-
-    def export(self, path, format='gpickle'):
-        if format == 'gpickle':
-            nx.write_gpickle(self.graph, path)
+    def __write_graphml(self, file, nlab='nlabel', elab='elabel',
+                        compress=False):
+        write_graphml(self.graph,
+                      './graphml/{}.graphml'.format(file.split('.')[0]),
+                      nlab, elab, rename={'labels': 'wdlabels'},
+                      compress=compress)
+
+    def export(self, path, format='snapshot', compress=False, workers=1):
+        if format == 'snapshot':
+            # versioned snapshot directory, see graph_snapshot.py
+            write_snapshot(self.graph, './snapshot/{}'.format(
+                           path.split('.')[0]))
+        elif format == 'gpickle':
+            with open(path, 'wb') as f:
+                pickle.dump(self.graph, f, pickle.HIGHEST_PROTOCOL)
         elif format == 'graphml':
-            self.__clean()
-            self.__write_graphml(path)
+            # columnar per label, see graph_cleaner.py
+            clean_graph(self.graph, workers=workers)
+            self.__write_graphml(path, compress=compress)
+        elif format == 'neo4j':
+            # CSV files for neo4j-admin import, see neo4j_csv_writer.py
+            write_neo4j_csv(self.graph, './neo4j/{}'.format(
+                            path.split('.')[0]), compress=compress,
+                            workers=workers)
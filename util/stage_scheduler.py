@@ -0,0 +1,134 @@
+import resource
+from collections import deque
+from multiprocessing import Pool
+from time import time
+
+
+def peak_memory():
+    # peak resident memory of this process so far, in MB (ru_maxrss is in
+    # KB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_task(task):
+    func, args = task
+    t1 = time()
+    result = func(*args)
+    return result, time() - t1, peak_memory()
+
+
+class Stage():
+    """A stage of an import: ``func(*args)`` parses its input, possibly in a
+    worker process, and its result is passed to ``merge`` in the main
+    process, after the merges of the stages named in ``after``. If
+    ``chunks`` is given, an iterable read lazily in the main process,
+    ``func(chunk, *args)`` is parsed and merged for every chunk of it, in
+    order."""
+
+    def __init__(self, name, func, args=(), merge=None, after=(),
+                 chunks=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.merge = merge
+        self.after = tuple(after)
+        self.chunks = chunks
+
+    def tasks(self):
+        if self.chunks is None:
+            yield (self.func, self.args)
+        else:
+            for chunk in self.chunks:
+                yield (self.func, (chunk,) + self.args)
+
+
+def check_stages(stages):
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate stage names")
+    for stage in stages:
+        unknown = [name for name in stage.after if name not in names]
+        if unknown:
+            raise ValueError("Stage {} runs after unknown stages {}".format(
+                    stage.name, unknown))
+
+
+def order_stages(stages):
+    # the stages in an order that respects after, the first ready stage of
+    # the list first
+    check_stages(stages)
+    pending = list(stages)
+    ordered = []
+    merged = set()
+    while pending:
+        ready = [stage for stage in pending
+                 if all(name in merged for name in stage.after)]
+        if not ready:
+            raise ValueError("Cyclic dependencies between stages {}"
+                             .format([stage.name for stage in pending]))
+        ordered.append(ready[0])
+        pending.remove(ready[0])
+        merged.add(ready[0].name)
+    return ordered
+
+
+def print_report(report):
+    print("Stage timings (sec) and peak memory (MB):")
+    print("\t{:<20} {:>10} {:>10} {:>12} {:>12}".format(
+            'stage', 'parse', 'merge', 'parse peak', 'merge peak'))
+    for row in report:
+        print("\t{:<20} {:>10.2f} {:>10.2f} {:>12.1f} {:>12.1f}".format(
+                row['stage'], row['parse'], row['merge'], row['parse_peak'],
+                row['merge_peak']))
+    slowest = max(report, key=lambda row: row['parse'] + row['merge'])
+    print("Slowest stage: {}".format(slowest['stage']))
+
+
+def run_stages(stages, workers=1, window=None):
+    """Runs a DAG of stages. The tasks of the stages (one per chunk) are
+    parsed on ``workers`` processes (in this process if workers is 1) and
+    merged here one at a time, in an order that respects the dependencies;
+    at most ``window`` tasks, 2 * workers by default, are parsed ahead of
+    the merges, so the parsed chunks waiting in memory stay bounded however
+    large the tables. Returns a report row per stage, in the order they
+    were merged: parse and merge times, and the peak memory of the parsing
+    and of the merging process by the end of the stage (the peak of a
+    worker covers the earlier tasks it ran too)."""
+    stages = order_stages(stages)
+    report = [{'stage': stage.name, 'parse': 0.0, 'merge': 0.0,
+               'parse_peak': 0.0, 'merge_peak': 0.0} for stage in stages]
+    tasks = ((row, stage, task) for (row, stage) in zip(report, stages)
+             for task in stage.tasks())
+
+    def merge(row, stage, result):
+        result, parse_time, parse_peak = result
+        if row['merge_peak'] == 0.0:
+            print("Merging {}".format(stage.name))
+        t1 = time()
+        if stage.merge is not None:
+            stage.merge(result)
+        row['parse'] += parse_time
+        row['merge'] += time() - t1
+        row['parse_peak'] = max(row['parse_peak'], parse_peak)
+        row['merge_peak'] = peak_memory()
+
+    if workers <= 1:
+        for (row, stage, task) in tasks:
+            merge(row, stage, run_task(task))
+        return report
+
+    window = window if window is not None else 2 * workers
+    pending = deque()
+    pool = Pool(workers)
+    try:
+        for (row, stage, task) in tasks:
+            if len(pending) >= window:
+                row0, stage0, future = pending.popleft()
+                merge(row0, stage0, future.get())
+            pending.append((row, stage, pool.apply_async(run_task, (task,))))
+        while pending:
+            row0, stage0, future = pending.popleft()
+            merge(row0, stage0, future.get())
+    finally:
+        pool.terminate()
+    return report
@@ -0,0 +1,51 @@
+# Example: python benchmark_filter.py ./data/latest-all.json.gz 100000
+# Compares the per-line cost of the filter with and without the prefilter
+# on the first lines of a dump, and checks that both keep the same lines.
+import gzip
+import json
+import sys
+from itertools import islice
+from time import time
+import pandas as pd
+import wikidata_filter
+from wikidata_filter import build_index, init_worker, filter_lines
+
+source = sys.argv[1] if len(sys.argv) > 1 else './data/latest-all.json.gz'
+no_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+files = ['./data/country.txt', './data/grant.txt', './data/group.txt',
+         './data/industry.txt', './data/market.txt',
+         './data/organizations.txt', './data/person.txt',
+         './data/product.txt', './data/tradingvenue.txt']
+
+with gzip.open(source, 'rb') as f:
+    f.readline()
+    lines = [line for line in islice(f, no_lines)
+             if not line.startswith(b']')]
+print("Sample of {:,} lines, {:,} MB".format(
+        len(lines), sum(len(line) for line in lines) >> 20))
+
+index = build_index([set(pd.read_csv(file, header=None)[0])
+                     for file in files])
+
+results = {}
+for prefilter in [False, True]:
+    init_worker("type", index, prefilter)
+    t1 = time()
+    results[prefilter] = filter_lines(lines)[1]
+    t2 = time()
+    print("Prefilter {}: {:,} lines kept, {:.2f} sec, {:.1f} us/line".format(
+            prefilter, len(results[prefilter]), t2-t1,
+            (t2-t1)/len(lines)*1e6))
+
+rejected = [line for line in lines if not wikidata_filter.is_candidate(line)]
+t1 = time()
+for line in rejected:
+    json.loads(line.rstrip(b',\r\n'))
+t2 = time()
+for line in rejected:
+    wikidata_filter.is_candidate(line)
+t3 = time()
+print("Rejected lines: {:,}, full parse {:.1f} us/line, prefilter {:.1f} "
+      "us/line".format(len(rejected), (t2-t1)/max(len(rejected), 1)*1e6,
+                       (t3-t2)/max(len(rejected), 1)*1e6))
+print("Same output: {}".format(results[False] == results[True]))
@@ -1,8 +1,12 @@
 from wikidata_cleaner import WikidataCleaner
 import os
+import sys
+
+# Example: python clean_data.py parquet
+format = sys.argv[1] if len(sys.argv) > 1 else 'csv'
 
 files = {file.split("_")[0]: './data/'+file for file in os.listdir('./data/')
          if file.endswith("filtered.txt")}
 
 wc = WikidataCleaner(files)
-wc.clean()
+wc.clean(format=format)
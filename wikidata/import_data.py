@@ -1,37 +1,49 @@
-import pandas as pd
+import os
+import sys
+from wikidata_cleaner import read_cleaned, read_indexed
 from wikidata_networkx import WD_NetworkxImporter
 
+# Example: python import_data.py parquet
+# reads the cleaned files written by clean_data.py in the same format
+format = sys.argv[1] if len(sys.argv) > 1 else 'csv'
 chunksize = 10000
 
+
+def cleaned(file):
+    if format == 'parquet':
+        file = os.path.splitext(file)[0] + '.parquet'
+    return './data/' + file
+
+
 nim = WD_NetworkxImporter()
 print("Creating Organizations")
-chunks = pd.read_csv('./data/organizations_cleaned.txt',
-                     quotechar='"', escapechar='\\', chunksize=chunksize,
-                     index_col="id")
+chunks = read_cleaned(cleaned('organizations_cleaned.txt'), chunksize)
 for i, df in enumerate(chunks):
     print("\tChunk {}".format(i))
     nim.create_companies(df)
 
+# the entity files are only read for the rows of the nodes to expand,
+# through the index that clean_data.py writes next to every cleaned file
 for node in ['Country', 'Grant', 'StockExchange', 'Industry', 'Group']:
     for file in nim.o_nodes[node]["files"]:
         print("Expanding for {}-{}".format(node, file))
-        chunks = pd.read_csv('./data/'+file, quotechar='"',
-                             escapechar='\\', chunksize=chunksize,
-                             index_col="id")
+        chunks = read_indexed(cleaned(file), nim.get_pending_ids(node),
+                              chunksize,
+                              ['label', 'aliases', 'descriptions', 'labels'])
         for i, df in enumerate(chunks):
             print("\tChunk {}".format(i))
             nim.expand_nodes(df, node)
 
 print("Creating Person")
-chunks = pd.read_csv('./data/person_cleaned.txt', quotechar='"',
-                     escapechar='\\', chunksize=chunksize, index_col="id")
+chunks = read_indexed(cleaned('person_cleaned.txt'),
+                      nim.get_pending_ids('Person'), chunksize)
 for i, df in enumerate(chunks):
     print("\tChunk {}".format(i))
     nim.expand_nodes(df, "Person")
 
 print("Creating Product")
-chunks = pd.read_csv('./data/product_cleaned.txt', quotechar='"',
-                     escapechar='\\', chunksize=chunksize, index_col="id")
+chunks = read_indexed(cleaned('product_cleaned.txt'),
+                      nim.get_pending_ids('Product'), chunksize)
 for i, df in enumerate(chunks):
     print("\tChunk {}".format(i))
     nim.expand_nodes(df, "Product")
@@ -39,4 +51,4 @@ for i, df in enumerate(chunks):
 nim.clean_companies_onwer()
 nim.print_statistics()
 nim.export_unlabeled_ids()
-nim.export('wd_graph.gpickle')
+nim.export('wd_graph')
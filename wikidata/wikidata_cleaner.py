@@ -1,19 +1,334 @@
 import json
-import pandas as pd
-import re
+import mmap
 import os
+import re
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+from io import BytesIO
+from time import time
+import numpy as np
+import pandas as pd
+
+claims = {'P1559': 'text', 'P1448': 'text', 'P6375': 'text',
+          'P569': 'time',  'P571': 'time',
+          'P2021': 'amount', 'P1128': 'amount',
+          'P2139': 'amount', 'P2295': 'amount',
+          'P2403': 'amount', 'P3362': 'amount'}
+
+
+def escape(text):
+    return text.replace('"', '\\"')
+
+
+def english(pairs):
+    return [pair["value"] for pair in pairs if pair["language"] == "en"]
+
+
+def values(snaks):
+    return [snak['mainsnak']['datavalue']['value'] for snak in snaks
+            if 'datavalue' in snak['mainsnak']]
+
+
+# claims that are kept as one ';'-joined string; the rest of the claims
+# become lists of values in Parquet files
+scalars = ['P21', 'P1559', 'P569', 'P2021', 'P571', 'P856', 'P1329', 'P968',
+           'P6375', 'P281', 'P275']
+
+
+def entity_fields(line, codes):
+    # extracts the fields of one filtered entity: strings, lists of strings,
+    # coordinates or None for missing claims
+    labels = english(line["labels"].values())
+    if len(labels) > 0:
+        label = labels[0]
+    else:
+        # most frequent label in any language, ties broken alphabetically
+        counts = Counter([pair["value"] for pair in line["labels"].values()])
+        label = min(counts, key=lambda v: (-counts[v], v)) if counts else ""
+
+    fields = [line["id"], label.replace('\\"', '"'),
+              [value for l in line["aliases"].values()
+               for value in english(l)],
+              english(line["descriptions"].values()), labels]
+
+    for claim_code in codes:
+        if claim_code not in line["claims"]:
+            fields.extend([None, None] if claim_code == 'P625' else [None])
+            continue
+        snaks = line["claims"][claim_code]
+        if claim_code == 'P625':
+            coordinates = values(snaks[:1])
+            if len(coordinates) > 0:
+                fields.extend([float(coordinates[0]['latitude']),
+                               float(coordinates[0]['longitude'])])
+            else:
+                fields.extend([None, None])
+            continue
+        if claim_code in claims:
+            items = [value[claims[claim_code]] for value in values(snaks)]
+        elif claim_code in ['P856', 'P281', 'P1329', 'P968']:
+            items = values(snaks)
+        else:
+            items = [value["id"] for value in values(snaks)]
+        fields.append(';'.join(items) if claim_code in scalars else items)
+    return fields
+
+
+def field_types(codes):
+    # Parquet type of every field returned by entity_fields
+    types = ['string', 'string', 'list', 'list', 'list']
+    for claim_code in codes:
+        if claim_code == 'P625':
+            types.extend(['double', 'double'])
+        else:
+            types.append('string' if claim_code in scalars else 'list')
+    return types
+
+
+def csv_row(fields):
+    row = []
+    for value in fields:
+        if value is None:
+            row.append('')
+        elif isinstance(value, list):
+            row.append('\"'+escape(';'.join(value))+'\"')
+        else:
+            row.append('\"'+escape(str(value))+'\"')
+    return ','.join(row) + '\n'
+
+
+def clean_entity(line, codes):
+    # turns one filtered entity into one row of the cleaned CSV
+    return csv_row(entity_fields(line, codes))
+
+
+def parquet_schema(columns, codes):
+    import pyarrow as pa
+    types = {'string': pa.string(), 'double': pa.float64(),
+             'list': pa.list_(pa.string())}
+    return pa.schema([(column, types[t]) for column, t
+                      in zip(columns, field_types(codes))])
+
+
+def chunk_offsets(path, chunks):
+    # splits a file into byte ranges that start and end on line boundaries
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, chunks):
+            f.seek(max(size * i // chunks, offsets[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > offsets[-1]:
+                offsets.append(f.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def clean_chunk(source, start, end, dest, codes, columns, format='csv',
+                row_group=100000):
+    # runs inside a worker: cleans the lines in [start, end) of the source
+    # and writes them to their own part file. Returns the ids of the rows
+    # and, for CSV, their byte offsets in the part (a row can span lines)
+    no_lines = 0
+    ids = []
+    offsets = []
+    if format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = parquet_schema(columns, codes)
+        f2 = pq.ParquetWriter(dest, schema)
+        rows = []
+
+        def flush():
+            f2.write_table(pa.table([list(column) for column in zip(*rows)],
+                                    schema=schema))
+            rows.clear()
+    else:
+        f2 = open(dest, 'wb')
+        offset = 0
+
+    with open(source, 'rb') as f:
+        f.seek(start)
+        position = start
+        for j_line in f:
+            if position >= end:
+                break
+            position += len(j_line)
+            j_line = j_line.rstrip(b',\r\n')
+            if len(j_line) == 0:
+                continue
+            no_lines += 1
+            fields = entity_fields(json.loads(j_line), codes)
+            ids.append(fields[0])
+            if format == 'parquet':
+                rows.append(fields)
+                if len(rows) == row_group:
+                    flush()
+            else:
+                row = csv_row(fields).encode('utf-8')
+                f2.write(row)
+                offsets.append(offset)
+                offset += len(row)
+    if format == 'parquet' and len(rows) > 0:
+        flush()
+    f2.close()
+    return no_lines, ids, offsets
+
+
+def index_path(path):
+    return path + '.index.npz'
+
+
+def write_index(path, ids, offsets=None, lengths=None):
+    """Writes the id index of a cleaned file next to it, sorted by id: the
+    byte offset and length of every row of a CSV file, or the row number of
+    every row of a Parquet file."""
+    ids = np.array(ids, dtype=str)
+    order = np.argsort(ids, kind='stable')
+    if path.endswith('.parquet'):
+        locations = {'rows': order}
+    else:
+        locations = {'offsets': np.asarray(offsets, dtype=np.int64)[order],
+                     'lengths': np.asarray(lengths, dtype=np.int64)[order]}
+    np.savez(index_path(path), ids=ids[order], **locations)
+
+
+quote = re.compile(rb'(?<!\\)"')
+
+
+def index_cleaned(path):
+    # builds the index of a cleaned file that was written without one, in
+    # one pass over its lines (CSV) or its id column (Parquet)
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        ids = pq.read_table(path, columns=['id']).column('id').to_pylist()
+        write_index(path, ids)
+        return len(ids)
+
+    ids = []
+    offsets = []
+    with open(path, 'rb') as f:
+        offset = len(f.readline())
+        start = None
+        quoted = False
+        for line in f:
+            if not quoted:
+                start = offset
+                ids.append(line[1:line.index(b'"', 1)].decode('utf-8'))
+                offsets.append(start)
+            # a value can contain newlines, so a row ends at the first line
+            # end outside quotes
+            quoted ^= len(quote.findall(line)) % 2 == 1
+            offset += len(line)
+    write_index(path, ids, offsets, np.diff(offsets + [offset]))
+    return len(ids)
+
+
+def frame(batch):
+    # the DataFrame of a Parquet record batch or table, as read_cleaned
+    # returns it
+    import pyarrow as pa
+    data = {}
+    for field in batch.schema:
+        column = batch.column(field.name)
+        if pa.types.is_floating(field.type):
+            data[field.name] = column.to_numpy(zero_copy_only=False)
+        else:
+            # empty strings and lists are missing values, as in CSV
+            data[field.name] = [value if value else np.nan
+                                for value in column.to_pylist()]
+    index = pd.Index(data.pop("id"), name="id")
+    return pd.DataFrame(data, index=index, dtype=object).astype(
+            {key: float for key in data if isinstance(data[key], np.ndarray)})
+
+
+def read_cleaned(path, chunksize=10000, columns=None):
+    """Reads a cleaned file in chunks of ``chunksize`` rows indexed by id,
+    either the CSV or the Parquet output of WikidataCleaner. ``columns``
+    restricts the columns that are read. Lists of values are ';'-joined
+    strings in CSV chunks and lists in Parquet chunks; missing values are
+    NaN in both."""
+    usecols = None if columns is None else ['id'] + list(columns)
+    if not path.endswith('.parquet'):
+        for df in pd.read_csv(path, quotechar='"', escapechar='\\',
+                              chunksize=chunksize, index_col="id",
+                              usecols=usecols):
+            yield df
+        return
+
+    import pyarrow.parquet as pq
+    f = pq.ParquetFile(path)
+    for batch in f.iter_batches(batch_size=chunksize, columns=usecols):
+        yield frame(batch)
+
+
+def read_indexed(path, ids, chunksize=10000, columns=None):
+    """Reads only the rows of a cleaned file whose id is in ``ids``, through
+    the index written next to it, in chunks as read_cleaned returns them
+    and in file order. A CSV file is memory-mapped and only the selected
+    rows are parsed; of a Parquet file only the row groups that hold them
+    are read. Without an index, the whole file is read with read_cleaned
+    and filtered."""
+    if not os.path.exists(index_path(path)):
+        for df in read_cleaned(path, chunksize, columns):
+            df = df[df.index.isin(ids)]
+            if len(df) > 0:
+                yield df
+        return
+
+    index = np.load(index_path(path))
+    keys = index['ids']
+    wanted = np.array(list(ids), dtype=str)
+    # every row of every wanted id, duplicates included
+    left = np.searchsorted(keys, wanted, 'left')
+    right = np.searchsorted(keys, wanted, 'right')
+    found = np.concatenate([np.arange(l, r) for (l, r) in zip(left, right)
+                            if r > l] or [np.array([], dtype=np.int64)])
+    usecols = None if columns is None else ['id'] + list(columns)
+
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = np.sort(index['rows'][found])
+        f = pq.ParquetFile(path)
+        sizes = [f.metadata.row_group(i).num_rows
+                 for i in range(f.num_row_groups)]
+        starts = np.cumsum([0] + sizes)
+        groups = np.searchsorted(starts, rows, 'right') - 1
+        tables = []
+        for group in np.unique(groups):
+            table = f.read_row_group(int(group), columns=usecols)
+            tables.append(table.take(pa.array(rows[groups == group] -
+                                              starts[group])))
+        if len(tables) == 0:
+            return
+        table = pa.concat_tables(tables)
+        for start in range(0, table.num_rows, chunksize):
+            yield frame(table.slice(start, chunksize))
+        return
+
+    order = np.argsort(index['offsets'][found], kind='stable')
+    offsets = index['offsets'][found][order]
+    lengths = index['lengths'][found][order]
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header = data[:data.find(b'\n') + 1]
+        for start in range(0, len(offsets), chunksize):
+            rows = [data[offset:offset+length] for (offset, length) in zip(
+                    offsets[start:start+chunksize],
+                    lengths[start:start+chunksize])]
+            yield pd.read_csv(BytesIO(header + b''.join(rows)),
+                              quotechar='"', escapechar='\\',
+                              index_col="id", usecols=usecols)
 
 
 class WikidataCleaner():
 
     def __init__(self,  files={}):
 
-        self.claims = {'P1559': 'text', 'P1448': 'text', 'P6375': 'text',
-                       'P569': 'time',  'P571': 'time',
-                       'P2021': 'amount', 'P1128': 'amount',
-                       'P2139': 'amount', 'P2295': 'amount',
-                       'P2403': 'amount', 'P3362': 'amount',
-                       'P571':  'time'}
+        self.claims = claims
 
         self.datasets = {"country": {"claims":  [],  "header":  ""},
                          "person": {"claims": ['P21', 'P106', 'P1559', 'P569',
@@ -81,109 +396,108 @@ class WikidataCleaner():
 
         self.files = files
 
-    def clean(self):
+    def __destination(self, dataset, format='csv'):
+        dest_file = self.files[dataset].replace('filtered', 'cleaned')
+        if self.files[dataset] == dest_file:
+            dest_file = self.files[dataset].replace('.', '_cleaned.')
+        if format == 'parquet':
+            dest_file = os.path.splitext(dest_file)[0] + '.parquet'
+        return dest_file
+
+    def __columns(self, dataset):
+        return ("id,label,aliases,descriptions,labels" +
+                self.datasets[dataset]["header"]).split(',')
+
+    def clean(self, workers=None, chunks=None, format='csv'):
+        # Every input is split into newline-aligned byte ranges that are
+        # cleaned into ordered part files and concatenated after the header,
+        # so the output does not depend on the number of workers. With more
+        # than one worker the chunks of all datasets share one pool.
+        # format='parquet' writes typed Parquet files (requires pyarrow),
+        # with lists of values instead of ';'-joined strings.
+        if format not in ['csv', 'parquet']:
+            raise ValueError('Not a valid format. Choose either "csv" or '
+                             '"parquet".')
+        workers = workers if workers is not None else cpu_count()
+        chunks = chunks if chunks is not None else 4 * workers
+        tasks = {}
         for dataset in self.files.keys():
-            no_lines = 0
-
-            print("Cleaning ", dataset)
-
-            with open(self.files[dataset],  'r') as f:
-                dest_file = self.files[dataset].replace('filtered', 'cleaned')
-                if self.files[dataset] == dest_file:
-                    dest_file = self.files[dataset].replace('.', '_cleaned.')
-                with open(dest_file,  'w') as f2:
-                    f2.write(
-                            "id,label,aliases,descriptions,labels{}\n".format(
-                                    self.datasets[dataset]["header"]))
-                    j_line = f.readline()
-                    while j_line != "":
-                        no_lines += 1
-                        if no_lines % 10000 == 0:
-                            print("\tLine {:,}".format(no_lines))
-                        line = json.loads(j_line[: -2])
-
-                        label = ""
-                        if "en" in [pair["language"]
-                                    for pair in line["labels"].values()]:
-
-                            label = [pair["value"]
-                                     for pair in line["labels"].values()
-                                     if pair["language"] == "en"][0]
-                        else:
-                            labels = pd.Series(
-                                    [pair["value"]
-                                        for pair in line["labels"].values()])
-                            if not labels.empty:
-                                label = labels.groupby(labels).count().idxmax()
-
-                        aliases = ';'.join([
-                                pair["value"]
-                                for l in line["aliases"].values()
-                                for pair in l if pair["language"] == "en"])
-                        descriptions = ';'.join([
-                                pair["value"]
-                                for pair in line["descriptions"].values()
-                                if pair["language"] == "en"])
-                        labels = ';'.join([pair["value"]
-                                           for pair in line["labels"].values()
-                                           if pair["language"] == "en"])
-
-                        label = re.sub('\\\\"',  '"',  label)
-                        label = re.sub('"',  '\\"',  label)
-                        aliases = re.sub('"',  '\\"',  aliases)
-                        descriptions = re.sub('"',  '\\"',  descriptions)
-                        labels = re.sub('"',  '\\"',  labels)
-                        f2.write('\"{}\",\"{}\",\"{}\",\"{}\",\"{}\"'.format(
-                                line["id"], label, aliases, descriptions,
-                                labels))
-
-                        for claim_code in self.datasets[dataset]["claims"]:
-                            f2.write(",")
-                            if claim_code in line["claims"].keys():
-                                if claim_code in ['P856', 'P281', 'P1329',
-                                                  'P968']:
-                                    output = '\"'+';'.join(
-                                      [claim['mainsnak']['datavalue']['value']
-                                       for claim in line["claims"][claim_code]
-                                       if 'datavalue' in (
-                                            claim['mainsnak']).keys()])+'\"'
-                                elif claim_code in ['P625']:
-                                    if 'datavalue' in (line["claims"]
-                                                       [claim_code][0]
-                                                       ['mainsnak']).keys():
-                                        output = '\"'+str(
-                                                line["claims"][claim_code]
-                                                [0]['mainsnak']
-                                                ['datavalue']['value']
-                                                ['latitude'])+'\",\"'+str(
-                                                line["claims"][claim_code][0]
-                                                ['mainsnak']['datavalue']
-                                                ['value']['longitude'])+'\"'
-                                elif claim_code in self.claims.keys():
-                                    output = ';'.join([claim['mainsnak']
-                                                      ['datavalue']['value']
-                                                      [self.claims[claim_code]]
-                                                      for claim in
-                                                      line["claims"]
-                                                      [claim_code]
-                                                      if 'datavalue' in (
-                                                      claim['mainsnak']
-                                                      ).keys()])
-                                    output = '\"'+re.sub('"',  '\\"',
-                                                         output)+'\"'
-                                else:
-                                    output = '\"'+';'.join([claim['mainsnak']
-                                                            ['datavalue']
-                                                            ['value']["id"]
-                                                            for claim
-                                                            in line["claims"]
-                                                            [claim_code]
-                                                            if 'datavalue' in (
-                                                        claim['mainsnak']
-                                                        ).keys()])+'\"'
-                                f2.write(output)
-                            else:
-                                if claim_code in ['P625']:
-                                    f2.write(",")
-                        f2.write("\n")
-                        j_line = f.readline()
+            dest_file = self.__destination(dataset, format)
+            tasks[dataset] = [(self.files[dataset], start, end,
+                               "{}.part{:04d}".format(dest_file, i),
+                               self.datasets[dataset]["claims"],
+                               self.__columns(dataset), format)
+                              for i, (start, end) in enumerate(chunk_offsets(
+                                      self.files[dataset], chunks))]
+
+        pool = Pool(workers) if workers > 1 else None
+        try:
+            if pool is not None:
+                results = {dataset: [pool.apply_async(clean_chunk, task)
+                                     for task in tasks[dataset]]
+                           for dataset in tasks}
+            for dataset in tasks:
+                print("Cleaning ", dataset)
+                t1 = time()
+                no_lines = 0
+                indexes = []
+                for task in tasks[dataset]:
+                    if pool is not None:
+                        lines, ids, offsets = results[dataset].pop(0).get()
+                    else:
+                        lines, ids, offsets = clean_chunk(*task)
+                    no_lines += lines
+                    indexes.append((ids, offsets))
+                    print("\tLine {:,}".format(no_lines))
+                parts = [task[3] for task in tasks[dataset]]
+                if format == 'parquet':
+                    self.__concatenate_parquet(dataset, parts)
+                    write_index(self.__destination(dataset, format),
+                                [i for (ids, _) in indexes for i in ids])
+                else:
+                    self.__concatenate(dataset, parts, indexes)
+                t2 = time()
+                print("\t{:,} lines in {:.2f} sec".format(no_lines, t2-t1))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def __concatenate(self, dataset, parts, indexes):
+        # the offsets of the rows in the parts are shifted to the file, for
+        # its index
+        with open(self.__destination(dataset), 'w') as f2:
+            f2.write(','.join(self.__columns(dataset)) + "\n")
+        ids = []
+        offsets = []
+        lengths = []
+        base = os.path.getsize(self.__destination(dataset))
+        for part, (part_ids, part_offsets) in zip(parts, indexes):
+            size = os.path.getsize(part)
+            ids += part_ids
+            offsets += [base + offset for offset in part_offsets]
+            lengths += np.diff(part_offsets + [size]).tolist()
+            base += size
+        with open(self.__destination(dataset), 'ab') as f2:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    while True:
+                        block = f.read(1 << 24)
+                        if not block:
+                            break
+                        f2.write(block)
+                os.remove(part)
+        write_index(self.__destination(dataset), ids, offsets, lengths)
+
+    def __concatenate_parquet(self, dataset, parts):
+        # the row groups of the parts are copied in order into one file
+        import pyarrow.parquet as pq
+        schema = parquet_schema(self.__columns(dataset),
+                                self.datasets[dataset]["claims"])
+        with pq.ParquetWriter(self.__destination(dataset, 'parquet'),
+                              schema) as f2:
+            for part in parts:
+                f = pq.ParquetFile(part)
+                for i in range(f.num_row_groups):
+                    f2.write_table(f.read_row_group(i))
+                f.close()
+                os.remove(part)
@@ -1,15 +1,117 @@
+import gzip
 import json
 import os
+import re
+import threading
 import pandas as pd
+from multiprocessing import Pool, cpu_count
+from queue import Queue
 from time import time
 
+# state of the worker processes, set by init_worker
+choice = "id"
+index = {}
+keys = None
+
+id_pattern = re.compile(rb'"id":\s*"([^"]+)"')
+p31_pattern = re.compile(r'"P31":\s*\[')
+decoder = json.JSONDecoder()
+
+
+def init_worker(_choice, _index, prefilter=False):
+    global choice, index, keys
+    choice = _choice
+    index = _index
+    if not prefilter:
+        keys = None
+    elif choice == "type":
+        keys = set([str(key) for key in index])
+    else:
+        keys = set([str(key).encode('utf-8') for key in index])
+
+
+def p31_ids(text, start):
+    # decodes only the JSON array that starts at text[start]
+    try:
+        snaks = decoder.raw_decode(text, start)[0]
+    except ValueError:
+        return set()
+    ids = set()
+    for snak in snaks:
+        if isinstance(snak, dict):
+            snak = snak.get("mainsnak", snak)
+            value = snak.get("datavalue", {}).get("value")
+            if isinstance(value, dict) and "id" in value:
+                ids.add(value["id"])
+    return ids
+
+
+def is_candidate(line):
+    # Cheap test that never rejects a line the full filter would keep. By
+    # type, only the arrays following a "P31" key are decoded; the claims'
+    # P31 array is one of them (qualifiers may add others). By id, the
+    # entity id appears as "id":"..." in the raw line, so the line is
+    # scanned for those values without parsing it.
+    if choice == "type":
+        if b'"P31"' not in line:
+            return False
+        text = line.decode('utf-8')
+        for match in p31_pattern.finditer(text):
+            if p31_ids(text, match.end() - 1) & keys:
+                return True
+        return False
+    for match in id_pattern.finditer(line):
+        if match.group(1) in keys:
+            return True
+    return False
+
+
+def route_line(line):
+    # returns the position of the output file a dump line belongs to, or
+    # None if it is not wanted
+    if keys is not None and not is_candidate(line):
+        return None
+    try:
+        entity = json.loads(line.rstrip(b',\r\n'))
+    except ValueError:
+        return None
+    if choice == "type":
+        if "P31" in entity["claims"].keys():
+            found = [index[snak["mainsnak"]["datavalue"]["value"]["id"]]
+                     for snak in entity["claims"]["P31"]
+                     if 'datavalue' in snak["mainsnak"].keys()
+                     and snak["mainsnak"]["datavalue"]["value"]["id"]
+                     in index]
+            if len(found) > 0:
+                return min(found)
+    elif choice == "id":
+        return index.get(entity["id"])
+    return None
+
+
+def build_index(ids):
+    # inverted index from class (or entity) id to the first file that lists
+    # it, so routing a line is one dictionary lookup per P31 value
+    index = {}
+    for i, keys in enumerate(ids):
+        for key in keys:
+            index.setdefault(key, i)
+    return index
+
+
+def filter_lines(lines):
+    routes = [route_line(line) for line in lines]
+    return len(lines), [(route, line) for route, line in zip(routes, lines)
+                        if route is not None]
+
 
 class WikidataFilter():
 
     def __init__(self, choice="id", files=[],
-                 source='./data/latest-all.json.gz'):
+                 source='./data/latest-all.json.gz', prefilter=True):
         self.choice = choice
         self.source = source
+        self.prefilter = prefilter
 
         if choice != "type" and choice != "id":
             raise ValueError('Not a valid choice for filtering. '
@@ -19,95 +121,108 @@ class WikidataFilter():
             files = [files]
 
         self.files = files
-        self.store = pd.DataFrame(columns=["FileDescriptor", "ids", "Found"])
+        self.names = []
+        self.ids = []
+        self.outputs = []
 
         for file in files:
             base = os.path.basename(file)
             try:
-                self.store.loc[base, "ids"] = set(
-                        (pd.read_csv(file, header=None))[0])
+                self.ids.append(set((pd.read_csv(file, header=None))[0]))
             except FileNotFoundError:
                 raise FileNotFoundError("This is not a valid filename.")
 
             try:
-                self.store.loc[base, "FileDescriptor"] = open("{}_{}{}".format(
+                self.outputs.append(open("{}_{}{}".format(
                         os.path.splitext(file)[0], "filtered",
-                        os.path.splitext(file)[1]), 'w')
+                        os.path.splitext(file)[1]), 'wb',
+                        buffering=1 << 22))
             except FileNotFoundError:
                 raise FileNotFoundError("Could not create new file.")
+            self.names.append(base)
 
-        self.store.Found = 0
-
-    def __filter_line(self, line):
-        try:
-            line = json.loads(line)
-        except ValueError:
-            return False
-        if self.choice == "type":
-            if "P31" in line["claims"].keys():
-                line = set([snak["mainsnak"]["datavalue"]["value"]["id"]
-                            for snak in line["claims"]["P31"] if 'datavalue' in
-                            snak["mainsnak"].keys()])
-                for index, row in self.store.iterrows():
-                    if len(line & row.ids) > 0:
-                        return index
-        elif self.choice == "id":
-            for index, row in self.store.iterrows():
-                if line["id"] in row.ids:
-                    return index
-        return False
-
-    def filter(self, chunksize):
-        lines = 0
-
-        chunks = pd.read_csv(self.source, chunksize=chunksize,
-                             compression='gzip', sep='\n', header=None,
-                             skiprows=1, names=["Value"])
-        for i, chunk in enumerate(chunks):
-            print("\tChunk {}".format(i))
-            if chunk.iloc[-1].Value == "]":
-                print("\t\tLast Line!")
-                chunk = chunk[:-1]
-
-            t1 = time()
-            chunk["FileDescriptor"] = chunk.apply(
-                    lambda x: self.__filter_line(
-                            x["Value"][:-1]), axis=1)
-
-            t2 = time()
-            print("\t\tTime elapsed: {:,} sec".format(t2-t1))
-            t1 = time()
+        self.index = build_index(self.ids)
 
-            if self.choice == "id":
-                self.store.Found = self.store.Found.add(
-                        chunk.FileDescriptor.groupby(
-                                chunk.FileDescriptor).count(), fill_value=0)
-                lines += chunksize
+        self.found = [0 for file in files]
 
-            chunk[~(chunk.FileDescriptor == False)].apply(
-                lambda x: self.store.FileDescriptor[x["FileDescriptor"]].write(
-                        x["Value"]+'\n'), axis=1)
+    def __read(self, chunksize, workers):
+        # decompression runs in its own thread and hands batches of raw
+        # lines over through a bounded queue; an error of the reader is
+        # passed on and raised here, and the end is always marked with None
+        queue = Queue(maxsize=4 * workers)
 
-            if self.choice == "id" and not self.__breaker(lines):
+        def reader():
+            try:
+                with gzip.open(self.source, 'rb') as f:
+                    f.readline()
+                    batch = []
+                    for line in f:
+                        if line.startswith(b']'):
+                            break
+                        batch.append(line)
+                        if len(batch) == chunksize:
+                            queue.put(batch)
+                            batch = []
+                    queue.put(batch)
+            except Exception as e:
+                queue.put(e)
+            finally:
+                queue.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+        while True:
+            batch = queue.get()
+            if batch is None:
                 return
-            t2 = time()
-            print("\t\tTime elapsed: {:,} sec".format(t2-t1))
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+    def filter(self, chunksize, workers=None):
+        workers = workers if workers is not None else cpu_count()
+        batches = self.__read(chunksize, workers)
+        pool = None
+        if workers > 1:
+            pool = Pool(workers, init_worker, (self.choice, self.index,
+                                               self.prefilter))
+            results = pool.imap(filter_lines, batches)
+        else:
+            init_worker(self.choice, self.index, self.prefilter)
+            results = map(filter_lines, batches)
 
-    def __breaker(self, lines):
-        bools = []
-        for index, row in self.store.iterrows():
-            print("\t\tFor file {}: ".format(index), end=" ")
+        lines = 0
+        t1 = time()
+        try:
+            for i, (no_lines, chunk) in enumerate(results):
+                for (route, line) in chunk:
+                    self.outputs[route].write(line)
+                    self.found[route] += 1
+                lines += no_lines
+
+                if i % 100 == 0:
+                    t2 = time()
+                    print("\tChunk {}: {:,} lines in {:.2f} sec".format(
+                            i, lines, t2-t1))
+                    self.__report(lines)
+                if self.choice == "id" and not self.__breaker():
+                    print("\tAll ids found")
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
+            for output in self.outputs:
+                output.close()
+        self.__report(lines)
+
+    def __report(self, lines):
+        for name, ids, found in zip(self.names, self.ids, self.found):
+            print("\t\tFor file {}: ".format(name), end=" ")
             if self.choice == "id":
                 print("Found {:,} of {:,} ({:0.2f}%) at {:,} lines".format(
-                        row.Found, len(row.ids),
-                        row.Found/len(row.ids)*100, lines))
-                if row.Found == len(row.ids):
-                    bools += [True]
-                else:
-                    bools += [False]
+                        found, len(ids), found/len(ids)*100, lines))
             else:
-                print("Found {:,} at {:,} lines".format(row.Found, lines))
-                bools += [False]
+                print("Found {:,} at {:,} lines".format(found, lines))
 
-        self.store = self.store[[not x for x in bools]]
-        return self.store.shape[0]
+    def __breaker(self):
+        return any([found < len(ids)
+                    for ids, found in zip(self.ids, self.found)])
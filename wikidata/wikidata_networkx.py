@@ -2,17 +2,54 @@ import pandas as pd
 import networkx as nx
 from collections import Counter
 import re
-from util.networkx_importer import NetworkxImporter
+from util.indexed_graph import IndexedMultiDiGraph
+from util.compact_graph import CompactGraph
+from util.networkx_importer import NetworkxImporter, KEEP_NON_NULL, UNION
 import pickle
 
 def isNaN(s):
     return s != s
 
 
+def split(value):
+    # multi-valued fields are ';'-joined strings in the cleaned CSV files
+    # and lists in the cleaned Parquet files
+    if isinstance(value, list):
+        return value
+    return value.split(';')
+
+
+def list_values(row, keys):
+    # the multi-valued fields of a row, split if present and NaN if not, in
+    # the order add_nodes_from used to add them
+    values = {key.lower(): split(row[key]) for key in keys
+              if not isinstance(row[key], float)}
+    values.update({key.lower(): row[key] for key in keys
+                   if isinstance(row[key], float)})
+    return values
+
+
+class WD_Graph(IndexedMultiDiGraph):
+    # stubs created for linked entities have no label until they are
+    # expanded, so graph.pending_nodes(nlabel) holds the nodes to expand
+    pending_attr = 'label'
+
+
+class WD_CompactGraph(CompactGraph):
+    pending_attr = 'label'
+
+
 class WD_NetworkxImporter(NetworkxImporter):
 
-    def __init__(self):
-        NetworkxImporter.__init__(self, 'Wikidata')
+    # an entity can be found in more than one file: its names are merged
+    # and a missing label does not replace a known one
+    policies = {'label': KEEP_NON_NULL, 'aliases': UNION,
+                'descriptions': UNION, 'labels': UNION}
+    graph_class = WD_Graph
+    compact_graph_class = WD_CompactGraph
+
+    def __init__(self, compact=False):
+        NetworkxImporter.__init__(self, 'Wikidata', compact)
 
         with open('maps/organization_nodes.pkl', 'rb') as f:
             self.o_nodes = pickle.load(f)
@@ -21,54 +58,32 @@ class WD_NetworkxImporter(NetworkxImporter):
             self.p_nodes = pickle.load(f)
 
     def __get_unlabeled_nodes_ids(self, node):
-        return set([self.graph.nodes[key]['id'] for key in self.graph.nodes()
-                    if self.graph.nodes[key]['nlabel'] == node
-                    and 'label' not in self.graph.nodes[key].keys()
-                    and 'source' in self.graph.nodes[key].keys()
-                    and self.graph.nodes[key]['source'] == 'Wikidata'])
-
-    def __get_unlabeled_nodes_statistics(self, val, choice=0):
-        if choice == 0:
-            self.no_nodes = Counter([self.graph.nodes[key]['nlabel']
-                                    for key in self.graph.nodes.keys()
-                                    if 'nlabel' in self.graph.nodes[key].keys()
-                                    and 'label' not in
-                                    self.graph.nodes[key].keys()
-                                    and 'source' in
-                                    self.graph.nodes[key].keys()
-                                    and self.graph.nodes[key]['source'] ==
-                                    'Wikidata'])
-        return self.no_nodes[val]
+        return set([self.graph.nodes[key]['id'] for key in
+                    self.graph.pending_nodes(node) &
+                    self.graph.nodes_by('source', 'Wikidata')])
+
+    def __get_unlabeled_nodes_statistics(self, val):
+        return len(self.graph.pending_nodes(val) &
+                   self.graph.nodes_by('source', 'Wikidata'))
 
     def create_companies(self, df):
         print("\t\tCreating nodes for Organizations")
+        keys = ['aliases', 'descriptions', 'labels', 'official_name',
+                'employees', 'total_revenue', 'total_assets', 'net_profit',
+                'operating_income']
+        nodes = []
         for index, row in df.iterrows():
-            self.graph.add_node("WD_Org_{}".format(index),
-                                id=index, nlabel='Organization',
-                                label=row['label'],
-                                inception=row['inception'],
-                                official_website=row['official_website'],
-                                phone_number=row['phone_number'],
-                                e_mail=row['e_mail'],
-                                address=row['address'],
-                                postal_code=row['postal_code'],
-                                latitude=row['latitude'],
-                                longitude=row['longitude'],
-                                source='Wikidata')
-
-            keys = ['aliases', 'descriptions', 'labels', 'official_name',
-                    'employees', 'total_revenue', 'total_assets', 'net_profit',
-                    'operating_income']
-
-            self.graph.add_nodes_from([("WD_Org_{}".format(index),
-                                       {key.lower(): row[key].split(';')
-                                       for key in keys
-                                       if not isinstance(row[key], float)
-                                        })])
-            self.graph.add_nodes_from([("WD_Org_{}".format(index),
-                                       {key.lower(): row[key] for key in keys
-                                       if isinstance(row[key], float)
-                                        })])
+            attr = {'id': index, 'nlabel': 'Organization',
+                    'label': row['label'], 'inception': row['inception'],
+                    'official_website': row['official_website'],
+                    'phone_number': row['phone_number'],
+                    'e_mail': row['e_mail'], 'address': row['address'],
+                    'postal_code': row['postal_code'],
+                    'latitude': row['latitude'],
+                    'longitude': row['longitude'], 'source': 'Wikidata'}
+            attr.update(list_values(row, keys))
+            nodes.append(("WD_Org_{}".format(index), attr))
+        self.upsert_nodes(nodes)
 
         for node in self.o_nodes.keys():
             self.__create_node(df, "Organization", node)
@@ -81,122 +96,149 @@ class WD_NetworkxImporter(NetworkxImporter):
         elif source == "Person":
             temp = self.p_nodes
 
+        # the linked entities are stubs, which do not overwrite an entity
+        # that is already in the graph, or that comes later
+        nodes = []
+        edges = []
         for index, row in df.iterrows():
             for key in temp[target]["links"]:
                 for label in temp[target]["labels"]:
-                    if not isNaN(row[key]) and len(row[key]) > 1:
-                        for item in row[key].split(';'):
-                            self.graph.add_node("WD_{}_{}".format(label[:3],
-                                                item),
-                                                nlabel=label, id=item,
-                                                source='Wikidata')
-                            self.graph.add_edge("WD_{}_{}".format(source[:3],
-                                                index),
-                                                "WD_{}_{}".format(label[:3],
-                                                item),
-                                                elabel=key.upper(),
-                                                source='Wikidata')
-
-    def clean_companies_onwer(self):
+                    if not isNaN(row[key]) and (isinstance(row[key], list)
+                                                or len(row[key]) > 1):
+                        for item in split(row[key]):
+                            node = "WD_{}_{}".format(label[:3], item)
+                            nodes.append((node, {'nlabel': label, 'id': item,
+                                                 'source': 'Wikidata'}))
+                            edges.append(("WD_{}_{}".format(source[:3],
+                                                            index),
+                                          node, {'elabel': key.upper(),
+                                                 'source': 'Wikidata'}))
+        self.upsert_nodes(nodes)
+        self.graph.add_edges_from(edges)
+
+    def __get_wikidata_nodes(self, node, unlabeled=False):
+        # the Wikidata nodes of a label, or its unlabeled stubs, from the
+        # label and pending indexes of the graph; the source index is only
+        # needed if other sources have nodes of the label too
+        nodes = self.graph.pending_nodes(node) if unlabeled else \
+            self.graph.nodes_by('nlabel', node)
+        if self.graph.count_nodes('Wikidata', node) != \
+                len(self.graph.nodes_by('nlabel', node)):
+            nodes = nodes & self.graph.nodes_by('source', 'Wikidata')
+        return nodes
+
+    def clean_companies_onwer(self, report='./data/owner_collisions.csv'):
+        """Resolves the entities that are both an Organization and a Person,
+        as owners are linked with both labels: the Organization node is
+        removed if the Person is labeled (expanded), and the Person node if
+        the Organization is. The collisions are written to ``report``, one
+        row per entity, and returned."""
         print("Cleaning after relationships for Organizations-Owner")
 
-        o_ids = set([x[7:] for x in self._NetworkxImporter__get_nodes_ids(
-                'nlabel', 'Organization')])
-        o_u_ids = set([x[7:] for x in self.__get_unlabeled_nodes_ids(
-                'Organization')])
-        o_l_ids = o_ids - o_u_ids
-        p_ids = set([x[7:] for x in self._NetworkxImporter__get_nodes_ids(
-                'nlabel', 'Person')])
-        p_u_ids = set([x[7:] for x in self.__get_unlabeled_nodes_ids('Person')])
-        p_l_ids = p_ids - p_u_ids
-
-        common_ids = o_ids & p_ids
-
-        i = 0
-        for key in common_ids:
-            if key in p_l_ids:
-                i += 1
-                self.graph.remove_node("WD_Org_{}".format(key))
-            if key in o_l_ids:
-                i += 1
-                self.graph.remove_node("WD_Per_{}".format(key))
-        print("\tCleaned totally {} nodes".format(i))
-
-    def __find_ids(self, node):
+        # entity ids ("Q..." after the "WD_Org_"/"WD_Per_" prefixes) of the
+        # collisions, found by walking the smaller of the two labels
+        orgs = self.__get_wikidata_nodes('Organization')
+        persons = self.__get_wikidata_nodes('Person')
+        if len(orgs) <= len(persons):
+            common_ids = set(key[7:] for key in orgs
+                             if "WD_Per_" + key[7:] in persons)
+        else:
+            common_ids = set(key[7:] for key in persons
+                             if "WD_Org_" + key[7:] in orgs)
+        o_pending = self.__get_wikidata_nodes('Organization', True)
+        p_pending = self.__get_wikidata_nodes('Person', True)
+        o_l_ids = set(key for key in common_ids
+                      if "WD_Org_" + key not in o_pending)
+        p_l_ids = set(key for key in common_ids
+                      if "WD_Per_" + key not in p_pending)
+
+        self.remove_nodes(["WD_Org_{}".format(key) for key in p_l_ids] +
+                          ["WD_Per_{}".format(key) for key in o_l_ids])
+
+        ids = sorted(common_ids)
+        o_labeled = [key in o_l_ids for key in ids]
+        p_labeled = [key in p_l_ids for key in ids]
+        collisions = pd.DataFrame({
+                'id': ids, 'organization_labeled': o_labeled,
+                'person_labeled': p_labeled,
+                'removed': ['Both' if o and p else 'Organization' if p else
+                            'Person' if o else 'None'
+                            for (o, p) in zip(o_labeled, p_labeled)]})
+        if report is not None:
+            collisions.to_csv(report, index=False)
+
+        print("\t{:,} Organization-Person collisions".format(len(collisions)))
+        for removed, count in collisions.removed.value_counts().items():
+            print("\t\tRemoved {}: {:,}".format(removed, count))
+        print("\tCleaned totally {} nodes".format(len(p_l_ids) +
+                                                  len(o_l_ids)))
+        return collisions
+
+    def get_pending_ids(self, node):
+        # entity ids of the unlabeled Wikidata nodes of a label: the rows of
+        # its files that expand_nodes needs
+        prefix = len("WD_{}_".format(node[:3]))
+        return set(key[prefix:] for key in
+                   self.__get_wikidata_nodes(node, True))
+
+    def __find_ids(self, df, node):
+        # ids of the chunk that belong to unlabeled nodes of this type, found
+        # with one lookup per row in the pending index of the graph
         print("\t\tCollecting ids for {}".format(node))
-        return set([self.graph.nodes[key]['id'] for key in self.graph.nodes()
-                    if 'label' not in self.graph.nodes[key].keys()
-                    and 'nlabel' in self.graph.nodes[key].keys()
-                    and self.graph.nodes[key]['nlabel'] == node])
+        pending = self.graph.pending_nodes(node)
+        return [index for index in df.index
+                if "WD_{}_{}".format(node[:3], index) in pending]
 
     def __expand_node(self, df, node):
         print("\t\tExpanding Nodes for ", node)
+        keys = ['aliases', 'descriptions', 'labels']
+        nodes = []
         for index, row in df.iterrows():
-            self.graph.add_node("WD_{}_{}".format(node[:3], index),
-                                id=index, nlabel=node, label=row['label'],
-                                source='Wikidata')
-
-            keys = ['aliases', 'descriptions', 'labels']
-            self.graph.add_nodes_from([("WD_{}_{}".format(node[:3], index),
-                                       {key.lower(): row[key].split(';')
-                                       for key in keys if not isNaN(row[key])
-                                   })])
+            attr = {'id': index, 'nlabel': node, 'label': row['label'],
+                    'source': 'Wikidata'}
+            attr.update({key.lower(): split(row[key]) for key in keys
+                         if not isNaN(row[key])})
+            nodes.append(("WD_{}_{}".format(node[:3], index), attr))
+        self.upsert_nodes(nodes)
 
     def __expand_person(self, df):
         print("\t\tExpanding Nodes for Person")
+        keys = ['aliases', 'descriptions', 'labels', 'occupation']
+        nodes = []
         for index, row in df.iterrows():
-            self.graph.add_node("WD_Per_{}".format(index),
-                                id=index, nlabel='Person', label=row['label'],
-                                gender=row['gender'], name=row['name'],
-                                date_of_birth=row['date_of_birth'],
-                                erdos_number=row['erdos_number'],
-                                source='Wikidata')
-
-            keys = ['aliases', 'descriptions', 'labels', 'occupation']
-
-            self.graph.add_nodes_from([("WD_Per_{}".format(index),
-                                       {key.lower(): row[key].split(';')
-                                       for key in keys
-                                       if not isinstance(row[key], float)
-                                        })])
-            self.graph.add_nodes_from([("WD_Per_{}".format(index),
-                                       {key.lower(): row[key] for key in keys
-                                       if isinstance(row[key], float)
-                                        })])
+            attr = {'id': index, 'nlabel': 'Person', 'label': row['label'],
+                    'gender': row['gender'], 'name': row['name'],
+                    'date_of_birth': row['date_of_birth'],
+                    'erdos_number': row['erdos_number'], 'source': 'Wikidata'}
+            attr.update(list_values(row, keys))
+            nodes.append(("WD_Per_{}".format(index), attr))
+        self.upsert_nodes(nodes)
 
         for node in self.p_nodes.keys():
             self.__create_node(df, "Person", node)
 
     def __expand_product(self, df):
         print("\t\tExpanding Nodes for Product")
+        keys = ['aliases', 'descriptions', 'labels']
+        nodes = []
         for index, row in df.iterrows():
-            self.graph.add_node("WD_Pro_{}".format(index),
-                                id=index, nlabel='Product', label=row['label'],
-                                inception=row['inception'],
-                                license=row['license'], source='Wikidata')
-
-            keys = ['aliases', 'descriptions', 'labels']
-
-            self.graph.add_nodes_from([("WD_Pro_{}".format(index),
-                                       {key.lower(): row[key].split(';')
-                                       for key in keys
-                                       if not isinstance(row[key], float)
-                                        })])
-            self.graph.add_nodes_from([("WD_Pro_{}".format(index),
-                                       {key.lower(): row[key] for key in keys
-                                       if isinstance(row[key], float)
-                                        })])
+            attr = {'id': index, 'nlabel': 'Product', 'label': row['label'],
+                    'inception': row['inception'], 'license': row['license'],
+                    'source': 'Wikidata'}
+            attr.update(list_values(row, keys))
+            nodes.append(("WD_Pro_{}".format(index), attr))
+        self.upsert_nodes(nodes)
 
     def expand_nodes(self, df, node):
-        ids = self.__find_ids(node)
+        ids = self.__find_ids(df, node)
         print("\t\t{} nodes will be expanded out of {}".format(
-                len(ids & set(df.index)), len(ids)))
+                len(ids), len(self.graph.pending_nodes(node))))
         if node == 'Person':
-            self.__expand_person(df.loc[ids & set(df.index)])
+            self.__expand_person(df.loc[ids])
         elif node == 'Product':
-            self.__expand_product(df.loc[ids & set(df.index)])
+            self.__expand_product(df.loc[ids])
         else:
-            self.__expand_node(df.loc[ids & set(df.index)], node)
+            self.__expand_node(df.loc[ids], node)
 
     def export_unlabeled_ids(self):
         nodes = self._NetworkxImporter__get_nodes_values('nlabel')
@@ -211,4 +253,4 @@ class WD_NetworkxImporter(NetworkxImporter):
         print('\n\tUnlabeled Nodes:')
         for i, node in enumerate(nodes):
             print("\t\tUnlabeled Wikidata {} Nodes: {:,}".format(node,
-                            self.__get_unlabeled_nodes_statistics(node, i)))
+                            self.__get_unlabeled_nodes_statistics(node)))